@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""Benchmark of a distributed import, with local worker processes
+
+A tree is generated (see gentree.py) unless one is given, then imported
+with distribute_tree and import_worker processes, all against the mongod
+at --db, for each number of workers given.  The volume 'benchmark' is
+replaced.
+
+    python benchmarks/distributed.py [--db host:port] [--tree DIR] [1 2 4]
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+import gentree
+from cadfael.conf import settings, load_modules
+from cadfael.core import storage, utils
+
+
+VOLUME = 'benchmark'
+
+
+def run(top, nworkers):
+    """import top with nworkers, returning (summary, seconds)"""
+    from cadfael.core.distributed import distribute_tree, import_worker
+    from cadfael.core.distributed import work_queue
+    from cadfael.modules.inode import import_directory
+    utils.create_volume(VOLUME)
+    result = {}
+    start = time.time()
+    coordinator = threading.Thread(
+        target=lambda: result.update(distribute_tree(VOLUME, top))
+    )
+    coordinator.start()
+    while work_queue().outstanding(VOLUME) == 0 and coordinator.is_alive():
+        time.sleep(0.01) # wait for the tree to be published
+    workers = multiprocessing.Process(
+        target=import_worker, args=(import_directory, None, nworkers, True)
+    )
+    workers.start()
+    coordinator.join()
+    workers.join()
+    return result, time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('benchmark distributed imports')
+    parser.add_argument(
+        '--db', dest='dbaddr', default=settings.DBADDR, help='mongod address'
+    )
+    parser.add_argument(
+        '--tree', default=None, help='import this rather than generating one'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        'workers', type=int, nargs='*', default=[1, 2, 4],
+        help='numbers of workers to run with'
+    )
+    args = parser.parse_args()
+
+    load_modules()
+    settings.DBADDR = args.dbaddr
+    settings.STORAGE = storage.connect(settings.DBADDR, connect=False)
+
+    tmp = None
+    top = args.tree
+    if top is None:
+        tmp = tempfile.mkdtemp()
+        top = os.path.join(tmp, 'tree')
+        print(gentree.generate(top, seed=args.seed))
+    try:
+        for nworkers in args.workers:
+            summary, elapsed = run(top, nworkers)
+            inodes = summary['dirs'] + summary['files'] + summary['links']
+            print('%3u workers %8u inodes %10.1f inodes/s %8.2f MB/s' % (
+                nworkers, inodes, inodes / elapsed,
+                summary['bytes'] / elapsed / 1e6
+            ))
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
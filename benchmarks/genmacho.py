@@ -0,0 +1,334 @@
+#!/usr/bin/python
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""Generate synthetic Mach-O binaries for benchmarking
+
+The binaries are only good enough for cadfael to analyse; a mach header,
+__TEXT segment with __cstring and __objc_methname sections, a symbol table,
+uuid, dylibs and optionally a code signature.  Thin or fat; or a dyld
+shared cache of --cache N unsigned images, split across --subcaches N
+subcaches written alongside out.
+
+    python benchmarks/genmacho.py [--fat | --cache N [--subcaches N]]
+                                  [--nsyms N] [--nstrings N] out
+"""
+from __future__ import unicode_literals, print_function
+
+import random
+import struct
+import argparse
+
+
+# from <mach/machine.h>
+CPU_TYPE_X86_64 = 0x01000007
+CPU_TYPE_ARM64 = 0x0100000c
+
+# from <mach-o/loader.h>
+MH_MAGIC_64 = 0xfeedfacf
+MH_EXECUTE = 2
+LC_SYMTAB = 0x2
+LC_LOAD_DYLIB = 0xc
+LC_SEGMENT_64 = 0x19
+LC_UUID = 0x1b
+LC_CODE_SIGNATURE = 0x1d
+FAT_MAGIC = 0xcafebabe
+
+# unslid address of a synthetic shared cache, and of each subcache after
+CACHE_ADDRESS = 0x7ff800000000
+SUBCACHE_STRIDE = 0x40000000
+
+ENTITLEMENTS = b'''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+	<key>com.apple.security.app-sandbox</key>
+	<true/>
+	<key>keychain-access-groups</key>
+	<array>
+		<string>ABCDE12345.com.example</string>
+	</array>
+</dict>
+</plist>
+'''
+
+
+def align(n, alignment=8):
+    """round n up to alignment"""
+    return (n + alignment - 1) & ~(alignment - 1)
+
+
+def cstrings(strings):
+    """pack a list of bytes as nul terminated strings"""
+    return b''.join(s + b'\0' for s in strings)
+
+
+def signature(identifier, team_id=None, entitlements=ENTITLEMENTS):
+    """generate a code signing superblob; code hashes are left out"""
+    ident = identifier + b'\0'
+    team = team_id + b'\0' if team_id is not None else b''
+    cd = struct.pack(
+        '>IIIIIIIIIBBBBIII',
+        0xfade0c02, 52 + len(ident) + len(team), 0x20400, 0x10000,
+        0, 52, 0, 0, 0, 32, 2, 0, 12, 0, 0,
+        52 + len(ident) if team_id is not None else 0
+    ) + ident + team
+    blobs = [(0, cd)]
+    if entitlements is not None:
+        blobs.append((
+            5,
+            struct.pack('>II', 0xfade7171, 8 + len(entitlements)) +
+            entitlements
+        ))
+    offset = 12 + 8 * len(blobs)
+    index = b''
+    data = b''
+    for slot, blob in blobs:
+        index += struct.pack('>II', slot, offset + len(data))
+        data += blob
+    return struct.pack(
+        '>III', 0xfade0cc0, offset + len(data), len(blobs)
+    ) + index + data
+
+
+def macho(nsyms=1000, nstrings=1000, ndylibs=8, cputype=CPU_TYPE_X86_64,
+          signed=True, seed=0, base=0, entitlements=ENTITLEMENTS):
+    """generate a thin 64bit little endian mach-o
+
+    The file offsets in its load commands are base more than they'd be;
+    for an image in a shared cache, where they're relative to the cache.
+    If signed, entitlements is the signature's entitlements blob (None for
+    none).
+    """
+    rnd = random.Random(seed)
+
+    def word(n):
+        return ''.join(
+            rnd.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(n)
+        ).encode('utf-8')
+
+    # content
+    names = [b'_' + word(rnd.randint(6, 40)) for _ in range(nsyms)]
+    strings = cstrings([word(rnd.randint(4, 60)) for _ in range(nstrings)])
+    methnames = cstrings(
+        [word(rnd.randint(4, 20)) + b':' for _ in range(nsyms // 4)]
+    )
+    dylibs = [b'/usr/lib/lib%s.dylib' % word(8) for _ in range(ndylibs)]
+    sig = None
+    if signed:
+        sig = signature(b'com.example.' + word(8), b'ABCDE12345', entitlements)
+
+    # load commands; everything's sized up front so offsets can be known
+    dylib_cmds = [
+        (align(24 + len(d) + 1), d) for d in dylibs
+    ]
+    sizeofcmds = (72 + 2 * 80) + 24 + 24 + sum(s for s, _ in dylib_cmds)
+    if sig is not None:
+        sizeofcmds += 16
+    ncmds = 3 + len(dylibs) + (1 if sig is not None else 0)
+    cstring_off = align(32 + sizeofcmds, 16)
+    methname_off = cstring_off + len(strings)
+    symoff = align(methname_off + len(methnames))
+    stroff = symoff + 16 * nsyms
+    string_table = b'\0'
+    nlists = b''
+    for i, name in enumerate(names):
+        n_type = 0x01 if i % 3 == 0 else 0x0f # undefined, external in sect
+        nlists += struct.pack(
+            '<IBBHQ', len(string_table), n_type, 0 if n_type == 1 else 1,
+            0, 0x100000000 + i * 16
+        )
+        string_table += name + b'\0'
+    sigoff = align(stroff + len(string_table), 16)
+    end = sigoff + (len(sig) if sig is not None else 0)
+
+    cmds = struct.pack(
+        '<II16sQQQQiiII', LC_SEGMENT_64, 72 + 2 * 80, b'__TEXT',
+        0x100000000, align(end, 4096), base, end, 5, 5, 2, 0
+    )
+    cmds += struct.pack(
+        '<16s16sQQIIIIIIII', b'__cstring', b'__TEXT', 0, len(strings),
+        base + cstring_off, 0, 0, 0, 2, 0, 0, 0
+    )
+    cmds += struct.pack(
+        '<16s16sQQIIIIIIII', b'__objc_methname', b'__TEXT', 0,
+        len(methnames), base + methname_off, 0, 0, 0, 2, 0, 0, 0
+    )
+    cmds += struct.pack(
+        '<IIIIII', LC_SYMTAB, 24, base + symoff, nsyms, base + stroff,
+        len(string_table)
+    )
+    cmds += struct.pack('<II', LC_UUID, 24) + bytes(bytearray(
+        rnd.randint(0, 255) for _ in range(16)
+    ))
+    for size, d in dylib_cmds:
+        cmds += struct.pack(
+            '<IIIIII', LC_LOAD_DYLIB, size, 24, 2, 0x10000, 0x10000
+        ) + d.ljust(size - 24, b'\0')
+    if sig is not None:
+        cmds += struct.pack(
+            '<IIII', LC_CODE_SIGNATURE, 16, base + sigoff, len(sig)
+        )
+    assert len(cmds) == sizeofcmds
+
+    data = struct.pack(
+        '<IiiIIIII', MH_MAGIC_64, cputype, 3, MH_EXECUTE, ncmds, sizeofcmds,
+        0, 0
+    ) + cmds
+    data = data.ljust(cstring_off, b'\0') + strings + methnames
+    data = data.ljust(symoff, b'\0') + nlists + string_table
+    if sig is not None:
+        data = data.ljust(sigoff, b'\0') + sig
+    return data
+
+
+def fat(slices):
+    """generate a fat binary from a list of (cputype, thin mach-o)"""
+    offset = 4096
+    archs = b''
+    data = b''
+    for cputype, thin in slices:
+        archs += struct.pack(
+            '>iiIII', cputype, 3, offset + len(data), len(thin), 12
+        )
+        data += thin.ljust(align(len(thin), 4096), b'\0')
+    header = struct.pack('>II', FAT_MAGIC, len(slices)) + archs
+    return header.ljust(offset, b'\0') + data
+
+
+def cache_header(mapping_offset, mapping_count, uuid, images=(0, 0),
+                 subcaches=(0, 0), symbols_uuid=b'\0' * 16):
+    """generate a dyld_cache_header, padded to mapping_offset
+
+    images and subcaches are the (offset, count) of the image infos and
+    subcache entries.
+    """
+    header = bytearray(mapping_offset)
+    struct.pack_into(
+        '<16sIIIIQ', header, 0, b'dyld_v1  x86_64', mapping_offset,
+        mapping_count, 0, 0, CACHE_ADDRESS
+    )
+    struct.pack_into('<16s', header, 0x58, uuid)
+    struct.pack_into('<II16s', header, 0x188, subcaches[0], subcaches[1],
+                     symbols_uuid)
+    struct.pack_into('<II', header, 0x1c0, images[0], images[1])
+    return bytes(header)
+
+
+def split_cache(count, subcaches=0, nsyms=1000, nstrings=1000, seed=0,
+                v1=False):
+    """generate a dyld shared cache of count images, as [(suffix, data)]
+
+    The main cache's suffix is ''.  It lists all the images, but they're
+    dealt out between it and its subcaches, each file having one mapping
+    of its own.  Subcaches are suffixed .01, .02 ... as from macOS 13, or
+    .1, .2 ... with the older header and entries if v1; and if there are
+    any, there's also an (empty) .symbols file.
+    """
+    mapping_offset = 0x1c8 if v1 else 0x1d0
+    entry_size = 24 if v1 else 56
+    paths = [
+        b'/usr/lib/libcadfael%u.dylib' % i for i in range(count)
+    ]
+    nfiles = subcaches + 1
+    suffixes = [''] + [
+        ('.%u' if v1 else '.%02u') % i for i in range(1, nfiles)
+    ]
+    uuids = [struct.pack('<QQ', seed, i) for i in range(nfiles + 1)]
+
+    # the main cache has the image infos, their paths and the subcache
+    # entries after its mapping; the images are in the pages after that
+    images_off = mapping_offset + 32
+    paths_off = images_off + 32 * count
+    subcaches_off = paths_off + len(cstrings(paths))
+    starts = [align(subcaches_off + entry_size * subcaches, 4096)]
+    starts += [align(mapping_offset + 32, 4096)] * subcaches
+
+    addresses = [None] * count
+    contents = []
+    for n in range(nfiles):
+        offset = starts[n]
+        images = []
+        for i in range(n, count, nfiles):
+            image = macho(
+                nsyms, nstrings, signed=False, seed=seed + i, base=offset
+            )
+            addresses[i] = CACHE_ADDRESS + n * SUBCACHE_STRIDE + offset
+            images.append(image.ljust(align(len(image), 4096), b'\0'))
+            offset += len(images[-1])
+        contents.append((offset, b''.join(images)))
+
+    retval = []
+    infos = b''
+    path_off = paths_off
+    for path, address in zip(paths, addresses):
+        infos += struct.pack('<QQQII', address, 0, 0, path_off, 0)
+        path_off += len(path) + 1
+    entries = b''
+    for n in range(1, nfiles):
+        entries += struct.pack('<16sQ', uuids[n], n * SUBCACHE_STRIDE)
+        if not v1:
+            entries += struct.pack('<32s', suffixes[n].encode('utf-8'))
+    for n, (size, images) in enumerate(contents):
+        mapping = struct.pack(
+            '<QQQII', CACHE_ADDRESS + n * SUBCACHE_STRIDE, size, 0, 5, 5
+        )
+        if n == 0:
+            header = cache_header(
+                mapping_offset, 1, uuids[n], (images_off, count),
+                (subcaches_off, subcaches),
+                uuids[nfiles] if subcaches > 0 else b'\0' * 16
+            ) + mapping + infos + cstrings(paths) + entries
+        else:
+            header = cache_header(mapping_offset, 1, uuids[n]) + mapping
+        retval.append((suffixes[n], header.ljust(starts[n], b'\0') + images))
+    if subcaches > 0:
+        retval.append(
+            ('.symbols', cache_header(mapping_offset, 0, uuids[nfiles]))
+        )
+    return retval
+
+
+def shared_cache(count, nsyms=1000, nstrings=1000, seed=0):
+    """generate a dyld shared cache of count images, all in one mapping
+
+    The header is laid out as from macOS 11 on, with the images' infos at
+    imagesOffset rather than imagesOffsetOld.
+    """
+    return split_cache(count, 0, nsyms, nstrings, seed, v1=True)[0][1]
+
+
+def generate(nsyms=1000, nstrings=1000, is_fat=False, seed=0):
+    """generate a thin (x86_64) or fat (x86_64 and arm64) mach-o"""
+    thin = macho(nsyms, nstrings, seed=seed)
+    if not is_fat:
+        return thin
+    return fat([
+        (CPU_TYPE_X86_64, thin),
+        (CPU_TYPE_ARM64,
+         macho(nsyms, nstrings, cputype=CPU_TYPE_ARM64, seed=seed + 1))
+    ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('generate a synthetic mach-o')
+    parser.add_argument('--fat', action='store_true', help='x86_64 and arm64')
+    parser.add_argument(
+        '--cache', type=int, default=None, help='a shared cache of N images'
+    )
+    parser.add_argument(
+        '--subcaches', type=int, default=0, help='with --cache; subcaches'
+    )
+    parser.add_argument('--nsyms', type=int, default=10000)
+    parser.add_argument('--nstrings', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('out', help='file to write')
+    args = parser.parse_args()
+    if args.cache is not None:
+        for suffix, data in split_cache(
+                args.cache, args.subcaches, args.nsyms, args.nstrings,
+                args.seed):
+            with open(args.out + suffix, 'wb') as f:
+                f.write(data)
+    else:
+        with open(args.out, 'wb') as f:
+            f.write(generate(args.nsyms, args.nstrings, args.fat, args.seed))
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""Generate a synthetic directory tree for benchmarking imports
+
+The tree is determined entirely by the parameters (and seed), so runs on
+different machines, or before and after a change, import the same thing.
+File sizes are lognormally distributed; a proportion of the files are
+hardlinks to, or symlinks at, earlier files and a proportion are synthetic
+Mach-O binaries (see genmacho.py).
+
+    python benchmarks/gentree.py [--fanout N] [--depth N] [--files N] out
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import random
+import struct
+import argparse
+
+import genmacho
+
+
+# largest regular file generated, whatever the distribution says
+MAX_SIZE = 64 * 1024 * 1024
+
+# size of the random block file content is cut from
+BLOCK = 1024 * 1024
+
+
+def content(rnd, block, index, size):
+    """generate size bytes of content, unique to index"""
+    data = struct.pack('<Q', index)
+    while len(data) < size:
+        offset = rnd.randint(0, BLOCK - 1)
+        data += block[offset:offset+size-len(data)]
+    return data[:size]
+
+
+def generate(top, fanout=4, depth=3, files=16, mu=8.0, sigma=2.0,
+             hardlinks=0.05, symlinks=0.02, macho=0.02, nsyms=2000,
+             seed=0):
+    """generate a tree at top, returning a count of what was created
+
+    Each directory has fanout subdirectories, down to depth, and files
+    entries; mu and sigma parameterise the lognormal distribution of file
+    sizes (so the median size is e**mu bytes).  hardlinks, symlinks and
+    macho are the proportion of entries which are each of those.
+    """
+    rnd = random.Random(seed)
+    block = bytes(bytearray(rnd.getrandbits(8) for _ in range(BLOCK)))
+    counts = {
+        'dirs': 0,
+        'files': 0,
+        'hardlinks': 0,
+        'symlinks': 0,
+        'macho': 0,
+        'bytes': 0
+    }
+    created = [] # regular files, for links to point at
+    todo = [(top, 0)]
+    while len(todo) > 0:
+        path, level = todo.pop()
+        os.makedirs(path)
+        counts['dirs'] += 1
+        for i in range(files):
+            name = os.path.join(path, 'f%04u' % i)
+            r = rnd.random()
+            if len(created) > 0 and r < hardlinks:
+                os.link(rnd.choice(created), name)
+                counts['hardlinks'] += 1
+            elif len(created) > 0 and r < hardlinks + symlinks:
+                target = rnd.choice(created)
+                os.symlink(os.path.relpath(target, path), name)
+                counts['symlinks'] += 1
+            else:
+                if r < hardlinks + symlinks + macho:
+                    data = genmacho.generate(
+                        nsyms, nsyms, rnd.random() < 0.5, len(created)
+                    )
+                    counts['macho'] += 1
+                else:
+                    size = int(min(rnd.lognormvariate(mu, sigma), MAX_SIZE))
+                    data = content(rnd, block, len(created), size)
+                with open(name, 'wb') as f:
+                    f.write(data)
+                created.append(name)
+                counts['files'] += 1
+                counts['bytes'] += len(data)
+        if level < depth:
+            for i in range(fanout):
+                todo.append((os.path.join(path, 'd%02u' % i), level + 1))
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('generate a synthetic directory tree')
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--files', type=int, default=16, help='per dir')
+    parser.add_argument('--mu', type=float, default=8.0, help='log size')
+    parser.add_argument('--sigma', type=float, default=2.0)
+    parser.add_argument('--hardlinks', type=float, default=0.05)
+    parser.add_argument('--symlinks', type=float, default=0.02)
+    parser.add_argument('--macho', type=float, default=0.02)
+    parser.add_argument('--nsyms', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('out', help='dir to create')
+    args = parser.parse_args()
+    print(generate(
+        args.out, args.fanout, args.depth, args.files, args.mu, args.sigma,
+        args.hardlinks, args.symlinks, args.macho, args.nsyms, args.seed
+    ))
@@ -0,0 +1,71 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""In-memory stand-in for the cadfael database
+
+Accepts everything an import does to the DB and throws it away, after
+encoding it as BSON (as pymongo would before sending it).  Lookups never
+find anything, so every inode and analysis is treated as new.  This takes
+mongod out of a benchmark, leaving only cadfael's own costs.
+"""
+from __future__ import unicode_literals, print_function
+
+import bson
+
+
+class NullCollection(object):
+    """A collection which counts, but doesn't keep, what's written"""
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def encode(self, filter, update):
+        """count an update, encoded as it would be sent"""
+        self.writes += 1
+        self.bytes += len(bson.BSON.encode({ 'q': filter, 'u': update }))
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            self.encode(op._filter, op._doc) # pylint: disable=W0212
+
+    def update_one(self, filter, update, upsert=False):
+        self.encode(filter, update)
+
+    def update_many(self, filter, update, upsert=False):
+        pass
+
+    def delete_many(self, filter):
+        pass
+
+    def create_index(self, keys, **kwargs):
+        pass
+
+    def find_one(self, *args, **kwargs):
+        return None
+
+    def find(self, *args, **kwargs):
+        return iter(())
+
+
+class NullDatabase(object):
+    """A database of NullCollections, created on first use"""
+
+    def __getattr__(self, name):
+        collection = NullCollection()
+        setattr(self, name, collection)
+        return collection
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+class NullClient(object):
+    """Stands in for MongoClient; every database is a NullDatabase"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        db = NullDatabase()
+        setattr(self, name, db)
+        return db
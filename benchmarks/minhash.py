@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""Micro-benchmark of MinHash sketching
+
+Times similarity.hash_features against hashing and unpacking each feature
+on its own, and the whole of similarity.sketch, over synthetic symbol sets
+the size of a binary's; reporting features hashed per second.
+
+    python benchmarks/minhash.py [nfeatures]
+"""
+from __future__ import unicode_literals, print_function
+
+import sys
+import time
+import random
+import struct
+import hashlib
+
+from cadfael.conf import settings
+from cadfael.core import similarity
+
+
+def make_features(nfeatures):
+    """generate a dict of named sets, nfeatures strings in total"""
+    rnd = random.Random(nfeatures)
+    features = { 'local': set(), 'undef': set(), 'strings': set() }
+    names = sorted(features.keys())
+    for i in range(nfeatures):
+        features[names[i % len(names)]].add(
+            '_sym%u_%s' % (i, 'x' * rnd.randint(4, 40))
+        )
+    return features
+
+
+def per_feature(features):
+    """md5 of the concatenated name and value, unpacked one at a time"""
+    retval = []
+    for name, values in features.items():
+        prefix = ('%s:' % name).encode('utf-8')
+        for value in values:
+            if not isinstance(value, bytes):
+                value = value.encode('utf-8', 'backslashreplace')
+            retval.append(struct.unpack(
+                '<Q', hashlib.md5(prefix + value).digest()[:8]
+            )[0])
+    return tuple(retval)
+
+
+def timeit(func, *args, **kwargs):
+    """time a single call of func"""
+    start = time.time()
+    retval = func(*args, **kwargs)
+    return time.time() - start, retval
+
+
+def rate(n, seconds):
+    """format n per seconds, in thousands a second"""
+    return '%7.0fk/s' % (n / max(seconds, 1e-9) / 1000.0)
+
+
+if __name__ == '__main__':
+    settings.MINHASH = True # off by default
+    for n in [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]:
+        features = make_features(n)
+        told, old = timeit(per_feature, features)
+        tnew, new = timeit(similarity.hash_features, features)
+        tsketch, _ = timeit(similarity.sketch, **features)
+        assert old == new
+        print('%7u features: per feature %s  hash_features %s  sketch %s' % (
+            n, rate(n, told), rate(n, tnew), rate(n, tsketch)
+        ))
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""Benchmark of cadfael-query's searches on a populated volume
+
+Values to search for are sampled from the analyses in the db, then each
+kind of query is run for each of them and the latency to the first result,
+and to the last, is reported.  With --compare the searches are run without
+the query indexes first, then again once they've been created.
+
+If the volume is empty a tree is generated (see gentree.py), with mostly
+Mach-O files, and imported into it first; or --tree is imported.  Queries
+need mongo, so --db must be a mongod.
+
+    python benchmarks/query.py [--db host:port] [--volume NAME] [--tree DIR]
+                               [--samples N] [--compare]
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from pymongo.errors import OperationFailure
+
+import gentree
+from cadfael.conf import settings, load_modules
+from cadfael.core import storage, utils
+from cadfael.core.query import search
+
+
+def populate(volname, top=None, seed=0):
+    """import top, or a generated tree, into volname"""
+    from cadfael.modules.inode import import_tree
+    tmp = None
+    if top is None:
+        tmp = tempfile.mkdtemp()
+        top = os.path.join(tmp, 'tree')
+        print(gentree.generate(top, macho=0.5, seed=seed))
+    try:
+        utils.create_volume(volname)
+        summary = import_tree(volname, top)
+        print('imported %u files' % summary['files'])
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+
+
+def samples(db, count, seed=0):
+    """get up to count values to search for, of each kind, from analyses"""
+    rnd = random.Random(seed)
+    retval = { 'imports': [], 'dylib': [], 'entitlement': [], 'sha256': [] }
+    for doc in db.analyses.find(
+            {},
+            {
+                'sha256': True, 'dylibs': True, 'symbols.undef': True,
+                'entitlements.name': True
+            }).limit(count * 4):
+        retval['sha256'].append(doc['sha256'])
+        undef = (doc.get('symbols') or {}).get('undef') or []
+        if len(undef) > 0:
+            retval['imports'].append(rnd.choice(undef))
+        if len(doc.get('dylibs') or []) > 0:
+            retval['dylib'].append(rnd.choice(doc['dylibs']))
+        if len(doc.get('entitlements') or []) > 0:
+            retval['entitlement'].append(
+                rnd.choice(doc['entitlements'])['name']
+            )
+    for kind, values in retval.items():
+        rnd.shuffle(values)
+        retval[kind] = values[:count]
+    return retval
+
+
+def run(db, volname, kind, values):
+    """time each search; returning (first, last, results) for each"""
+    retval = []
+    for value in values:
+        start = time.time()
+        first = None
+        results = 0
+        for _ in search(db, kind, value, volname=volname):
+            if first is None:
+                first = time.time() - start
+            results += 1
+        last = time.time() - start
+        retval.append((first if first is not None else last, last, results))
+    return retval
+
+
+def percentile(values, p):
+    """get the pth percentile of values"""
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+def drop_indexes(db):
+    """drop the indexes cadfael-query uses, leaving those imports do"""
+    for name, field in storage.QUERY_INDEXES:
+        try:
+            db[name].drop_index('%s_1' % field)
+        except OperationFailure:
+            pass # not there
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('benchmark cadfael-query')
+    parser.add_argument(
+        '--db', dest='dbaddr', default=settings.DBADDR, help='mongod address'
+    )
+    parser.add_argument('--volume', default='benchmark')
+    parser.add_argument(
+        '--tree', default=None, help='import this if the volume is empty'
+    )
+    parser.add_argument(
+        '--samples', type=int, default=50,
+        help='number of values searched for, of each kind'
+    )
+    parser.add_argument(
+        '--compare', action='store_true',
+        help='run without the query indexes too'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    load_modules()
+    settings.DBADDR = args.dbaddr
+    settings.STORAGE = storage.connect(settings.DBADDR, connect=False)
+    db = settings.STORAGE.db
+    if db is None:
+        parser.error('--db must be the address of a mongod')
+
+    if db.inodes.count_documents({ 'dev': args.volume }) == 0:
+        populate(args.volume, args.tree, args.seed)
+    values = samples(db, args.samples, args.seed)
+    passes = [('indexed', settings.STORAGE.create_indexes)]
+    if args.compare:
+        passes.insert(0, ('unindexed', lambda: drop_indexes(db)))
+    for label, prepare in passes:
+        prepare()
+        for kind in sorted(values):
+            if len(values[kind]) == 0:
+                continue
+            timings = run(db, args.volume, kind, values[kind])
+            firsts = [t[0] * 1000 for t in timings]
+            lasts = [t[1] * 1000 for t in timings]
+            print(
+                '%-9s %-11s %4u queries %8.1f results  first %8.2f ms p50 '
+                '%8.2f ms p95  all %8.2f ms p50 %8.2f ms p95' % (
+                    label, kind, len(timings),
+                    sum(t[2] for t in timings) / float(len(timings)),
+                    percentile(firsts, 50), percentile(firsts, 95),
+                    percentile(lasts, 50), percentile(lasts, 95)
+                )
+            )
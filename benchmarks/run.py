@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""Benchmark of importing a synthetic tree, stage by stage
+
+A tree is generated (see gentree.py) unless one is given, then each stage
+is run over it in a fresh process, so that each has its own peak RSS:
+
+    walk    list_tree over the tree
+    hash    sha256_file of each regular file
+    macho   x-mach-binary's get_info and get_signature of each Mach-O
+    inode   get_inode of each entry, serially in one process
+    import  import_tree, as cadfael-ctrl runs it
+
+For each stage files/s, MB/s and the peak RSS of the stage (and of any pool
+workers it ran) are reported.  By default the database is an in-memory
+stand-in (see memdb.py) so only cadfael's own costs are measured; give
+--db host:port to use a real mongod, or --db sqlite:path to use sqlite.
+The volume 'benchmark' is replaced.
+
+    python benchmarks/run.py [--db memory|host:port|sqlite:path] [--tree DIR]
+                             [--stages walk,hash,...] [--json FILE]
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import stat
+import json
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import traceback
+import importlib
+import multiprocessing
+
+import memdb
+import gentree
+from cadfael.conf import settings, load_modules
+from cadfael.core import utils, storage
+
+
+STAGES = ['walk', 'hash', 'macho', 'inode', 'import']
+
+VOLUME = 'benchmark'
+
+# first 4 bytes of the Mach-O files gentree creates (thin, fat)
+MACHO_MAGIC = (b'\xcf\xfa\xed\xfe', b'\xca\xfe\xba\xbe')
+
+
+def setup(dbaddr):
+    """load the modules and connect to the db, as cadfael-ctrl would"""
+    load_modules()
+    if dbaddr == 'memory':
+        # fork() creates the workers' connections with this too
+        storage.MongoClient = memdb.NullClient
+    else:
+        settings.DBADDR = dbaddr
+    utils.fork()
+
+
+def entries(top):
+    """get everything list_tree yields for top"""
+    from cadfael.modules.inode import list_tree
+    return list(list_tree(VOLUME, top))
+
+
+def regular_files(top):
+    """get the path and size of each regular file under top"""
+    retval = []
+    for entry in entries(top):
+        st = os.lstat(entry[2])
+        if len(entry) == 4 and stat.S_ISREG(st.st_mode):
+            retval.append((entry[2], st.st_size))
+    return retval
+
+
+def stage_walk(top):
+    """time list_tree"""
+    start = time.time()
+    count = len(entries(top))
+    return count, 0, time.time() - start
+
+
+def stage_hash(top):
+    """time sha256_file of every regular file"""
+    from cadfael.modules.inode import sha256_file
+    files = regular_files(top)
+    start = time.time()
+    for path, _ in files:
+        sha256_file(path)
+    return len(files), sum(size for _, size in files), time.time() - start
+
+
+def stage_macho(top):
+    """time x-mach-binary's parsing of every Mach-O"""
+    macho = importlib.import_module('cadfael.modules.x-mach-binary')
+    files = []
+    for path, size in regular_files(top):
+        with open(path, 'rb') as f:
+            if f.read(4) in MACHO_MAGIC:
+                files.append((path, size))
+    start = time.time()
+    for path, _ in files:
+        try:
+            macho.get_info(path)
+        except ValueError:
+            pass # malformed; still parsed as far as it goes
+        macho.get_signature(path)
+    return len(files), sum(size for _, size in files), time.time() - start
+
+
+def stage_inode(top):
+    """time get_inode of every entry, without a pool"""
+    from cadfael.modules.inode import get_inode
+    utils.create_volume(VOLUME)
+    args = entries(top)
+    size = 0
+    start = time.time()
+    for arg in args:
+        inode = get_inode(arg)
+        if len(arg) == 4 and inode['fmt'] == '-':
+            size += inode['size'] # content counted at first link
+    settings.WRITER.flush()
+    settings.ANALYSIS_WRITER.flush()
+    return len(args), size, time.time() - start
+
+
+def stage_import(top):
+    """time import_tree"""
+    from cadfael.modules.inode import import_tree
+    utils.create_volume(VOLUME)
+    start = time.time()
+    summary = import_tree(VOLUME, top)
+    elapsed = time.time() - start
+    count = summary['dirs'] + summary['files'] + summary['links']
+    return count, summary['bytes'], elapsed, summary['stats']['stages']
+
+
+def maxrss(who):
+    """peak rss, in MB, of this process or its (waited for) children"""
+    rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 1e6 # bytes
+    return rss / 1e3 # kilobytes
+
+
+def run_stage(name, top, dbaddr, results):
+    """process; run a stage, putting its result (or error) on results"""
+    try:
+        setup(dbaddr)
+        retval = globals()['stage_' + name](top)
+    except Exception: # pylint: disable=W0703
+        results.put({ 'stage': name, 'error': traceback.format_exc() })
+        return
+    count, size, elapsed = retval[:3]
+    results.put({
+        'stage': name,
+        'count': count,
+        'bytes': size,
+        'seconds': elapsed,
+        'files_per_sec': count / max(elapsed, 1e-6),
+        'mb_per_sec': size / max(elapsed, 1e-6) / 1e6,
+        'rss_mb': maxrss(resource.RUSAGE_SELF),
+        'workers_rss_mb': maxrss(resource.RUSAGE_CHILDREN),
+        'stages': retval[3] if len(retval) > 3 else None
+    })
+
+
+def run(top, dbaddr, stages):
+    """run each stage in its own process, returning the results"""
+    retval = []
+    for name in stages:
+        results = multiprocessing.Queue()
+        p = multiprocessing.Process(
+            target=run_stage, args=(name, top, dbaddr, results)
+        )
+        p.start()
+        result = results.get()
+        p.join()
+        if 'error' in result:
+            raise RuntimeError('%s failed:\n%s' % (name, result['error']))
+        retval.append(result)
+        print(
+            '%-8s %8u files %10.1f files/s %8.2f MB/s %8.1f MB rss '
+            '%8.1f MB worker rss' % (
+                name, result['count'], result['files_per_sec'],
+                result['mb_per_sec'], result['rss_mb'],
+                result['workers_rss_mb']
+            )
+        )
+    return retval
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('benchmark imports stage by stage')
+    parser.add_argument(
+        '--db', dest='dbaddr', default='memory',
+        help='db address e.g. %s or sqlite:path, or memory' % settings.DBADDR
+    )
+    parser.add_argument(
+        '--tree', default=None, help='import this rather than generating one'
+    )
+    parser.add_argument(
+        '--stages', default=','.join(STAGES),
+        help='comma separated stages to run, from %s' % ','.join(STAGES)
+    )
+    parser.add_argument('--json', default=None, help='write results here')
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--files', type=int, default=16, help='per dir')
+    parser.add_argument('--macho', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # the workers are handed the settings, but only forked ones inherit the
+    # in-memory db's patch of storage (see setup)
+    if (args.dbaddr == 'memory' and
+            hasattr(multiprocessing, 'set_start_method')):
+        multiprocessing.set_start_method('fork')
+
+    tmp = None
+    top = args.tree
+    if top is None:
+        tmp = tempfile.mkdtemp()
+        top = os.path.join(tmp, 'tree')
+        print(gentree.generate(
+            top, args.fanout, args.depth, args.files, macho=args.macho,
+            seed=args.seed
+        ))
+    if top[-1] != os.path.sep:
+        top += os.path.sep
+    try:
+        results = run(top, args.dbaddr, args.stages.split(','))
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""Benchmark of inode signal dispatch against the number of receivers
+
+Each receiver filters on a different mime type (like an analysis module
+would); dispatch is timed for a stream of inodes, using the indexed signal
+and by evaluating every receiver's filter in turn as Signal used to.
+
+    python benchmarks/signals.py [ninodes]
+"""
+from __future__ import unicode_literals, print_function
+
+import sys
+import time
+
+from cadfael.core import signals
+
+
+def make_signal(nreceivers):
+    """create an inode signal with nreceivers mime type receivers"""
+    signal = signals.Signal(index=('details__mime_type', 'fmt'))
+    for i in range(nreceivers):
+        signals.receiver(
+            signal, fmt='-', details__mime_type='application/x-type-%u' % i
+        )(lambda inode, path: None)
+    return signal
+
+
+def linear(signal, *args):
+    """dispatch by evaluating every receiver"""
+    for r in signal.receivers:
+        if r.filter(*args):
+            r.func(*args)
+
+
+def make_inodes(ninodes):
+    """inodes of a handful of types, one of which has a receiver"""
+    mime_types = [
+        'text/plain', 'application/octet-stream', 'image/png',
+        'application/x-type-0'
+    ]
+    return [
+        {
+            'fmt': '-',
+            'details': { 'mime_type': mime_types[i % len(mime_types)] }
+        }
+        for i in range(ninodes)
+    ]
+
+
+if __name__ == '__main__':
+    ninodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    inodes = make_inodes(ninodes)
+    for nreceivers in [1, 10, 100, 1000]:
+        signal = make_signal(nreceivers)
+        start = time.time()
+        for inode in inodes:
+            linear(signal, inode, None)
+        tlinear = time.time() - start
+        start = time.time()
+        for inode in inodes:
+            signal(inode, None)
+        tindexed = time.time() - start
+        print('%5u receivers: linear %6.2fus/inode  indexed %6.2fus/inode' % (
+            nreceivers,
+            tlinear * 1e6 / ninodes,
+            tindexed * 1e6 / ninodes
+        ))
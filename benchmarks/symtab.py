@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""Micro-benchmark of Mach-O symbol table decoding
+
+Compares x-mach-binary's get_symbols with the per-nlist decoder it
+replaced, over a synthetic nlist_64 table.
+
+    python benchmarks/symtab.py [nsyms]
+"""
+from __future__ import unicode_literals, print_function
+
+import io
+import sys
+import time
+import random
+import struct
+import ctypes
+import importlib
+
+xmach = importlib.import_module('cadfael.modules.x-mach-binary')
+
+
+class nlist_64(ctypes.Structure):
+    """64bit nlist structure"""
+    _fields_ = (
+        ('n_un', ctypes.c_uint32),
+        ('n_type', ctypes.c_uint8),
+        ('n_sect', ctypes.c_uint8),
+        ('n_desc', ctypes.c_uint16),
+        ('n_value', ctypes.c_uint64),
+    )
+
+
+def make_symtab(nsyms):
+    """generate (nlists, string_table) with nsyms symbols, 1/3 undefined"""
+    rnd = random.Random(nsyms)
+    string_table = bytearray(b'\0')
+    nlists = bytearray()
+    for i in range(nsyms):
+        name = ('_sym%u_%s' % (i, 'x' * rnd.randint(4, 40))).encode('utf-8')
+        n_type = 0x01 if i % 3 == 0 else 0x0f
+        nlists += struct.pack(
+            '<IBBHQ', len(string_table), n_type, 0 if n_type == 1 else 1, 0, i
+        )
+        string_table += name + b'\0'
+    return bytes(nlists), bytes(string_table)
+
+
+def legacy(nlists, nsyms, string_table):
+    """the old decoder; one readinto and one character at a time"""
+    local = set()
+    undef = set()
+    f = io.BytesIO(nlists)
+    for _ in range(0, nsyms):
+        nl = nlist_64()
+        f.readinto(nl)
+        s = ''
+        for c in bytearray(string_table[nl.n_un:]):
+            if c == 0:
+                break
+            s += chr(c)
+        if nl.n_type & 0x0e == 0:
+            undef.add(s)
+        else:
+            local.add(s)
+    return local, undef
+
+
+def bulk(nlists, nsyms, string_table):
+    """the array based decoder"""
+    local = set()
+    undef = set()
+    xmach.get_symbols(nlists, nsyms, True, '<', string_table, local, undef)
+    return local, undef
+
+
+def timeit(func, *args):
+    """time a single call of func"""
+    start = time.time()
+    retval = func(*args)
+    return time.time() - start, retval
+
+
+if __name__ == '__main__':
+    for nsyms in [int(a) for a in sys.argv[1:]] or [1000, 10000, 50000]:
+        nlists, string_table = make_symtab(nsyms)
+        told, old = timeit(legacy, nlists, nsyms, string_table)
+        tnew, new = timeit(bulk, nlists, nsyms, string_table)
+        assert old == new
+        print('%7u symbols: legacy %8.3fs  bulk %8.3fs  (%.0fx)' % (
+            nsyms, told, tnew, told / max(tnew, 1e-9)
+        ))
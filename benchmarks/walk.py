@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""Micro-benchmark of walking a tree
+
+Times scan_dir over every directory of a synthetic tree (see gentree.py)
+against listing them and stat'ing each regular file, as finding hardlinks
+by their link count would; and the whole of list_tree, serially and on
+several threads.  Reports entries listed per second; the first run warms
+the page cache, so each is run twice and the second timed.
+
+    python benchmarks/walk.py [--fanout N] [--depth N] [--files N]
+                              [--threads N] [--tree DIR]
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import gentree
+from cadfael.modules.inode import list_tree, scan_dir
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir # python 2
+
+
+def directories(top):
+    """get the path of every directory under top"""
+    retval = [top]
+    for path, dirs, _ in os.walk(top):
+        retval.extend(os.path.join(path, d) for d in dirs)
+    return retval
+
+
+def scan_all(dirs):
+    """scan_dir each directory; get the number of entries"""
+    return sum(len(scan_dir(path)) for path in dirs)
+
+
+def stat_all(dirs):
+    """list each directory, stat'ing its regular files"""
+    count = 0
+    for path in dirs:
+        for entry in scandir(path):
+            if entry.is_file(follow_symlinks=False):
+                entry.stat(follow_symlinks=False).st_nlink
+            count += 1
+    return count
+
+
+def walk(top, threads):
+    """list_tree top; get the number of entries"""
+    return sum(1 for _ in list_tree('benchmark', top, threads))
+
+
+def timeit(func, *args):
+    """time the second of two calls of func"""
+    func(*args)
+    start = time.time()
+    retval = func(*args)
+    return time.time() - start, retval
+
+
+def rate(n, seconds):
+    """format n per seconds, in thousands a second"""
+    return '%7.0fk/s' % (n / max(seconds, 1e-9) / 1000.0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark tree walking')
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--files', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--tree', help='walk this tree, not a synthetic one')
+    args = parser.parse_args()
+    tmp = None
+    top = args.tree
+    if top is None:
+        tmp = tempfile.mkdtemp()
+        top = os.path.join(tmp, 'tree')
+        gentree.generate(
+            top, args.fanout, args.depth, args.files, mu=4.0, sigma=1.0,
+            macho=0
+        )
+    top = os.path.join(top, '')
+    try:
+        dirs = directories(top)
+        for name, func, arg in [
+                ('scan_dir', scan_all, (dirs,)),
+                ('stat each file', stat_all, (dirs,)),
+                ('list_tree', walk, (top, 1)),
+                ('list_tree %u threads' % args.threads, walk,
+                 (top, args.threads))]:
+            seconds, n = timeit(func, *arg)
+            print('%-20s %8u entries %s' % (name, n, rate(n, seconds)))
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
@@ -4,12 +4,15 @@ from __future__ import unicode_literals, print_function
 
 import imp
 import argparse
-from pymongo import MongoClient
 
 import cadfael.core.settings
 import cadfael.core.signals
 
 
+# settings made by each process (see utils.fork), rather than handed on
+PER_PROCESS = set(['STORAGE', 'WRITER', 'ANALYSIS_WRITER'])
+
+
 class Settings(object):
     """Settings object, holds all the settings"""
 
@@ -18,13 +21,46 @@ class Settings(object):
         self.update(cadfael.core.settings)
 
     def update(self, module):
-        """updates settings with those from module"""
-        for item in dir(module):
+        """updates settings with those from module, or a dict of them"""
+        if not isinstance(module, dict):
+            module = dict(
+                (item, getattr(module, item)) for item in dir(module)
+            )
+        for item, value in module.items():
             if item.isupper():
-                setattr(self, item, getattr(module, item))
+                setattr(self, item, value)
+
+    def worker(self):
+        """get the settings to hand a worker process, as a dict
+
+        Workers which aren't forked (under spawn or forkserver) start with
+        the defaults; so they update with these, the parent's settings
+        (e.g. -s overrides) but those in PER_PROCESS.
+        """
+        return dict(
+            (item, value) for item, value in vars(self).items()
+            if item.isupper() and item not in PER_PROCESS
+        )
 
 settings = Settings()
 
+# true once load_modules has run
+loaded = False
+
+
+def load_modules():
+    """import settings.MODULES, then register settings.ANALYSERS"""
+    global loaded
+    if loaded:
+        return
+    loaded = True
+    for mod in settings.MODULES:
+        __import__(mod)
+    for name, target, filters in settings.ANALYSERS:
+        cadfael.core.signals.lazy_receiver(
+            getattr(cadfael.core.signals, name), target, **filters
+        )
+
 
 def argument_parser(desc, banner=True):
     """create argment parser with global options"""
@@ -38,7 +74,9 @@ def argument_parser(desc, banner=True):
     )
     parser.add_argument(
         '--db', dest='dbaddr', default=cadfael.core.settings.DBADDR,
-        help='address of database e.g. %s' % cadfael.core.settings.DBADDR
+        help='address of database e.g. %s, or sqlite:path for a local file' % (
+            cadfael.core.settings.DBADDR
+        )
     )
     parser.add_argument(
         '-s', '--settings', dest='settings', default=None,
@@ -60,15 +98,11 @@ def argument_parser(desc, banner=True):
             settings.update(mod)
         settings.DBADDR = args.dbaddr
 
-        # load all the modules
-        for mod in settings.MODULES:
-            __import__(mod)
+        load_modules()
 
-        # create the DB connection
-        db = settings.DBADDR.split(':')
-        db[1] = int(db[1])
-        # connect=False because: http://api.mongodb.com/python/current/faq.html#multiprocessing
-        settings.DB = MongoClient(db[0], db[1], connect=False).cadfael
+        # create the DB connection; imported here as storage needs settings
+        from cadfael.core.storage import connect
+        settings.STORAGE = connect(settings.DBADDR, connect=False)
 
         cadfael.core.signals.parse_args(args)
         # ready to run - print banner
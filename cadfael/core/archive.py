@@ -0,0 +1,147 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import stat
+import zlib
+import tarfile
+import zipfile
+import posixpath
+import collections
+from datetime import datetime
+
+
+# number of bytes at the start of a file archive_kind needs
+HEAD = 512
+
+# errors reading a damaged or truncated archive
+ERRORS = (
+    zipfile.BadZipfile, tarfile.TarError, zlib.error, EOFError, IOError,
+    ValueError
+)
+
+# an archive member; name is a route ('/a/b'), fmt is as for inodes plus 'h'
+# for a hardlink to linkname, and data is the content of regular files
+Member = collections.namedtuple(
+    'Member', 'name fmt mode uid gid size mtime linkname data'
+)
+
+
+def archive_kind(head):
+    """get the kind of archive ('zip' or 'tar') head is the start of, or None
+
+    Compressed files are taken to be tars; members() finds out if they are.
+    """
+    head = bytes(head[:HEAD])
+    if head[:4] in (b'PK\x03\x04', b'PK\x05\x06'):
+        return 'zip' # including ipa, jar etc
+    if (head[257:262] == b'ustar' or
+            head[:2] == b'\x1f\x8b' or # gzip
+            head[:3] == b'BZh' or
+            head[:6] == b'\xfd7zXZ\x00'):
+        return 'tar'
+    return None
+
+
+def is_archive(fileobj, kind):
+    """true if fileobj really is the kind of archive archive_kind said
+
+    archive_kind only guesses that compressed files are tars; this reads
+    the first header to be sure.  fileobj is left where it was.
+    """
+    start = fileobj.tell()
+    try:
+        if kind == 'zip':
+            return zipfile.is_zipfile(fileobj)
+        with tarfile.open(fileobj=fileobj, mode='r|*') as tf:
+            tf.next()
+        return True
+    except ERRORS:
+        return False
+    finally:
+        fileobj.seek(start)
+
+
+def file_kind(path):
+    """get the kind of archive the file at path is, or None if it isn't one
+
+    Unlike archive_kind, compressed files which aren't tars are None.
+    """
+    with open(path, 'rb') as f:
+        kind = archive_kind(f.read(HEAD))
+        f.seek(0)
+        if kind is None or not is_archive(f, kind):
+            return None
+    return kind
+
+
+def members(fileobj, kind):
+    """generate the Members of an archive, in the order they're stored
+
+    Members are read into memory one at a time, nothing's extracted to disk;
+    fileobj can be a file or a buffer, and tars are read as a stream.
+    """
+    if kind == 'zip':
+        return zip_members(fileobj)
+    return tar_members(fileobj)
+
+
+def zip_members(fileobj):
+    """generate the Members of a zip"""
+    with zipfile.ZipFile(fileobj) as zf:
+        for info in zf.infolist():
+            mode = info.external_attr >> 16 # set by unix zips
+            if info.filename.endswith('/'):
+                fmt = 'd'
+                mode = mode or stat.S_IFDIR | 0o755
+            elif stat.S_ISLNK(mode):
+                fmt = 'l'
+            else:
+                fmt = '-'
+                mode = mode or stat.S_IFREG | 0o644
+            data = zf.read(info) if fmt != 'd' else None
+            yield Member(
+                route(info.filename), fmt, stat.S_IMODE(mode), None, None,
+                info.file_size, datetime(*info.date_time),
+                data.decode('utf-8') if fmt == 'l' else None,
+                data if fmt == '-' else None
+            )
+
+
+def tar_members(fileobj):
+    """generate the Members of a (possibly compressed) tar"""
+    try:
+        tf = tarfile.open(fileobj=fileobj, mode='r|*')
+    except tarfile.ReadError:
+        raise ValueError('compressed, but not a tar')
+    with tf:
+        for ti in tf:
+            data = None
+            linkname = None
+            if ti.isdir():
+                fmt = 'd'
+            elif ti.issym():
+                fmt = 'l'
+                linkname = ti.linkname
+            elif ti.islnk():
+                fmt = 'h'
+                linkname = route(ti.linkname)
+            elif ti.isreg():
+                fmt = '-'
+                data = tf.extractfile(ti).read()
+            elif ti.ischr():
+                fmt = 'c'
+            elif ti.isblk():
+                fmt = 'b'
+            else:
+                fmt = 'p'
+            yield Member(
+                route(ti.name), fmt, stat.S_IMODE(ti.mode), ti.uid, ti.gid,
+                ti.size if fmt == '-' else 0,
+                datetime.utcfromtimestamp(ti.mtime), linkname, data
+            )
+
+
+def route(name):
+    """normalise a member's name to a route"""
+    return posixpath.normpath('/' + name.lstrip('/'))
@@ -0,0 +1,48 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import functools
+
+from cadfael.conf import settings
+
+
+# ids of the analyses this process knows are already in the db
+analysed = set()
+
+
+def analysis(name, version):
+    """Decorator for inode receivers whose results only depend on content
+
+    The decorated function returns a dict of results rather than adding them
+    to the inode.  These are stored once per sha256 in the analyses
+    collection, as { '_id': 'name:sha256', 'analyser': name, 'version':
+    version, 'sha256': sha256, ...results }, and the inode just references
+    them in details.analyses[name].  If the content has already been
+    analysed by this version of the analyser the function isn't called at
+    all; bump version whenever the results would change.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(inode, path, content=None):
+            details = inode['details']
+            if 'sha256' not in details:
+                # nothing to key it on; keep it in the inode
+                details.update(func(inode, path, content))
+                return
+            _id = '%s:%s' % (name, details['sha256'])
+            if _id not in analysed:
+                if not settings.STORAGE.has_analysis(_id, version):
+                    result = func(inode, path, content)
+                    result.update({
+                        'analyser': name,
+                        'version': version,
+                        'sha256': details['sha256']
+                    })
+                    settings.ANALYSIS_WRITER.update_one(
+                        { '_id': _id }, { '$set': result }, True
+                    )
+                analysed.add(_id)
+            details.setdefault('analyses', {})[name] = _id
+        return wrapper
+    return decorator
@@ -0,0 +1,120 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import io
+import os
+import mmap
+import hashlib
+import collections
+
+
+# size of the chunks content is hashed in
+CHUNK = 1024 * 1024
+
+# a file within another, such as an image in a dyld shared cache; name is
+# its route beneath the container's, and its own bytes are size bytes from
+# offset in the container
+Part = collections.namedtuple('Part', 'name offset size')
+
+
+class Content(object):
+    """A file's content; opened and mapped once, then shared
+
+    One of these is created for each regular file imported and handed to the
+    hashing, type detection and every inode receiver (as the content kwarg),
+    so a file is only opened and read once however many things look at it.
+    Receivers should use read/head or data (the mmap) rather than opening
+    the path themselves.  Content which isn't a file (archive members) is
+    created with from_bytes, and data is then the bytes.  The content of a
+    Part is a view of its container's; see view.
+    """
+
+    def __init__(self, path):
+        """open and map path"""
+        self.path = path
+        self.offset = 0
+        self.parent = None
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size > 0:
+            self.data = mmap.mmap(
+                self.file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        else:
+            self.data = b'' # can't map an empty file
+
+    @classmethod
+    def from_bytes(cls, path, data):
+        """create content from bytes already in memory; path is a label"""
+        self = cls.__new__(cls)
+        self.path = path
+        self.offset = 0
+        self.parent = None
+        self.file = None
+        self.size = len(data)
+        self.data = data
+        return self
+
+    def view(self, path, part):
+        """get the content of a Part of this; path is a label
+
+        data is still the container's, with the part's bytes from offset,
+        as a part's own offsets (e.g. those in a dyld shared cache image's
+        load commands) can be relative to its container; read is too, but
+        head and digests only see the part.  The view's parent is this, and
+        it's only valid while this is open.
+        """
+        retval = Content.from_bytes(path, b'')
+        retval.offset = part.offset
+        retval.parent = self
+        retval.size = part.size
+        retval.data = self.data
+        return retval
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def head(self, size):
+        """get the first size bytes"""
+        return self.data[self.offset:self.offset + min(size, self.size)]
+
+    def read(self, offset, size):
+        """get size bytes from offset"""
+        return self.data[offset:offset+size]
+
+    def fileobj(self):
+        """get a file object, positioned at the start, over the content
+
+        This is shared; it's only valid until the next call to fileobj.
+        """
+        if self.parent is not None:
+            return io.BytesIO(self.head(self.size))
+        if self.file is None or self.size == 0:
+            return io.BytesIO(self.data)
+        self.data.seek(0)
+        return self.data
+
+    def digests(self, names):
+        """generate hexdigests of the content with each hashlib algorithm
+
+        All the digests are calculated in a single pass over the content.
+        """
+        hashes = [(name, hashlib.new(name)) for name in names]
+        end = self.offset + self.size
+        for offset in range(self.offset, end, CHUNK):
+            chunk = self.data[offset:min(offset + CHUNK, end)]
+            for _, h in hashes:
+                h.update(chunk)
+        return dict((name, h.hexdigest()) for name, h in hashes)
+
+    def close(self):
+        """unmap and close the file"""
+        if self.file is None:
+            return
+        if self.size > 0:
+            self.data.close()
+        self.file.close()
@@ -0,0 +1,195 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+
+# number of differing paths whose analyses are fetched together
+LOOKUP_SIZE = 1000
+
+# documents fetched from the server at a time
+BATCH_SIZE = 1000
+
+# the analyses fields compared for changed files, and what they're called
+# in diff records; entitlements are compared separately, by name
+FIELDS = [('dylibs', 'dylibs'), ('symbols.undef', 'imports')]
+
+
+def diff(db, old, new):
+    """generate a record of each path which differs between two volumes
+
+    Both volumes are streamed from the server sorted by path, and merged;
+    only the fields needed to tell if a path's changed are fetched for
+    every path, and the analyses are only fetched for files which have.
+    Each record is { 'path': route, 'change': 'added' | 'removed' |
+    'changed', 'old': entry, 'new': entry } where the entries are the fmt,
+    sha256 and symlink target (None if it isn't in that volume); and, for
+    changed files, the dylibs, imports and entitlements added and removed.
+    """
+    pending = []
+    for path, a, b in merge(entries(db, old), entries(db, new)):
+        if a is None:
+            pending.append((path, 'added', a, b))
+        elif b is None:
+            pending.append((path, 'removed', a, b))
+        elif differs(a, b):
+            pending.append((path, 'changed', a, b))
+        else:
+            continue
+        if len(pending) >= LOOKUP_SIZE:
+            for record in compare(db, pending):
+                yield record
+            pending = []
+    for record in compare(db, pending):
+        yield record
+
+
+def entries(db, volname):
+    """generate (path, entry) for every path of a volume, sorted by path"""
+    cursor = db.inodes.aggregate(
+        [
+            { '$match': { 'dev': volname } },
+            {
+                '$project': {
+                    '_id': False,
+                    'paths': True,
+                    'fmt': True,
+                    'sha256': '$details.sha256',
+                    'readlink': '$details.readlink',
+                    'analyses': '$details.analyses'
+                }
+            },
+            { '$unwind': '$paths' },
+            { '$sort': { 'paths': 1 } }
+        ],
+        allowDiskUse=True,
+        batchSize=BATCH_SIZE
+    )
+    for entry in cursor:
+        yield entry.pop('paths'), entry
+
+
+def merge(a, b):
+    """merge two sorted (path, entry) streams into (path, a, b)
+
+    a or b is None if the path is only in the other stream.
+    """
+    end = (None, None)
+    pa, ea = next(a, end)
+    pb, eb = next(b, end)
+    while pa is not None or pb is not None:
+        if pb is None or (pa is not None and pa < pb):
+            yield pa, ea, None
+            pa, ea = next(a, end)
+        elif pa is None or pb < pa:
+            yield pb, None, eb
+            pb, eb = next(b, end)
+        else:
+            yield pa, ea, eb
+            pa, ea = next(a, end)
+            pb, eb = next(b, end)
+
+
+def differs(a, b):
+    """true if the entries of a path in two volumes differ"""
+    return any(a.get(k) != b.get(k) for k in ('fmt', 'sha256', 'readlink'))
+
+
+def compare(db, pending):
+    """generate the records of (path, change, a, b), in order
+
+    The analyses of the changed files are fetched in one query, and the
+    dylibs, imports and entitlements of each pair compared.
+    """
+    ids = set()
+    for _, change, a, b in pending:
+        if change == 'changed':
+            for entry in (a, b):
+                ids.update((entry.get('analyses') or {}).values())
+    analyses = {}
+    if len(ids) > 0:
+        projection = dict((field, True) for field, _ in FIELDS)
+        projection['entitlements'] = True
+        for doc in db.analyses.find(
+                { '_id': { '$in': list(ids) } }, projection,
+                batch_size=BATCH_SIZE):
+            analyses[doc['_id']] = doc
+    for path, change, a, b in pending:
+        record = {
+            'path': path,
+            'change': change,
+            'old': summarise(a),
+            'new': summarise(b)
+        }
+        if change == 'changed':
+            old = [analyses[i] for i in (a.get('analyses') or {}).values()
+                   if i in analyses]
+            new = [analyses[i] for i in (b.get('analyses') or {}).values()
+                   if i in analyses]
+            for field, name in FIELDS:
+                changes = changed(values(old, field), values(new, field))
+                if changes is not None:
+                    record[name] = changes
+            changes = changed_entitlements(old, new)
+            if changes is not None:
+                record['entitlements'] = changes
+        yield record
+
+
+def summarise(entry):
+    """get what a record shows of an entry"""
+    if entry is None:
+        return None
+    retval = { 'fmt': entry.get('fmt'), 'sha256': entry.get('sha256') }
+    if entry.get('readlink') is not None:
+        retval['readlink'] = entry['readlink']
+    return retval
+
+
+def values(analyses, field):
+    """get the set of values of a (dotted) list field in analyses"""
+    retval = set()
+    for doc in analyses:
+        for key in field.split('.'):
+            doc = (doc or {}).get(key)
+        retval.update(doc or [])
+    return retval
+
+
+def changed(old, new):
+    """get { 'added': [...], 'removed': [...] } between sets; or None"""
+    if old == new:
+        return None
+    return { 'added': sorted(new - old), 'removed': sorted(old - new) }
+
+
+def changed_entitlements(old, new):
+    """compare the entitlements in two lists of analyses; None if the same
+
+    Returns { 'added': [entitlement], 'removed': [entitlement], 'changed':
+    [{ 'name': name, 'old': value, 'new': value }] }.
+    """
+    old = entitlements(old)
+    new = entitlements(new)
+    if old == new:
+        return None
+    return {
+        'added': [
+            { 'name': k, 'value': new[k] } for k in sorted(new) if k not in old
+        ],
+        'removed': [
+            { 'name': k, 'value': old[k] } for k in sorted(old) if k not in new
+        ],
+        'changed': [
+            { 'name': k, 'old': old[k], 'new': new[k] }
+            for k in sorted(old) if k in new and old[k] != new[k]
+        ]
+    }
+
+
+def entitlements(analyses):
+    """get the entitlements in analyses, as a dict of name to value"""
+    retval = {}
+    for doc in analyses:
+        for entitlement in doc.get('entitlements') or []:
+            retval[entitlement['name']] = entitlement['value']
+    return retval
@@ -0,0 +1,181 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import time
+import threading
+import multiprocessing
+
+from cadfael.conf import settings, load_modules
+from cadfael.core.pool import summarise
+from cadfael.core.stats import Stats, Progress
+from cadfael.core.utils import fork
+from cadfael.core.workqueue import WorkQueue
+
+
+def distribute_tree(volume_name, top, progress=False):
+    """import all files rooted at top with import_worker processes
+
+    top is published to the work queue, then this waits for the workers
+    (on any number of hosts) to import it; returning a summary, as
+    import_tree does.
+    """
+    if top[-1] != os.path.sep:
+        top += os.path.sep
+    queue = work_queue()
+    queue.clear(volume_name)
+    queue.publish(volume_name, top, [os.path.sep])
+    progress = Progress() if progress else None
+    while queue.outstanding(volume_name) > 0:
+        if progress is not None:
+            progress.update(
+                merge_summaries(queue.summaries(volume_name)),
+                queue.outstanding(volume_name)
+            )
+        time.sleep(settings.WORKQUEUE_POLL)
+    summary = merge_summaries(queue.summaries(volume_name), Stats())
+    queue.clear(volume_name)
+    if progress is not None:
+        progress.finish(summary)
+    summary['stats'] = summary['stats'].report()
+    return summary
+
+
+def merge_summaries(summaries, totals=None):
+    """add up the summaries of work items; merging stats into totals"""
+    retval = { 'dirs': 0, 'files': 0, 'links': 0, 'bytes': 0, 'skipped': 0 }
+    for summary in summaries:
+        for key in retval:
+            retval[key] += summary[key]
+        if totals is not None:
+            totals.merge({
+                'stages': dict(summary['stages']),
+                'slowest': dict(summary['slowest'])
+            })
+    if totals is not None:
+        retval['stats'] = totals
+    return retval
+
+
+def import_worker(func, top=None, processes=None, drain=False):
+    """run processes (a cpu's worth by default) distributed import workers
+
+    Each claims work items from the queue and imports them with func (see
+    import_item), until killed; or if drain is True until the queue is
+    empty.  If top is given it's where the trees are on this host, rather
+    than where they are on the coordinator's.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    workers = [
+        multiprocessing.Process(
+            target=work, args=(func, top, drain, settings.worker())
+        )
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def work(func, top=None, drain=False, values=None):
+    """process; claim and import work items with func
+
+    values are the parent's settings, as given to pool.init_worker.
+    """
+    if values is not None:
+        settings.update(values)
+    load_modules()
+    fork()
+    queue = work_queue()
+    while True:
+        item = queue.claim()
+        if item is not None:
+            import_item(queue, item, func, top)
+        elif drain and queue.outstanding() == 0:
+            break
+        else:
+            time.sleep(settings.WORKQUEUE_POLL)
+
+
+def work_queue():
+    """get the work queue; it's only in mongo"""
+    if settings.STORAGE.db is None:
+        raise ValueError('distributed imports need mongo storage')
+    return WorkQueue(settings.STORAGE.db.workqueue, settings.WORKQUEUE_LEASE)
+
+
+def import_item(queue, item, func, top=None):
+    """import the directories of a work item
+
+    The item's directory is walked, and its entries imported, until
+    settings.WORKQUEUE_SPLIT have been; then the subdirectories not yet
+    reached are published as items of their own.  Each directory is
+    imported by func(volume_name, top, path, links), which returns the
+    paths of its subdirectories, and the list of (path, fmt, size) and the
+    stats of the import.  links is shared by the item's directories, so
+    func can deduplicate hardlinks within it.
+    """
+    if top is None:
+        top = item['top']
+    elif top[-1] != os.path.sep:
+        top += os.path.sep
+    heartbeat = Heartbeat(queue, item)
+    summary = { 'dirs': 0, 'files': 0, 'links': 0, 'bytes': 0, 'skipped': 0 }
+    totals = Stats()
+    links = set()
+    count = 0
+    stack = [top[:-1] + item['route']]
+    try:
+        while len(stack) > 0 and not heartbeat.lost.is_set():
+            if count >= settings.WORKQUEUE_SPLIT:
+                queue.publish(
+                    item['volume'], item['top'],
+                    [path[len(top)-1:] for path in stack]
+                )
+                break
+            subdirs, out, collected = func(
+                item['volume'], top, stack.pop(), links
+            )
+            stack.extend(subdirs)
+            for _, fmt, size in out:
+                summarise(summary, fmt, size)
+            totals.merge(collected)
+            count += len(out)
+        # the item's only done once everything it imported is written
+        settings.WRITER.flush()
+    finally:
+        heartbeat.stop()
+    if not heartbeat.lost.is_set():
+        # stage names have dots in, so can't be keys in mongo
+        summary['stages'] = list(totals.stages.items())
+        summary['slowest'] = list(totals.slowest.items())
+        queue.complete(item, summary)
+
+
+class Heartbeat(object):
+    """Thread which renews the lease on a work item until stopped"""
+
+    def __init__(self, queue, item):
+        """start renewing item's lease"""
+        self.queue = queue
+        self.item = item
+        self.stopped = threading.Event()
+        self.lost = threading.Event() # set if another worker took it
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """thread; renew the lease a few times a lease period"""
+        while not self.stopped.wait(settings.WORKQUEUE_LEASE / 3.0):
+            if not self.queue.renew(self.item):
+                self.lost.set()
+                break
+
+    def stop(self):
+        """stop renewing"""
+        self.stopped.set()
+        self.thread.join()
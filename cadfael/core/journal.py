@@ -0,0 +1,145 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import json
+import threading
+
+
+class Journal(object):
+    """Append-only record of an import's progress, so it can be resumed
+
+    The first line is a header, { 'volume': volname, 'top': top, 'run':
+    run }, then there's a { 'done': dir } line for each directory all of
+    whose entries have been imported.  Paths in flight are those in
+    directories which aren't done; a resumed import skips the entries of
+    done directories, and walks the rest again.
+
+    Workers buffer their writes, so a directory is only journalled once the
+    db has acknowledged the writes of every task which imported its
+    entries.  Each task's results come with an ack, (pid, task, written);
+    the task's number in its worker, and the last of that worker's tasks
+    all of whose writes have been made (see inode.acknowledge).
+    """
+
+    def __init__(self, path):
+        """create a journal at path"""
+        self.path = path
+        self.header = None
+        self.done = set() # directories done before this run
+        self.file = None
+        self.lock = threading.Lock() # listed is called by the feed thread
+        self.pending = {} # dir: number of entries not yet imported
+        self.tasks = {} # dir: { pid: last task which imported its entries }
+        self.written = {} # pid: last task all of whose writes have been made
+        self.ready = [] # (dir, tasks) imported, waiting for their writes
+
+    def create(self, header):
+        """start a new journal, replacing any existing one"""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.header = header
+        self.file = open(self.path, 'w')
+        self.append(header)
+        self.sync()
+
+    def load(self):
+        """open an existing journal to resume, returning its header"""
+        if not os.path.exists(self.path):
+            raise ValueError('no import to resume; %s is missing' % self.path)
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break # torn final line
+                if self.header is None:
+                    self.header = record
+                else:
+                    self.done.add(record['done'])
+        if self.header is None:
+            raise ValueError('empty journal: %s' % self.path)
+        self.file = open(self.path, 'a')
+        return self.header
+
+    def listed(self, entries):
+        """note a directory's entries; false if they were done already"""
+        if len(entries) == 0:
+            return False
+        directory = os.path.dirname(entries[0][0])
+        if directory in self.done:
+            return False
+        with self.lock:
+            self.pending[directory] = len(entries)
+            self.tasks[directory] = {}
+        return True
+
+    def wrote(self, path, ack):
+        """note that the task of ack wrote some of path, but isn't done"""
+        with self.lock:
+            self.note(os.path.dirname(path), ack)
+
+    def imported(self, path, ack):
+        """note that path has been imported, by the task of ack"""
+        directory = os.path.dirname(path)
+        with self.lock:
+            self.note(directory, ack)
+            remaining = self.pending[directory] - 1
+            if remaining > 0:
+                self.pending[directory] = remaining
+            else:
+                del self.pending[directory]
+                self.ready.append((directory, self.tasks.pop(directory)))
+
+    def note(self, directory, ack):
+        """note that the task of ack wrote entries of directory"""
+        pid, task = ack[:2]
+        tasks = self.tasks[directory]
+        if task > tasks.get(pid, 0):
+            tasks[pid] = task
+
+    def acknowledged(self, ack):
+        """note the tasks of ack's worker whose writes have been made"""
+        pid, _, written = ack
+        with self.lock:
+            if written > self.written.get(pid, 0):
+                self.written[pid] = written
+
+    def commit(self, force=False):
+        """journal the directories imported whose writes have been made
+
+        If force is True all the directories imported are journalled; only
+        do this once the workers have flushed, and so written everything.
+        """
+        done = []
+        with self.lock:
+            waiting = []
+            for directory, tasks in self.ready:
+                if force or all(
+                        task <= self.written.get(pid, 0)
+                        for pid, task in tasks.items()):
+                    done.append(directory)
+                else:
+                    waiting.append((directory, tasks))
+            self.ready = waiting
+            for directory in done:
+                self.append({ 'done': directory })
+        if len(done) > 0:
+            self.sync()
+
+    def append(self, record):
+        """append a record"""
+        self.file.write(json.dumps(record) + '\n')
+
+    def sync(self):
+        """make sure what's been appended survives a crash"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self, remove=False):
+        """close the journal; removing it if the import is complete"""
+        self.file.close()
+        if remove:
+            os.unlink(self.path)
@@ -0,0 +1,226 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+"""Inode metadata lstat doesn't give; chflags and ACLs, per platform
+
+chflags(path, st) and acl(path, st) are given the inode's lstat result,
+so they only make the syscalls they need.  Native functions are bound when
+this is imported, so once in the parent and inherited by forked workers,
+rather than for each file.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import stat
+import errno
+import fcntl
+import struct
+import ctypes
+from ctypes.util import find_library
+
+
+# from <linux/fs.h>; FS_IOC_GETFLAGS is _IOR('f', 1, long)
+FS_IOC_GETFLAGS = 0x80006601 | struct.calcsize('l') << 16
+FS_APPEND_FL = 0x00000020
+FS_IMMUTABLE_FL = 0x00000010
+FS_NODUMP_FL = 0x00000040
+
+# chflags names, and the st_flags (BSD) and FS_IOC_GETFLAGS (linux) bits
+# which set them
+FLAGS = [
+    ('archived', stat.SF_ARCHIVED, 0),
+    ('opaque', stat.UF_OPAQUE, 0),
+    ('nodump', stat.UF_NODUMP, FS_NODUMP_FL),
+    ('sappend', stat.UF_APPEND | stat.SF_APPEND, FS_APPEND_FL),
+    ('uappend', stat.UF_IMMUTABLE | stat.SF_IMMUTABLE, FS_IMMUTABLE_FL),
+    ('hidden', stat.UF_HIDDEN, 0)
+]
+
+# from <linux/posix_acl_xattr.h>; the xattrs are a little endian version
+# header, then (tag, perm, id) entries
+ACL_XATTRS = [('system.posix_acl_access', ''),
+              ('system.posix_acl_default', 'default:')]
+ACL_EA_VERSION = 2
+ACL_TAGS = {
+    0x01: 'user::',
+    0x02: 'user:%u:',
+    0x04: 'group::',
+    0x08: 'group:%u:',
+    0x10: 'mask::',
+    0x20: 'other::'
+}
+
+# from <sys/acl.h> on darwin
+ACL_TYPE_EXTENDED = 0x00000100
+
+# errors meaning the filesystem doesn't support flags or xattrs
+UNSUPPORTED = (errno.ENOTTY, errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP,
+               getattr(errno, 'ENODATA', errno.ENOENT))
+
+
+def names(flags, column):
+    """get the names of flags; column is 1 for BSD and 2 for linux"""
+    return [flag[0] for flag in FLAGS if flags & flag[column] != 0]
+
+
+def has_extras(st):
+    """true if an inode can have flags and ACLs; only files and dirs do"""
+    return stat.S_ISREG(st.st_mode) or stat.S_ISDIR(st.st_mode)
+
+
+def fsencode(path):
+    """get path as bytes, for native functions"""
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding() or 'utf-8')
+
+
+def darwin_chflags(path, st):
+    """get the chflags of an inode; BSD keeps them in st_flags"""
+    return names(st.st_flags, 1)
+
+
+def darwin_acl(path, st):
+    """get the extended ACL of an inode as text, or None"""
+    acl = acl_get_file(fsencode(path), ACL_TYPE_EXTENDED)
+    if not acl:
+        return None
+    text = acl_to_text(acl, None)
+    acl_free(acl)
+    if not text:
+        return None
+    retval = ctypes.string_at(text).decode('utf-8')
+    acl_free(text)
+    return retval
+
+
+def linux_chflags(path, st):
+    """get the chflags of an inode, from the FS_IOC_GETFLAGS ioctl
+
+    Only files and directories have flags; empty if the inode can't be
+    opened or its filesystem has no flags.
+    """
+    if not has_extras(st):
+        return []
+    try:
+        fd = os.open(
+            path, os.O_RDONLY | os.O_NONBLOCK | os.O_NOFOLLOW | os.O_NOCTTY
+        )
+    except OSError:
+        return []
+    try:
+        buf = fcntl.ioctl(fd, FS_IOC_GETFLAGS, b'\0' * 8)
+    except IOError as e:
+        if e.errno not in UNSUPPORTED:
+            raise
+        return []
+    finally:
+        os.close(fd)
+    return names(struct.unpack('=I', buf[:4])[0], 2)
+
+
+def linux_acl(path, st):
+    """get the POSIX ACLs of an inode as text, or None
+
+    Entries are as getfacl -n gives them, one per line, with uids and gids
+    as numbers as they are in the inode.
+    """
+    if not has_extras(st):
+        return None
+    entries = []
+    for name, prefix in ACL_XATTRS:
+        value = getxattr(path, name)
+        if value is None or len(value) < 4:
+            continue
+        if struct.unpack('<I', value[:4])[0] != ACL_EA_VERSION:
+            continue
+        for offset in range(4, len(value) - 7, 8):
+            tag, perm, _id = struct.unpack('<HHI', value[offset:offset+8])
+            entry = ACL_TAGS.get(tag)
+            if entry is None:
+                continue
+            if '%' in entry:
+                entry = entry % _id
+            entries.append('%s%s%s%s%s' % (
+                prefix, entry,
+                'r' if perm & 4 else '-',
+                'w' if perm & 2 else '-',
+                'x' if perm & 1 else '-'
+            ))
+    if len(entries) == 0:
+        return None
+    return '\n'.join(entries)
+
+
+def os_getxattr(path, name):
+    """get an inode's xattr, not following symlinks, or None"""
+    try:
+        return os.getxattr(path, name, follow_symlinks=False)
+    except OSError as e:
+        if e.errno not in UNSUPPORTED:
+            raise
+    return None
+
+
+def libc_getxattr(path, name):
+    """get an inode's xattr, not following symlinks, or None; python 2"""
+    path = fsencode(path)
+    name = name.encode('ascii')
+    while True:
+        size = lgetxattr(path, name, None, 0)
+        if size >= 0:
+            buf = ctypes.create_string_buffer(size)
+            size = lgetxattr(path, name, buf, size)
+        if size >= 0:
+            return buf.raw[:size]
+        err = ctypes.get_errno()
+        if err == errno.ERANGE:
+            continue # it grew between the calls
+        if err in UNSUPPORTED:
+            return None
+        raise OSError(err, os.strerror(err), path)
+
+
+def no_chflags(path, st):
+    """get the chflags of an inode, on a platform we can't"""
+    return []
+
+
+def no_acl(path, st):
+    """get the ACL of an inode, on a platform we can't"""
+    return None
+
+
+if sys.platform == 'darwin':
+    libc = ctypes.CDLL(find_library('c'))
+
+    acl_get_file = libc.acl_get_file
+    acl_get_file.argtypes = [ctypes.c_char_p, ctypes.c_int]
+    acl_get_file.restype = ctypes.c_void_p
+
+    acl_to_text = libc.acl_to_text
+    acl_to_text.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_ssize_t)]
+    acl_to_text.restype = ctypes.c_void_p # to be freed with acl_free
+
+    acl_free = libc.acl_free
+    acl_free.argtypes = [ctypes.c_void_p]
+    acl_free.restype = ctypes.c_int
+
+    chflags = darwin_chflags
+    acl = darwin_acl
+elif sys.platform.startswith('linux'):
+    if hasattr(os, 'getxattr'):
+        getxattr = os_getxattr
+    else:
+        lgetxattr = ctypes.CDLL(None, use_errno=True).lgetxattr
+        lgetxattr.argtypes = [
+            ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_size_t
+        ]
+        lgetxattr.restype = ctypes.c_ssize_t
+        getxattr = libc_getxattr
+
+    chflags = linux_chflags
+    acl = linux_acl
+else:
+    chflags = no_chflags
+    acl = no_acl
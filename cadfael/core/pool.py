@@ -0,0 +1,484 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import heapq
+import signal
+import itertools
+import threading
+import collections
+import multiprocessing
+
+from cadfael.conf import settings, load_modules
+from cadfael.core.stats import Stats
+from cadfael.core.utils import fork
+
+
+class Worker(object):
+    """The state of a pool worker, for the import it was started for
+
+    init_worker makes one in each worker; known and run are set when the
+    import is incremental, to the (size, mtime, ctime) of every inode
+    already in the volume and the run id.  defer is true in import pool
+    workers when there's an analysis pool; files with inode receivers, and
+    the parts of files, are then left to it (see Analysis).  barrier is the
+    (arrived, go) of flush_worker, in the workers of kept pools.
+    """
+
+    def __init__(self, known=None, run=None, defer=False, barrier=None):
+        """state for an import; by default a fresh one, without pools"""
+        self.known = known
+        self.run = run
+        self.defer = defer
+        self.barrier = barrier
+        # the content of the file whose parts this last imported; kept
+        # open, as the rest of its parts are likely to follow
+        self.container = None
+        # the number of tasks done, the last of those all of whose writes
+        # have been made, and the (task, inode writer sequence, analysis
+        # writer sequence) of those whose might not have been
+        self.tasks_done = 0
+        self.tasks_written = 0
+        self.unwritten = collections.deque()
+
+    def acknowledge(self):
+        """get the ack to return with a task's results
+
+        This is (pid, task, written); task numbers the task in this worker,
+        and written is the last of its tasks all of whose writes (and those
+        of the tasks before it) the db has acknowledged.  So the parent
+        knows when it can journal what the task imported (see Journal).
+        """
+        self.tasks_done += 1
+        self.unwritten.append((
+            self.tasks_done,
+            settings.WRITER.sequence,
+            settings.ANALYSIS_WRITER.sequence
+        ))
+        while (len(self.unwritten) > 0 and
+               self.unwritten[0][1] <= settings.WRITER.written and
+               self.unwritten[0][2] <= settings.ANALYSIS_WRITER.written):
+            self.tasks_written = self.unwritten.popleft()[0]
+        return os.getpid(), self.tasks_done, self.tasks_written
+
+
+# this process's state as a worker; init_worker replaces it in pool workers,
+# and this is that of imports run without a pool
+worker = Worker()
+
+# the pools fresh imports use, if warm_pools has started them; see Workers
+warm = None
+
+
+def run_pool(func, feed, initargs, progress=None, journal=None,
+             analyse=None):
+    """run func over the chunks of feed in a pool of init_worker workers
+
+    func returns, for each chunk, a list of (path, fmt, size) along with
+    the stats collected and its ack (see Worker.acknowledge); or (path,
+    fmt, size, job) for files it defers.  If analyse is given, and
+    settings.ANALYSIS_PROCESSES isn't 0, those jobs are given to analyse by
+    a second pool (see Analysis).  Fresh imports (initargs of (None, None))
+    use the pools from warm_pools, if they've been started; otherwise the
+    pools are just for this.
+
+    Returns (summary, completed, flushed); completed is false if the import
+    was interrupted, and flushed is true if the workers exited (or flushed)
+    cleanly, so everything they imported has been written.
+    """
+    global warm
+    workers = warm
+    if workers is None or initargs != (None, None):
+        workers = Workers(initargs[0], initargs[1], analyse is not None)
+    analysis = None
+    if analyse is not None and workers.analysis is not None:
+        analysis = Analysis(workers.analysis, workers.processes[1], analyse)
+    summary = {
+        'dirs': 0,
+        'files': 0,
+        'links': 0,
+        'bytes': 0,
+        'skipped': 0
+    }
+    totals = Stats()
+    completed = False
+    flushed = False
+    try:
+        res = workers.pool.imap_unordered(func, feed)
+        consume(res, feed, summary, totals, progress, journal, analysis)
+        completed = True
+    except KeyboardInterrupt:
+        # stop walking, but let the paths in flight finish, so the workers
+        # exit cleanly and flush their writes; ctrl-c again to abandon them
+        feed.stop()
+        if analysis is not None:
+            analysis.stop()
+        try:
+            consume(res, feed, summary, totals, progress, journal, analysis)
+        except KeyboardInterrupt:
+            pass
+        else:
+            flushed = True
+    except Exception:
+        # the pool's task handler may be waiting on the feed; it has to
+        # finish for terminate to
+        feed.stop()
+        if analysis is not None:
+            analysis.stop()
+        workers.terminate()
+        if workers is warm:
+            warm = None
+        raise
+    else:
+        flushed = True
+    if flushed:
+        workers.finish()
+    else:
+        workers.terminate()
+        if workers is warm:
+            warm = None
+    summary['stats'] = totals.report()
+    return summary, completed, flushed
+
+
+def init_worker(known, run, defer=False, barrier=None, values=None):
+    """pool initializer; connects to the db and sets up the Worker
+
+    values are the parent's settings (see Settings.worker); with them the
+    analysers are registered here, as a worker which wasn't forked hasn't
+    inherited them.
+    """
+    global worker
+    if values is not None:
+        settings.update(values)
+    load_modules()
+    fork()
+    worker = Worker(known, run, defer, barrier)
+
+
+class Workers(object):
+    """The pools of an import; its import pool, and analysis pool if any
+
+    Usually they're started for an import, and closed (so the workers exit
+    and flush their writes) at its end.  Those started by warm_pools are
+    kept instead, and used by every fresh import until close_pools; so the
+    workers are only forked, and connect to the db, once however many trees
+    are imported.  Incremental and resumed imports always start their own,
+    as their workers are forked with the volume's inodes.  Kept workers
+    are made to flush at the end of each import (see flush).
+    """
+
+    def __init__(self, known=None, run=None, analyse=False, keep=False):
+        """start the pools; analysis pool only if analyse is True"""
+        self.keep = keep
+        # (arrived, go) of flush_worker; only kept workers need it
+        self.barrier = None
+        if keep:
+            self.barrier = (
+                multiprocessing.Semaphore(0), multiprocessing.Event()
+            )
+        self.processes = [multiprocessing.cpu_count()]
+        # we have to do this magic as otherwise we can't properly ctrl-c
+        original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.analysis = None
+        if analyse and settings.ANALYSIS_PROCESSES != 0:
+            self.processes.append(
+                settings.ANALYSIS_PROCESSES or multiprocessing.cpu_count()
+            )
+            self.analysis = multiprocessing.Pool(
+                self.processes[1],
+                init_worker,
+                (None, run, False, self.barrier, settings.worker())
+            )
+        self.pool = multiprocessing.Pool(
+            self.processes[0],
+            init_worker,
+            (
+                known, run, self.analysis is not None, self.barrier,
+                settings.worker()
+            )
+        )
+        signal.signal(signal.SIGINT, original_sigint_handler)
+        self.pools = [self.pool]
+        if self.analysis is not None:
+            self.pools.append(self.analysis)
+
+    def finish(self):
+        """have every worker write what it's buffered, once the import's done
+
+        Kept workers are flushed; others exit.
+        """
+        if self.keep:
+            self.flush()
+        else:
+            self.close()
+
+    def flush(self):
+        """have every worker of kept pools write what it's buffered
+
+        Each worker of a pool is given a flush_worker; as they don't return
+        until every one has started, none can take two.
+        """
+        arrived, go = self.barrier
+        for pool, processes in zip(self.pools, self.processes):
+            go.clear()
+            results = [
+                pool.apply_async(flush_worker) for _ in range(processes)
+            ]
+            for _ in range(processes):
+                arrived.acquire()
+            go.set()
+            for result in results:
+                result.get()
+
+    def close(self):
+        """stop the workers, once they've flushed their writes"""
+        for pool in self.pools:
+            pool.close()
+        for pool in self.pools:
+            pool.join()
+
+    def terminate(self):
+        """stop the workers, abandoning whatever they're doing"""
+        for pool in self.pools:
+            pool.terminate()
+        for pool in self.pools:
+            pool.join()
+
+
+def warm_pools():
+    """start pools for the fresh imports of this process to share
+
+    Forking the workers, and their connecting to the db, is then paid once
+    rather than by every import_tree or import_archive; see Workers.  Uses
+    settings.ANALYSIS_PROCESSES as it is when called.
+    """
+    global warm
+    if warm is None:
+        warm = Workers(analyse=True, keep=True)
+    return warm
+
+
+def close_pools():
+    """stop the pools from warm_pools, once their workers have flushed"""
+    global warm
+    if warm is not None:
+        warm.close()
+        warm = None
+
+
+def flush_worker():
+    """kept pool task; write what this worker has buffered, see Workers"""
+    try:
+        if worker.container is not None:
+            # it may have changed by the next import
+            worker.container.close()
+            worker.container = None
+        settings.ANALYSIS_WRITER.flush()
+        settings.WRITER.flush()
+    finally:
+        arrived, go = worker.barrier
+        arrived.release()
+        go.wait()
+
+
+def consume(res, feed, summary, totals, progress=None, journal=None,
+            analysis=None):
+    """collect the results and stats of run_pool's func
+
+    Files it defers are handed to analysis, and only summarised
+    and journalled once it's analysed them (all of them, for files whose
+    parts are analysed in chunks).  While analysis has more than
+    settings.ANALYSIS_BACKLOG files waiting no more paths are fed, so the
+    walk can't run away from it.
+    """
+    done = 0
+    timeout = 1 if analysis is None else 0.1
+    while True:
+        try:
+            result = res.next(timeout)
+        except multiprocessing.TimeoutError:
+            if analysis is not None:
+                done += record(analysis.collect(), summary, totals, journal)
+            if progress is not None:
+                progress.update(summary, feed.fed - done)
+            if journal is not None:
+                journal.commit()
+            continue # ignore and try again
+        except StopIteration:
+            break
+        for entry in result[0]:
+            if len(entry) > 3:
+                analysis.push(entry[3])
+        done += record([result], summary, totals, journal)
+        if analysis is not None:
+            while analysis.backlog() > settings.ANALYSIS_BACKLOG:
+                done += record(analysis.collect(1), summary, totals, journal)
+            done += record(analysis.collect(), summary, totals, journal)
+        feed.release()
+        if progress is not None:
+            progress.update(summary, feed.fed - done)
+    if analysis is not None:
+        analysis.close()
+        while analysis.pending > 0:
+            done += record(analysis.collect(1), summary, totals, journal)
+            if progress is not None:
+                progress.update(summary, feed.fed - done)
+
+
+def record(results, summary, totals, journal=None):
+    """summarise and journal the (out, collected, ack) results of workers
+
+    Returns the number of paths done; those deferred for analysis, or with
+    jobs still to be analysed, aren't.
+    """
+    retval = 0
+    for out, collected, ack in results:
+        if journal is not None:
+            journal.acknowledged(ack)
+        for entry in out:
+            if len(entry) > 3:
+                # not done, but what it's written so far has to be too
+                if journal is not None:
+                    journal.wrote(entry[0], ack)
+                continue
+            path, fmt, size = entry
+            summarise(summary, fmt, size)
+            if journal is not None:
+                journal.imported(path, ack)
+            retval += 1
+        totals.merge(collected)
+    if journal is not None:
+        journal.commit()
+    return retval
+
+
+def summarise(summary, fmt, size):
+    """add the result of a single inode import to summary"""
+    if fmt is None:
+        summary['skipped'] += 1
+    elif fmt == 'd':
+        summary['dirs'] += 1
+    elif fmt == 'l':
+        summary['links'] += 1
+    else:
+        summary['files'] += 1
+        summary['bytes'] += size
+
+
+def job_size(job):
+    """get the bytes an analysis job looks at; of a file, or its parts
+
+    Jobs are (path, route, inode) or (path, route, inode, parts).
+    """
+    if len(job) > 3:
+        return sum(part.size for part in job[3])
+    return job[2]['size']
+
+
+class Analysis(object):
+    """Pool which runs the inode receivers on the files an import defers
+
+    Analysing a large binary can take far longer than importing thousands
+    of small files, so it's done by a pool of its own (of processes
+    workers) while the import pool carries on walking, hashing and typing.
+    The files waiting are analysed largest first, so the slowest are
+    started as soon as they're found rather than holding up the end of the
+    import.  The pool's fed through a bounded generator, as BoundedFeed
+    does, so each worker only has a couple of files queued and the rest
+    stay in the heap, where larger files found later can overtake them.
+    A file with parts can have several jobs; its result is only collected
+    once they're all done.
+    """
+
+    def __init__(self, pool, processes, func):
+        """start feeding pool, of init_worker workers, from the heap
+
+        func analyses a job, returning the same as run_pool's func does for
+        a chunk; see job_size.
+        """
+        self.pool = pool
+        self.slots = threading.Semaphore(2 * processes)
+        self.cond = threading.Condition()
+        self.waiting = [] # heap of (-size, seq, job)
+        self.seq = itertools.count() # so equal sizes are analysed in order
+        self.closed = False
+        self.pending = 0 # pushed but not collected
+        self.outstanding = {} # path: its jobs which are pending
+        self.res = self.pool.imap_unordered(func, self.jobs())
+
+    def jobs(self):
+        """generate the waiting jobs, largest first, as the pool has room"""
+        while True:
+            self.slots.acquire()
+            with self.cond:
+                while len(self.waiting) == 0 and not self.closed:
+                    self.cond.wait()
+                if len(self.waiting) == 0:
+                    return
+                job = heapq.heappop(self.waiting)[2]
+            yield job
+
+    def push(self, job):
+        """queue a job deferred by the import to be analysed"""
+        with self.cond:
+            if self.closed:
+                return
+            heapq.heappush(
+                self.waiting, (-job_size(job), next(self.seq), job)
+            )
+            self.pending += 1
+            self.outstanding[job[0]] = self.outstanding.get(job[0], 0) + 1
+            self.cond.notify()
+
+    def backlog(self):
+        """get the number of jobs waiting for a worker"""
+        return len(self.waiting)
+
+    def collect(self, timeout=0):
+        """get the results of the jobs which are done
+
+        If none are, waits up to timeout seconds for one.
+        """
+        retval = []
+        while self.pending > 0:
+            wait = timeout if len(retval) == 0 else 0
+            try:
+                out, collected, ack = self.res.next(wait)
+            except multiprocessing.TimeoutError:
+                break
+            retval.append((self.finished(out), collected, ack))
+            self.slots.release()
+            self.pending -= 1
+        return retval
+
+    def finished(self, out):
+        """get a job's out; entries whose paths have jobs left are marked
+
+        They have None appended, so record takes them to be deferred.
+        """
+        retval = []
+        for entry in out:
+            self.outstanding[entry[0]] -= 1
+            if self.outstanding[entry[0]] == 0:
+                del self.outstanding[entry[0]]
+                retval.append(entry)
+            else:
+                retval.append(entry + (None,))
+        return retval
+
+    def close(self):
+        """stop taking jobs, once those waiting have been analysed"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def stop(self):
+        """stop taking jobs, and forget those waiting"""
+        with self.cond:
+            self.closed = True
+            self.pending -= len(self.waiting)
+            self.waiting = []
+            self.cond.notify()
+        self.slots.release() # in case jobs() is waiting for one
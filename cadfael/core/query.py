@@ -0,0 +1,87 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+from cadfael.core.similarity import similar
+
+
+# the analyses field each kind of query matches
+FIELDS = {
+    'imports': 'symbols.undef',
+    'dylib': 'dylibs',
+    'entitlement': 'entitlements.name'
+}
+
+# every kind of query search answers
+KINDS = sorted(FIELDS) + ['sha256', 'similar']
+
+# the least similarity of the results of a similar query, if not given
+SIMILARITY = 0.5
+
+# number of sha256s looked up in inodes per query
+LOOKUP_SIZE = 1000
+
+# documents fetched from the server at a time
+BATCH_SIZE = 1000
+
+
+def search(db, kind, value, extra=None, volname=None):
+    """generate the (volume, path) of every file matching a query
+
+    kind is one of KINDS; the symbol, dylib or entitlement name to find
+    (imports, dylib and entitlement) or the sha256 of the content (sha256,
+    or similar for binaries like it).  For entitlement queries extra can be
+    the value it must have (or, for arrays, contain), and for similar the
+    least similarity (0 to 1) of the results.  Results are streamed; the
+    analyses matching are found with an index, then the inodes with their
+    content, in batches.
+    """
+    if kind == 'sha256':
+        return lookup(db, [value], volname)
+    if kind == 'similar':
+        found = similar(
+            db, value, SIMILARITY if extra is None else float(extra)
+        )
+        return inodes(db, (sha256 for _, sha256 in found), volname)
+    query = { FIELDS[kind]: value }
+    if kind == 'entitlement' and extra is not None:
+        query = {
+            'entitlements': { '$elemMatch': { 'name': value, 'value': extra } }
+        }
+    return inodes(db, analysed(db, query), volname)
+
+
+def analysed(db, query):
+    """generate the sha256 of the content of each analysis matching query"""
+    seen = set() # content can have more than one analysis
+    for doc in db.analyses.find(
+            query, { '_id': False, 'sha256': True }, batch_size=BATCH_SIZE):
+        if doc['sha256'] not in seen:
+            seen.add(doc['sha256'])
+            yield doc['sha256']
+
+
+def inodes(db, sha256s, volname=None):
+    """generate the (volume, path) of every file with content in sha256s"""
+    batch = []
+    for sha256 in sha256s:
+        batch.append(sha256)
+        if len(batch) >= LOOKUP_SIZE:
+            for result in lookup(db, batch, volname):
+                yield result
+            batch = []
+    if len(batch) > 0:
+        for result in lookup(db, batch, volname):
+            yield result
+
+
+def lookup(db, sha256s, volname=None):
+    """generate the (volume, path) of every file with one of sha256s"""
+    query = { 'details.sha256': { '$in': sha256s } }
+    if volname is not None:
+        query['dev'] = volname
+    for inode in db.inodes.find(
+            query, { '_id': False, 'dev': True, 'paths': True },
+            batch_size=BATCH_SIZE):
+        for path in inode.get('paths', []):
+            yield inode['dev'], path
@@ -1,5 +1,5 @@
 # coding: utf-8
-# pylint: disable=W0621,C0103,R0903
+# pylint: disable=W0621,C0103,R0903,C0326
 from __future__ import unicode_literals, print_function
 
 import os
@@ -8,13 +8,104 @@ import os
 # processing modules; in the order they are run
 MODULES = [
     'cadfael.modules.inode',
-    'cadfael.modules.x-mach-binary',
 ]
 
-# default database location
+# analysers; (signal, 'module:function', filters) of receivers registered
+# after MODULES, whose modules are only imported by a process once it gets
+# something passing the filters (see signals.lazy_receiver)
+ANALYSERS = [
+    (
+        'inode', 'cadfael.modules.x-mach-binary:signals_inode',
+        { 'fmt': '-', 'details__mime_type': 'application/x-mach-binary' }
+    ),
+    (
+        'inode', 'cadfael.modules.x-elf:signals_inode',
+        {
+            'fmt': '-',
+            'details__mime_type': (
+                'application/x-executable',
+                'application/x-pie-executable',
+                'application/x-sharedlib',
+                'application/x-object'
+            )
+        }
+    ),
+    (
+        'parts', 'cadfael.modules.x-dyld-shared-cache:signals_parts',
+        { 'fmt': '-', 'details__mime_type': 'application/x-dyld-shared-cache' }
+    ),
+]
+
+# default database location; host:port of a mongod, or sqlite:path
 DBADDR = '127.0.0.1:27017'
 
 # the directory to store files we have issues parsing
 FAULTS = os.path.join(os.path.abspath('..'), 'faults')
 
+# the directory to keep import journals in, so imports can be resumed
+JOURNALS = os.path.join(os.path.abspath('..'), 'journals')
+
+# hashlib digests stored for each file; sha256 must be included
+DIGESTS = ['sha256']
+
+# number of bytes from the start of a file given to libmagic
+MAGIC_BUFFER = 1024 * 1024
+
+# number of mime types each worker remembers by sha256, so libmagic isn't
+# asked about the same content twice; 0 to not remember any
+MAGIC_CACHE = 10000
+
+# threads listing directories during an import; more helps on network fs
+WALK_THREADS = 1
+
+# number of paths handed to a pool worker at a time
+IMPORT_CHUNKSIZE = 32
+
+# maximum number of paths walked ahead of the pool; bounds parent memory
+IMPORT_BACKLOG = 4096
+
+# processes running the inode receivers (the slow analysis of binaries) in
+# a pool of their own during an import; a cpu's worth if None, and if 0 the
+# receivers are run by the import pool as each file is found
+ANALYSIS_PROCESSES = None
+
+# maximum number of files waiting for the analysis pool; bounds parent memory
+ANALYSIS_BACKLOG = 4096
+
+# whether binaries are MinHash sketched as they're analysed, for the similar
+# query; off by default, as it costs about twice the parse of a Mach-O.
+# Binaries have to be analysed again for a change to apply to them
+MINHASH = False
+
+# bins in the MinHash sketch of each binary's symbols and strings, and the
+# LSH bands it's split into to find similar ones; more bands finds less
+# similar binaries, but gives more candidates to check.  Binaries have to
+# be analysed again for a change to apply to them
+MINHASH_SIZE = 128
+MINHASH_BANDS = 32
+
+# bytes of archive members handed to a pool worker at a time
+ARCHIVE_CHUNK = 16 * 1024 * 1024
+
+# maximum bytes of archive members read ahead of the pool; bounds memory
+ARCHIVE_BACKLOG = 256 * 1024 * 1024
+
+# how deeply archives within archives are imported
+ARCHIVE_DEPTH = 8
+
+# number of inode updates each worker buffers before writing them to the DB
+DB_BATCH_SIZE = 500
+
+# maximum number of seconds an update stays buffered before being written
+DB_FLUSH_INTERVAL = 5.0
+
+# seconds a distributed import worker holds a work item without renewing it
+WORKQUEUE_LEASE = 60.0
+
+# entries a worker imports from an item before queueing the rest as items
+WORKQUEUE_SPLIT = 10000
+
+# seconds between checks of the work queue when it's idle
+WORKQUEUE_POLL = 1.0
+
 CADFAEL = None
@@ -2,66 +2,216 @@
 # pylint: disable=W0621,C0103,R0903
 from __future__ import unicode_literals, print_function
 
+import time
+import inspect
+import importlib
+
+# returned by resolve when a path isn't present
+MISSING = object()
+
+
+def keywords(func):
+    """get the names of the keyword arguments func takes; None if any"""
+    try:
+        if hasattr(inspect, 'getfullargspec'):
+            spec = inspect.getfullargspec(func)
+            names, varkw = spec.args + spec.kwonlyargs, spec.varkw
+        else:
+            spec = inspect.getargspec(func) # python 2
+            names, varkw = spec.args, spec.keywords
+    except TypeError:
+        return None # not something we can inspect; give it everything
+    if varkw is not None:
+        return None
+    return frozenset(names)
+
+
+def compile_path(key):
+    """turn a filter key, e.g. details__mime_type, into a path tuple"""
+    return tuple(key.split('__'))
+
+
+def resolve(item, path):
+    """get the value at path in nested dicts; or MISSING"""
+    for p in path:
+        try:
+            item = item[p]
+        except (KeyError, IndexError, TypeError):
+            return MISSING
+    return item
+
 
 class Signal(object):
-    """Simple signal mechanism to provide weak binding"""
+    """Simple signal mechanism to provide weak binding
+
+    If index is given (filter keys, as used in receiver kwargs, most
+    selective first) receivers which filter on one of those keys are looked
+    up by the value they accept, so each call only evaluates the receivers
+    which could match.  The
+    candidates for each combination of indexed values are remembered, so
+    dispatch cost barely grows with the number of receivers.
+    """
 
-    def __init__(self):
+    def __init__(self, index=()):
         """create a empty signal"""
         self.receivers = []
+        self.index = [(key, compile_path(key)) for key in index]
+        self.dispatch = None
+        self.indexed = 0 # len(receivers) when dispatch was built
+        # if set, called with (func, seconds, args) after each receiver
+        self.profile = None
+
+    def connect(self, receiver):
+        """add a receiver to the signal"""
+        self.receivers.append(receiver)
 
     def __call__(self, *args, **kwargs):
         """call all registered signal handlers for this signal"""
         retval = []
-        for r in self.receivers:
+        for r in self.candidates(args):
             if r.filter(*args, **kwargs):
-                retval.append((r.func, r.func(*args, **kwargs)))
+                if self.profile is None:
+                    retval.append((r.func, r.call(args, kwargs)))
+                else:
+                    start = time.time()
+                    result = r.call(args, kwargs)
+                    self.profile(r.func, time.time() - start, args)
+                    retval.append((r.func, result))
         return retval
 
+    def receives(self, *args, **kwargs):
+        """true if calling the signal with these args would call a receiver"""
+        return any(r.filter(*args, **kwargs) for r in self.candidates(args))
+
+    def candidates(self, args):
+        """get the receivers, in registration order, which might match"""
+        if (len(self.index) == 0 or len(args) < 1 or
+                not isinstance(args[0], dict)):
+            return self.receivers # let filter sort it out
+        if self.dispatch is None or self.indexed != len(self.receivers):
+            self.build()
+        values = tuple(resolve(args[0], path) for _, path in self.index)
+        try:
+            return self.dispatch['cache'][values]
+        except KeyError:
+            pass
+        except TypeError:
+            return self.receivers # unhashable value; can't use the index
+        retval = set(self.dispatch['unindexed'])
+        for i, value in enumerate(values):
+            retval.update(self.dispatch['tables'][i].get(value, ()))
+        retval = sorted(retval, key=self.dispatch['order'].get)
+        self.dispatch['cache'][values] = retval
+        return retval
+
+    def build(self):
+        """build the dispatch tables from the registered receivers"""
+        tables = [{} for _ in self.index]
+        unindexed = []
+        for r in self.receivers:
+            for i, (key, _) in enumerate(self.index):
+                if key in r.kwargs:
+                    values = r.kwargs[key]
+                    if not isinstance(values, tuple):
+                        values = (values,)
+                    for value in values:
+                        tables[i].setdefault(value, []).append(r)
+                    break
+            else:
+                unindexed.append(r)
+        self.dispatch = {
+            'tables': tables,
+            'unindexed': unindexed,
+            'order': dict((r, i) for i, r in enumerate(self.receivers)),
+            'cache': {}
+        }
+        self.indexed = len(self.receivers)
+
 
 class receiver(object):
-    """Decorator class to allow easy registration of signal handlers"""
+    """Decorator class to allow easy registration of signal handlers
+
+    Signals can pass keyword arguments receivers written before them don't
+    take (e.g. inode's content); each receiver is only given those its
+    function does.
+    """
 
     def __init__(self, signal, **kwargs):
         """create decorator object"""
         self.signal = signal
         self.kwargs = kwargs
+        # compiled filters; (path, value, value is a tuple of options)
+        self.tests = [
+            (compile_path(k), v, isinstance(v, tuple))
+            for k, v in kwargs.items()
+        ]
         self.func = None
-        signal.receivers.append(self)
+        self.accepts = None # keywords(func), once it's known
+        signal.connect(self)
 
     def filter(self, *args, **_):
         """filters the signal, allowing optional calling of receiver"""
-        retval = True
         if len(args) < 1 or not isinstance(args[0], dict):
-            if len(self.kwargs) > 0:
+            if len(self.tests) > 0:
                 raise ValueError('filtered receiver expects dict as first param')
-        else:
-            for k, v in self.kwargs.items():
-                item = args[0]
-                parts = k.split('__')
-                for p in parts[:-1]:
-                    item = item[p]
-                k = parts[-1]
-                if k not in item:
-                    # this key isn't present
-                    retval = False
-                    break
-                if isinstance(v, tuple):
-                    # we have a list of options
-                    if item[k] not in v:
-                        # the value isn't present
-                        retval = False
-                        break
-                elif item[k] != v:
-                    # single value, but doens't match
-                    retval = False
-                    break
-        return retval
+            return True
+        for path, v, options in self.tests:
+            value = resolve(args[0], path)
+            if value is MISSING:
+                # this key isn't present
+                return False
+            if options:
+                # we have a list of options
+                if value not in v:
+                    # the value isn't present
+                    return False
+            elif value != v:
+                # single value, but doens't match
+                return False
+        return True
 
     def __call__(self, func):
         self.func = func
+        self.accepts = keywords(func)
         return func
 
+    def call(self, args, kwargs):
+        """call the function, with the keyword arguments it takes"""
+        func = self.func
+        if self.accepts is not None:
+            kwargs = dict(
+                (k, v) for k, v in kwargs.items() if k in self.accepts
+            )
+        return func(*args, **kwargs)
+
+
+class lazy_receiver(receiver):
+    """A receiver whose function isn't imported until it's first called
+
+    target is 'module:function'; so the module (and whatever it imports) is
+    only loaded in processes which get something passing the filters.  The
+    module mustn't register the function as a receiver itself.
+    """
+
+    def __init__(self, signal, target, **kwargs):
+        """create receiver, and connect it to signal"""
+        self.target = target
+        self.loaded = None
+        super(lazy_receiver, self).__init__(signal, **kwargs)
+
+    @property
+    def func(self):
+        """the receiver function; imported the first time it's needed"""
+        if self.loaded is None:
+            module, name = self.target.split(':')
+            self.loaded = getattr(importlib.import_module(module), name)
+            self.accepts = keywords(self.loaded)
+        return self.loaded
+
+    @func.setter
+    def func(self, func):
+        self.loaded = func
+
 
 #
 # Define signals here, they are Signal object
@@ -75,4 +225,9 @@ register_args = Signal()
 parse_args = Signal()
 
 # called when an inode is created; before added to the db
-inode = Signal()
+inode = Signal(index=('details__mime_type', 'fmt'))
+
+# called with a file's inode, once typed, to find the files within it (e.g.
+# the images in a dyld shared cache); receivers return a list of Parts (see
+# cadfael.core.content), which are imported as inodes of their own
+parts = Signal(index=('details__mime_type', 'fmt'))
@@ -0,0 +1,126 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import struct
+import hashlib
+
+from cadfael.conf import settings
+
+
+# added to the value of a bin borrowed by an empty one, per bin it's moved;
+# bigger than any value a bin can have
+ROTATION = 1 << 32
+
+# documents fetched from the server at a time
+BATCH_SIZE = 1000
+
+
+def sketch(**features):
+    """get the MinHash sketch of sets of features, to add to an analysis
+
+    features are named sets of strings, e.g. undef=symbols['undef']; the
+    same string in different sets is a different feature.  Returns {
+    'minhash': [value of each bin], 'lsh': [band key] }, or {} if there are
+    no features or sketching is off (see settings.MINHASH).  This is one
+    permutation hashing: each feature is hashed once, and the hash split
+    into a bin and a value, the sketch being the minimum value in each bin
+    (with empty bins borrowing from the next non-empty one).  The share of
+    bins two sketches have equal estimates the Jaccard similarity of their
+    features.
+    """
+    if not settings.MINHASH:
+        return {}
+    size = settings.MINHASH_SIZE
+    hashes = hash_features(features)
+    if len(hashes) == 0:
+        return {}
+    bins = [None] * size
+    for h in hashes:
+        i = h % size
+        value = h >> 32
+        if bins[i] is None or value < bins[i]:
+            bins[i] = value
+    # densify; rotate the next non-empty bin into each empty one
+    retval = list(bins)
+    for i in range(size):
+        distance = 1
+        while retval[i] is None:
+            value = bins[(i + distance) % size]
+            if value is not None:
+                retval[i] = value + distance * ROTATION
+            distance += 1
+    return { 'minhash': retval, 'lsh': bands(retval) }
+
+
+def hash_features(features):
+    """get a 64 bit hash of every feature in a dict of named sets
+
+    Each is md5(name:value) truncated; see benchmarks/minhash.py for the
+    throughput.
+    """
+    data = []
+    for name, values in features.items():
+        # the prefix is hashed once, and its state copied for each value
+        prefix = hashlib.md5(('%s:' % name).encode('utf-8'))
+        for value in values:
+            if not isinstance(value, bytes):
+                value = value.encode('utf-8', 'backslashreplace')
+            h = prefix.copy()
+            h.update(value)
+            data.append(h.digest()[:8])
+    # unpacked all at once, rather than a struct call each
+    return struct.unpack('<%uQ' % len(data), b''.join(data))
+
+
+def bands(minhash):
+    """get the LSH band keys of a sketch
+
+    Sketches with any key in common are candidates for being similar; the
+    probability they share one rises steeply with their similarity.
+    """
+    nbands = settings.MINHASH_BANDS
+    rows = len(minhash) // nbands
+    retval = []
+    for band in range(nbands):
+        data = struct.pack(
+            '<%uQ' % rows, *minhash[band * rows:(band + 1) * rows]
+        )
+        retval.append('%x:%s' % (band, hashlib.md5(data).hexdigest()[:16]))
+    return retval
+
+
+def estimate(a, b):
+    """estimate the Jaccard similarity of the features of two sketches"""
+    if len(a) != len(b) or len(a) == 0:
+        return 0.0 # not comparable; sketched with different settings
+    return sum(1 for x, y in zip(a, b) if x == y) / float(len(a))
+
+
+def similar(db, sha256, threshold=0.5, limit=None):
+    """get [(similarity, sha256)] of analysed content like sha256's
+
+    The candidates are the analyses, by the same analyser, sharing an LSH
+    band key with content's; found with an index, so the whole db isn't
+    compared.  Those with an estimated similarity of at least threshold are
+    returned, most similar first, up to limit of them.
+    """
+    found = {}
+    for doc in db.analyses.find(
+            { 'sha256': sha256, 'lsh': { '$exists': True } },
+            { 'analyser': True, 'minhash': True, 'lsh': True }):
+        for candidate in db.analyses.find(
+                { 'lsh': { '$in': doc['lsh'] }, 'analyser': doc['analyser'] },
+                { '_id': False, 'sha256': True, 'minhash': True },
+                batch_size=BATCH_SIZE):
+            if candidate['sha256'] == sha256:
+                continue
+            other = candidate['sha256']
+            score = estimate(doc['minhash'], candidate['minhash'])
+            if score >= threshold and score > found.get(other, 0):
+                found[other] = score
+    retval = sorted(
+        ((score, other) for other, score in found.items()),
+        key=lambda x: (-x[0], x[1])
+    )
+    return retval[:limit] if limit is not None else retval
@@ -0,0 +1,172 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import re
+import struct
+import collections
+import magic
+
+from cadfael.conf import settings
+from cadfael.core.stats import stats
+
+
+# number of bytes sniff looks at
+HEAD = 512
+
+# the mime type libmagic gives each kind of content sniff recognises
+MIME_TYPES = {
+    'mach-o': 'application/x-mach-binary',
+    'elf-exec': 'application/x-executable',
+    'elf-rel': 'application/x-object',
+    'elf-core': 'application/x-coredump',
+    'shell': 'text/x-shellscript',
+    'perl': 'text/x-perl',
+    'xml-plist': 'text/xml',
+    'binary-plist': 'application/octet-stream', # libmagic has no type
+    'gzip': 'application/gzip',
+    'bzip2': 'application/x-bzip2',
+    'xz': 'application/x-xz',
+    'tar': 'application/x-tar',
+    'dyld-shared-cache': 'application/x-dyld-shared-cache' # ours
+}
+
+# kinds libmagic has no type for, so which are given ours unchecked
+UNKNOWN_TO_LIBMAGIC = set(['dyld-shared-cache'])
+
+# interpreters of the scripts sniff recognises, and their kind
+INTERPRETERS = {
+    b'sh': 'shell',
+    b'bash': 'shell',
+    b'dash': 'shell',
+    b'ksh': 'shell',
+    b'zsh': 'shell',
+    b'perl': 'perl'
+}
+
+# leading magic numbers, and the kind they identify
+MAGIC_NUMBERS = [
+    (b'\xfe\xed\xfa\xce', 'mach-o'),
+    (b'\xce\xfa\xed\xfe', 'mach-o'),
+    (b'\xfe\xed\xfa\xcf', 'mach-o'),
+    (b'\xcf\xfa\xed\xfe', 'mach-o'),
+    (b'\xca\xfe\xba\xbf', 'mach-o'), # fat, 64bit
+    (b'bplist00', 'binary-plist'),
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bzip2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'dyld_v1', 'dyld-shared-cache')
+]
+
+# ELF e_types, and their kind; ET_DYN is left to libmagic, as whether it's
+# a shared library or a PIE executable depends on the dynamic section
+ELF_TYPES = { 1: 'elf-rel', 2: 'elf-exec', 4: 'elf-core' }
+
+# characters which mean libmagic wouldn't take content for text
+BINARY = re.compile('[\x00-\x07\x0e-\x1a\x1c-\x1f\x7f]')
+
+# kind: whether libmagic agreed with MIME_TYPES, for the first of each kind
+confirmed = {}
+
+# sha256: mime type, of recently typed content; least recently used first
+by_sha256 = collections.OrderedDict()
+
+
+def mime_type(content, sha256=None):
+    """get the mime type of content, as libmagic would, but cheaply
+
+    The start of the content is sniffed for the types we need to be precise
+    about; libmagic is only used when that's unsure.  Some kinds libmagic
+    doesn't know (dyld shared caches) get types of our own.  The first of
+    each other kind sniffed in a process is checked with libmagic, and if it
+    disagrees that kind isn't trusted.  Otherwise, if sha256 is given,
+    libmagic's answers are remembered (for settings.MAGIC_CACHE contents)
+    so it's only asked once for each.
+    """
+    with stats.timer('sniff'):
+        kind = sniff(content.head(HEAD))
+        if kind in ('shell', 'perl', 'xml-plist'):
+            # libmagic only takes text to be these, and looks at more of it
+            if not is_text(content.head(settings.MAGIC_BUFFER)):
+                kind = None
+    if kind in UNKNOWN_TO_LIBMAGIC:
+        return MIME_TYPES[kind]
+    if kind is not None:
+        if kind not in confirmed:
+            confirmed[kind] = from_libmagic(content) == MIME_TYPES[kind]
+        if confirmed[kind]:
+            return MIME_TYPES[kind]
+    if sha256 is None or settings.MAGIC_CACHE <= 0:
+        return from_libmagic(content)
+    retval = by_sha256.pop(sha256, None)
+    if retval is None:
+        retval = from_libmagic(content)
+        if len(by_sha256) >= settings.MAGIC_CACHE:
+            by_sha256.popitem(last=False)
+    by_sha256[sha256] = retval
+    return retval
+
+
+def from_libmagic(content):
+    """get libmagic's mime type for content"""
+    with stats.timer('magic'):
+        return magic.from_buffer(
+            content.head(settings.MAGIC_BUFFER), mime=True
+        )
+
+
+def sniff(head):
+    """get the kind of content head is the start of, or None if unsure"""
+    head = bytes(head)
+    for number, kind in MAGIC_NUMBERS:
+        if head.startswith(number):
+            return kind
+    if head.startswith(b'\xca\xfe\xba\xbe'):
+        # fat mach-o, or a java class; nfat_arch is small, class versions not
+        if len(head) >= 8 and struct.unpack('>I', head[4:8])[0] < 20:
+            return 'mach-o'
+        return None
+    if head.startswith(b'\x7fELF'):
+        return sniff_elf(head)
+    if head.startswith(b'#!'):
+        return sniff_script(head)
+    if head[257:262] == b'ustar':
+        return 'tar'
+    if (is_text(head) and b'<plist' in head and
+            head.lstrip().startswith(b'<?xml')):
+        return 'xml-plist'
+    return None
+
+
+def sniff_elf(head):
+    """get the kind of ELF file head is the start of"""
+    if len(head) < 18 or head[5:6] not in (b'\x01', b'\x02'):
+        return None
+    endian = '<' if head[5:6] == b'\x01' else '>'
+    return ELF_TYPES.get(struct.unpack(endian + 'H', head[16:18])[0])
+
+
+def sniff_script(head):
+    """get the kind of script head is the start of"""
+    if not is_text(head):
+        return None # libmagic only takes text to be a script
+    args = head[2:].split(b'\n', 1)[0].split()
+    if len(args) == 0:
+        return None
+    interpreter = args[0].split(b'/')[-1]
+    if interpreter == b'env' and len(args) > 1:
+        interpreter = args[1]
+    return INTERPRETERS.get(interpreter)
+
+
+def is_text(data):
+    """true if data is utf-8 text, without any control characters"""
+    data = bytes(data)
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        if e.start < len(data) - 3:
+            return False
+        # it's cut off part way through a character
+        text = data[:e.start].decode('utf-8')
+    return BINARY.search(text) is None
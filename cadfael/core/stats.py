@@ -0,0 +1,143 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import sys
+import time
+import heapq
+
+
+class Timer(object):
+    """Context manager which adds the time spent in it to a stage"""
+    __slots__ = ('stats', 'stage', 'path', 'start')
+
+    def __init__(self, stats, stage, path):
+        self.stats = stats
+        self.stage = stage
+        self.path = path
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *_):
+        self.stats.add(self.stage, time.time() - self.start, self.path)
+
+
+class Stats(object):
+    """Per-stage counters and timers
+
+    Each pool worker keeps its own (cadfael.core.stats.stats); it's cheap
+    enough to always be on.  Workers hand collect() back with their
+    results, and the parent merges them into its own Stats.
+    """
+
+    def __init__(self, nslowest=10):
+        """create empty stats, remembering the nslowest paths per stage"""
+        self.nslowest = nslowest
+        self.stages = {} # stage: [count, seconds]
+        self.slowest = {} # stage: heap of (seconds, path)
+
+    def timer(self, stage, path=None):
+        """time a stage; if path is given it's a candidate for slowest"""
+        return Timer(self, stage, path)
+
+    def add(self, stage, seconds, path=None):
+        """add a timing to a stage"""
+        counts = self.stages.get(stage)
+        if counts is None:
+            counts = self.stages[stage] = [0, 0.0]
+        counts[0] += 1
+        counts[1] += seconds
+        if path is not None:
+            self.rank(stage, seconds, path)
+
+    def rank(self, stage, seconds, path):
+        """keep path if it's one of the slowest for stage"""
+        slowest = self.slowest.setdefault(stage, [])
+        if len(slowest) < self.nslowest:
+            heapq.heappush(slowest, (seconds, path))
+        elif seconds > slowest[0][0]:
+            heapq.heapreplace(slowest, (seconds, path))
+
+    def collect(self):
+        """get (and reset) everything gathered since the last collect"""
+        retval = { 'stages': self.stages, 'slowest': self.slowest }
+        self.stages = {}
+        self.slowest = {}
+        return retval
+
+    def merge(self, collected):
+        """add what another Stats collected to this"""
+        for stage, (count, seconds) in collected['stages'].items():
+            counts = self.stages.setdefault(stage, [0, 0.0])
+            counts[0] += count
+            counts[1] += seconds
+        for stage, slowest in collected['slowest'].items():
+            for seconds, path in slowest:
+                self.rank(stage, seconds, path)
+
+    def report(self):
+        """generate a json-able report"""
+        stages = {}
+        for stage, (count, seconds) in self.stages.items():
+            stages[stage] = {
+                'count': count,
+                'seconds': seconds,
+                'mean_ms': seconds * 1000.0 / count if count else 0.0
+            }
+        slowest = {}
+        for stage, heap in self.slowest.items():
+            slowest[stage] = [
+                { 'path': path, 'seconds': seconds }
+                for seconds, path in sorted(heap, reverse=True)
+            ]
+        return { 'stages': stages, 'slowest': slowest }
+
+
+class Progress(object):
+    """Live progress line for an import, written to stderr"""
+
+    def __init__(self, interval=1.0, out=sys.stderr):
+        """create a progress line, redrawn at most every interval seconds"""
+        self.interval = interval
+        self.out = out
+        self.start = self.last = time.time()
+        self.files = self.bytes = 0
+
+    def update(self, summary, depth, force=False):
+        """redraw the line if it's due"""
+        now = time.time()
+        elapsed = now - self.last
+        if elapsed < self.interval and not force:
+            return
+        files = summary['dirs'] + summary['files'] + summary['links']
+        self.out.write(
+            '\r%10u inodes %8.1f inodes/s %8.2f MB/s %6u queued' % (
+                files,
+                (files - self.files) / max(elapsed, 1e-6),
+                (summary['bytes'] - self.bytes) / max(elapsed, 1e-6) / 1e6,
+                depth
+            )
+        )
+        self.out.flush()
+        self.last = now
+        self.files = files
+        self.bytes = summary['bytes']
+
+    def finish(self, summary):
+        """draw the final line, with the average rates"""
+        elapsed = max(time.time() - self.start, 1e-6)
+        files = summary['dirs'] + summary['files'] + summary['links']
+        self.out.write(
+            '\r%10u inodes %8.1f inodes/s %8.2f MB/s %8.1fs elapsed\n' % (
+                files, files / elapsed, summary['bytes'] / elapsed / 1e6,
+                elapsed
+            )
+        )
+        self.out.flush()
+
+
+# this process's stats
+stats = Stats()
@@ -0,0 +1,363 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import sqlite3
+import threading
+import bson
+from pymongo import MongoClient, ASCENDING, ReplaceOne
+
+from cadfael.conf import settings
+from cadfael.core.writer import BulkWriter
+
+
+# prefix of a DBADDR which is a local sqlite file rather than a mongod
+SQLITE = 'sqlite:'
+
+# number of _ids looked up per query of sqlite; applying a batch, or loading
+LOOKUP_SIZE = 500
+
+# (collection, field) of each index imports need
+INDEXES = [
+    ('inodes', 'dev'),
+    ('inodes', 'chmod'),
+    ('inodes', 'paths'),
+    ('analyses', 'sha256')
+]
+
+# and of each index cadfael-query needs
+QUERY_INDEXES = [
+    ('inodes', 'details.sha256'),
+    ('analyses', 'dylibs'),
+    ('analyses', 'symbols.undef'),
+    ('analyses', 'entitlements.name'),
+    ('analyses', 'lsh')
+]
+
+
+def connect(dbaddr, connect=True):
+    """get the storage at dbaddr; host:port for a mongod or sqlite:path"""
+    if dbaddr.startswith(SQLITE):
+        return SQLiteStorage(dbaddr[len(SQLITE):])
+    return MongoStorage(dbaddr, connect)
+
+
+class MongoStorage(object):
+    """Inodes and analyses stored in mongo; the default"""
+
+    def __init__(self, dbaddr, connect=True):
+        """connect to the mongod at dbaddr (host:port)"""
+        host, port = dbaddr.split(':')
+        # connect=False because: http://api.mongodb.com/python/current/faq.html#multiprocessing
+        self.db = MongoClient(host, int(port), connect=connect).cadfael
+
+    def create_volume(self, volname, delete_existing=True):
+        """create a volume, clearing previous entries"""
+        if delete_existing:
+            # delete the old records in this volume
+            self.db.inodes.delete_many({ 'dev': volname })
+
+        # now create it and setup indexes
+        self.create_indexes()
+
+    def create_indexes(self):
+        """create the indexes imports and queries need, if they don't exist"""
+        for name, field in INDEXES + QUERY_INDEXES:
+            self.db[name].create_index([(field, ASCENDING)])
+
+    def load_volume(self, volname, keep_seen=False):
+        """get the (size, mtime, ctime) of each inode in a volume, by _id"""
+        if not keep_seen:
+            # forget routes collected by an incremental import which didn't
+            # finish
+            self.db.inodes.update_many(
+                { 'dev': volname, 'seen': { '$exists': True } },
+                { '$unset': { 'seen': '' } }
+            )
+        retval = {}
+        for inode in self.db.inodes.find(
+                { 'dev': volname, 'details.parts': { '$exists': False } },
+                { 'size': True, 'mtime': True, 'ctime': True }):
+            retval[inode['_id']] = known_inode(inode)
+        return retval
+
+    def finish_volume(self, volname, run):
+        """complete an incremental import of a volume; see utils"""
+        self.db.inodes.delete_many({ 'dev': volname, 'run': { '$ne': run } })
+        self.db.inodes.update_many(
+            { 'dev': volname, 'run': run },
+            [
+                { '$set': { 'paths': '$seen' } },
+                { '$project': { 'seen': False } }
+            ]
+        )
+
+    def has_analysis(self, _id, version):
+        """true if version of the analysis _id is stored"""
+        return self.db.analyses.find_one(
+            { '_id': _id, 'version': version }, { '_id': True }
+        ) is not None
+
+    def writer(self, name, before=None):
+        """get a BulkWriter for a collection"""
+        return BulkWriter(
+            self.db[name], settings.DB_BATCH_SIZE, settings.DB_FLUSH_INTERVAL,
+            before
+        )
+
+    def load(self, source, volname):
+        """copy a volume, and the analyses its inodes refer to, from another
+
+        The ids of the analyses are collected while the inodes are copied,
+        then just those are fetched; not every analysis source has.
+        """
+        self.create_volume(volname)
+        ids = set()
+        inodes = source.documents('inodes', volname)
+        self.copy('inodes', referring(inodes, ids))
+        self.copy('analyses', fetch(source, 'analyses', sorted(ids)))
+
+    def copy(self, name, documents):
+        """replace documents in a collection, in batches"""
+        ops = []
+        for doc in documents:
+            ops.append(ReplaceOne({ '_id': doc['_id'] }, doc, upsert=True))
+            if len(ops) >= settings.DB_BATCH_SIZE:
+                self.db[name].bulk_write(ops, ordered=False)
+                ops = []
+        if len(ops) > 0:
+            self.db[name].bulk_write(ops, ordered=False)
+
+
+class SQLiteStorage(object):
+    """Inodes and analyses stored in a local sqlite file
+
+    Each document is stored whole, BSON encoded, along with the fields
+    volumes are queried on.  The file is in WAL mode, so every pool worker
+    can write to it at disk speed without a server; cadfael-load pushes a
+    finished volume into mongo for querying.
+    """
+
+    # the columns, other than _id and doc, each table keeps
+    TABLES = {
+        'inodes': ('dev', 'run'),
+        'analyses': ('sha256', 'version')
+    }
+
+    def __init__(self, path):
+        """open (creating if needed) the sqlite file at path"""
+        self.path = path
+        self.db = None # not mongo
+        self.lock = threading.Lock() # shared by this process's writers
+        self.conn = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.lock:
+            for table, columns in self.TABLES.items():
+                self.conn.execute(
+                    'CREATE TABLE IF NOT EXISTS %s '
+                    '(_id TEXT PRIMARY KEY, %s, doc BLOB)' % (
+                        table, ', '.join(columns)
+                    )
+                )
+                self.conn.execute(
+                    'CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)' % (
+                        table, columns[0], table, columns[0]
+                    )
+                )
+
+    def create_volume(self, volname, delete_existing=True):
+        """create a volume, clearing previous entries"""
+        if delete_existing:
+            with self.lock:
+                self.conn.execute(
+                    'DELETE FROM inodes WHERE dev = ?', (volname,)
+                )
+
+    def load_volume(self, volname, keep_seen=False):
+        """get the (size, mtime, ctime) of each inode in a volume, by _id"""
+        retval = {}
+        unseen = [] # from an incremental import which didn't finish
+        for inode in self.documents('inodes', volname):
+            if 'seen' in inode and not keep_seen:
+                del inode['seen']
+                unseen.append(inode)
+            if 'parts' not in inode.get('details', {}):
+                retval[inode['_id']] = known_inode(inode)
+        with self.lock:
+            self.put('inodes', unseen)
+        return retval
+
+    def finish_volume(self, volname, run):
+        """complete an incremental import of a volume; see utils"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute(
+                'DELETE FROM inodes WHERE dev = ? AND '
+                '(run IS NULL OR run != ?)', (volname, str(run))
+            )
+            inodes = []
+            for (doc,) in self.conn.execute(
+                    'SELECT doc FROM inodes WHERE dev = ? AND run = ?',
+                    (volname, str(run))):
+                inode = decode(doc)
+                inode['paths'] = inode.pop('seen', inode.get('paths'))
+                inodes.append(inode)
+            self.put('inodes', inodes)
+            self.conn.execute('COMMIT')
+
+    def has_analysis(self, _id, version):
+        """true if version of the analysis _id is stored"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT 1 FROM analyses WHERE _id = ? AND version = ?',
+                (_id, version)
+            ).fetchone() is not None
+
+    def writer(self, name, before=None):
+        """get a BulkWriter for a table"""
+        return SQLiteWriter(
+            self, name, settings.DB_BATCH_SIZE, settings.DB_FLUSH_INTERVAL,
+            before
+        )
+
+    def documents(self, table, volname=None):
+        """generate the documents in a table; just volname's for inodes"""
+        if volname is None:
+            cursor = self.conn.execute('SELECT doc FROM %s' % table)
+        else:
+            cursor = self.conn.execute(
+                'SELECT doc FROM %s WHERE dev = ?' % table, (volname,)
+            )
+        for (doc,) in cursor:
+            yield decode(doc)
+
+    def get(self, table, ids):
+        """get the documents with ids from a table, by _id"""
+        retval = {}
+        ids = list(ids)
+        for i in range(0, len(ids), LOOKUP_SIZE):
+            chunk = ids[i:i+LOOKUP_SIZE]
+            for _id, doc in self.conn.execute(
+                    'SELECT _id, doc FROM %s WHERE _id IN (%s)' % (
+                        table, ', '.join('?' * len(chunk))
+                    ), chunk):
+                retval[_id] = decode(doc)
+        return retval
+
+    def put(self, table, docs):
+        """insert or replace documents in a table"""
+        columns = self.TABLES[table]
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO %s (_id, %s, doc) VALUES (?, %s, ?)' % (
+                table, ', '.join(columns), ', '.join('?' * len(columns))
+            ),
+            [
+                [doc['_id']] +
+                [column_value(doc.get(column)) for column in columns] +
+                [encode(doc)]
+                for doc in docs
+            ]
+        )
+
+
+class SQLiteWriter(BulkWriter):
+    """BulkWriter which applies its batches to a SQLiteStorage table
+
+    Each batch is applied in one transaction; the documents are read,
+    updated and written back while holding the database's write lock, so
+    workers updating the same document (links to an inode) don't race.
+    """
+
+    def __init__(self, storage, table, batch_size, interval=None,
+                 before=None):
+        """create a writer for table"""
+        self.storage = storage
+        self.table = table
+        super(SQLiteWriter, self).__init__(
+            None, batch_size, interval, before
+        )
+
+    def write(self, ops, retry=True):
+        """apply ops to the table"""
+        storage = self.storage
+        with storage.lock:
+            storage.conn.execute('BEGIN IMMEDIATE')
+            try:
+                docs = storage.get(
+                    self.table, set(f['_id'] for f, _, _ in ops)
+                )
+                changed = {}
+                for filter, update, upsert in ops:
+                    doc = docs.get(filter['_id'])
+                    if doc is None and not upsert:
+                        continue
+                    inserting = doc is None
+                    if inserting:
+                        doc = docs[filter['_id']] = { '_id': filter['_id'] }
+                    apply_update(doc, update, inserting)
+                    changed[filter['_id']] = doc
+                storage.put(self.table, changed.values())
+            except Exception:
+                storage.conn.execute('ROLLBACK')
+                raise
+            storage.conn.execute('COMMIT')
+
+
+def apply_update(doc, update, inserting):
+    """apply the subset of mongo update operators we use to doc"""
+    for op, fields in update.items():
+        if op == '$set' or (op == '$setOnInsert' and inserting):
+            doc.update(fields)
+        elif op == '$addToSet':
+            for field, value in fields.items():
+                values = doc.setdefault(field, [])
+                if value not in values:
+                    values.append(value)
+        elif op != '$setOnInsert':
+            raise ValueError('unsupported update operator: %s' % op)
+
+
+def referring(inodes, ids):
+    """generate inodes, adding the ids of the analyses they refer to to ids"""
+    for inode in inodes:
+        ids.update((inode.get('details') or {}).get('analyses', {}).values())
+        yield inode
+
+
+def fetch(source, table, ids):
+    """generate the documents with ids from a storage's table"""
+    for i in range(0, len(ids), LOOKUP_SIZE):
+        docs = source.get(table, ids[i:i+LOOKUP_SIZE])
+        for _id in ids[i:i+LOOKUP_SIZE]:
+            if _id in docs:
+                yield docs[_id]
+
+
+def known_inode(inode):
+    """get the (size, mtime, ctime) load_volume returns for an inode
+
+    These are None for an inode whose only write so far is from add_link.
+    Files with parts aren't returned, so are always imported again; their
+    parts have to be found again to be kept.
+    """
+    return (inode.get('size'), inode.get('mtime'), inode.get('ctime'))
+
+
+def column_value(value):
+    """convert a document value for an sqlite column"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return '%s' % value # ObjectId etc
+
+
+def encode(doc):
+    """BSON encode a document"""
+    return sqlite3.Binary(bson.BSON.encode(doc))
+
+
+def decode(data):
+    """decode a BSON document"""
+    return bson.BSON(bytes(data)).decode()
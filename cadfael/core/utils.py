@@ -2,26 +2,102 @@
 # pylint: disable=W0621,C0103,R0903,C0326
 from __future__ import unicode_literals, print_function
 
-from pymongo import MongoClient, ASCENDING
+import itertools
+import threading
+from multiprocessing.util import Finalize
 
 from cadfael.conf import settings
+from cadfael.core import storage
 
 
 def create_volume(volname, delete_existing=True):
     """create a volume in the DB, clearing previous entries"""
-    if delete_existing:
-        # delete the old records in this volume
-        db = settings.DB
-        db.inodes.delete_many({ 'dev': volname })
+    settings.STORAGE.create_volume(volname, delete_existing)
 
-    # now create it and setup indexes
-    db.inodes.create_index([('dev', ASCENDING)])
-    db.inodes.create_index([('chmod', ASCENDING)])
-    db.inodes.create_index([('paths', ASCENDING)])
+
+def load_volume(volname, keep_seen=False):
+    """get the (size, mtime, ctime) of each inode in a volume, by _id
+
+    Unless keep_seen is True, the routes collected by an incremental import
+    which didn't finish are forgotten.
+    """
+    return settings.STORAGE.load_volume(volname, keep_seen)
+
+
+def finish_volume(volname, run):
+    """complete an incremental import of a volume
+
+    Removes the inodes which weren't seen by the run, and replaces the
+    routes of those that were with the ones the run found.
+    """
+    settings.STORAGE.finish_volume(volname, run)
 
 
 def fork():
-    """helper function to recreate DB connection in a child"""
-    db = settings.DBADDR.split(':')
-    db[1] = int(db[1])
-    settings.DB = MongoClient(db[0], db[1]).cadfael
+    """helper function to recreate DB connection and writer in a child"""
+    # the connection's made by the first query, not while the pool's forking
+    settings.STORAGE = storage.connect(settings.DBADDR, connect=False)
+    settings.ANALYSIS_WRITER = settings.STORAGE.writer('analyses')
+    # inodes refer to analyses, so those are always written first
+    settings.WRITER = settings.STORAGE.writer(
+        'inodes', settings.ANALYSIS_WRITER
+    )
+    # flush whatever is buffered when the worker exits
+    Finalize(settings.WRITER, settings.WRITER.close, exitpriority=10)
+    Finalize(
+        settings.ANALYSIS_WRITER,
+        settings.ANALYSIS_WRITER.close,
+        exitpriority=10
+    )
+
+
+class BoundedFeed(object):
+    """Iterator which hands out chunks of iterable, at most limit at a time
+
+    Every chunk taken from the feed must be handed back with release() once
+    it's been processed; until then the feed blocks.  This gives
+    Pool.imap_unordered (which otherwise drains its input as fast as it can)
+    backpressure.
+    """
+
+    def __init__(self, iterable, chunksize, limit):
+        """create a feed over iterable"""
+        self.iterable = iter(iterable)
+        self.chunksize = chunksize
+        self.cond = threading.Condition()
+        self.slots = limit # chunks which can be handed out
+        self.stopped = False
+        self.fed = 0 # number of items handed out
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.cond:
+            while self.slots == 0 and not self.stopped:
+                self.cond.wait()
+            if self.stopped:
+                raise StopIteration
+            self.slots -= 1
+        chunk = list(itertools.islice(self.iterable, self.chunksize))
+        if len(chunk) == 0:
+            raise StopIteration
+        self.fed += len(chunk)
+        return chunk
+    next = __next__ # python 2
+
+    def release(self):
+        """mark a chunk as processed, allowing another to be fed"""
+        with self.cond:
+            self.slots += 1
+            self.cond.notify()
+
+    def stop(self):
+        """stop feeding chunks; anything already in flight is unaffected
+
+        Whatever's waiting for a chunk is woken, and gets none; so a pool's
+        task handler can't be left blocked here when it's terminated.
+        """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
@@ -0,0 +1,101 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import socket
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, ReturnDocument
+
+
+class WorkQueue(object):
+    """Work items in a mongo collection, claimed by workers with leases
+
+    Each item is a directory of a volume to import; { '_id':
+    'volume:route', 'volume': volume, 'top': top, 'route': route, 'state':
+    'queued' | 'claimed' | 'done', 'owner': owner, 'expires': time }.  A
+    claimed item's lease has to be renewed before it expires, otherwise the
+    worker is presumed dead and the item can be claimed by another.  Lease
+    times are the workers' clocks, so hosts need to be roughly in sync.
+    """
+
+    def __init__(self, collection, lease, owner=None):
+        """create a queue on collection, with lease second leases"""
+        self.collection = collection
+        self.lease = timedelta(seconds=lease)
+        if owner is None:
+            owner = '%s:%u' % (socket.gethostname(), os.getpid())
+        self.owner = owner
+        collection.create_index([('state', ASCENDING), ('expires', ASCENDING)])
+        collection.create_index([('volume', ASCENDING)])
+
+    def publish(self, volume, top, routes):
+        """queue directories; those which already have an item are ignored"""
+        for route in routes:
+            self.collection.update_one(
+                { '_id': '%s:%s' % (volume, route) },
+                {
+                    '$setOnInsert': {
+                        'volume': volume,
+                        'top': top,
+                        'route': route,
+                        'state': 'queued',
+                        'owner': None,
+                        'expires': None
+                    }
+                },
+                True
+            )
+
+    def claim(self):
+        """claim a queued item, or one whose lease has expired; or None"""
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {
+                '$or': [
+                    { 'state': 'queued' },
+                    { 'state': 'claimed', 'expires': { '$lt': now } }
+                ]
+            },
+            {
+                '$set': {
+                    'state': 'claimed',
+                    'owner': self.owner,
+                    'expires': now + self.lease
+                },
+                '$inc': { 'attempts': 1 }
+            },
+            sort=[('state', ASCENDING)], # expired claims first
+            return_document=ReturnDocument.AFTER
+        )
+
+    def renew(self, item):
+        """extend the lease on an item; false if it's been lost"""
+        return self.collection.update_one(
+            { '_id': item['_id'], 'owner': self.owner, 'state': 'claimed' },
+            { '$set': { 'expires': datetime.utcnow() + self.lease } }
+        ).matched_count == 1
+
+    def complete(self, item, summary):
+        """mark an item done, with a summary of what was imported"""
+        return self.collection.update_one(
+            { '_id': item['_id'], 'owner': self.owner, 'state': 'claimed' },
+            { '$set': { 'state': 'done', 'summary': summary } }
+        ).matched_count == 1
+
+    def outstanding(self, volume=None):
+        """get the number of items which aren't done"""
+        query = { 'state': { '$ne': 'done' } }
+        if volume is not None:
+            query['volume'] = volume
+        return self.collection.count_documents(query)
+
+    def summaries(self, volume):
+        """generate the summaries of a volume's done items"""
+        for item in self.collection.find(
+                { 'volume': volume, 'state': 'done' }, { 'summary': True }):
+            yield item['summary']
+
+    def clear(self, volume):
+        """remove all of a volume's items"""
+        self.collection.delete_many({ 'volume': volume })
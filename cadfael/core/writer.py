@@ -0,0 +1,106 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import time
+import threading
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+# error code mongo returns when two upserts of the same _id race
+DUPLICATE_KEY = 11000
+
+
+class BulkWriter(object):
+    """Buffers updates to a collection and writes them with bulk_write
+
+    update_one takes the same arguments as Collection.update_one, but the
+    update is only sent once batch_size updates are buffered, the oldest has
+    been buffered for interval seconds, or flush/close are called.  As the
+    batches are unordered, the updates to a document must give the same
+    result in any order.  $setOnInsert and $addToSet always do; $set does
+    as we use it, as each document is only $set by the one process which
+    analysed it, once per import (store_inode of an inode; hardlinks and
+    archive links only $addToSet), or with values which don't depend on
+    who sets them (an analysis is a function of the content and analyser
+    version; an incremental import's run is the same for all).  Anything
+    which could $set a document twice with different values must flush
+    in between.
+
+    If before is another writer, it's flushed before each of this writer's
+    batches; so nothing this writes refers to something it hasn't written.
+
+    sequence counts the updates buffered, and written how many of them have
+    been written (and acknowledged by the db); so once written reaches the
+    sequence at some point, everything buffered up to then is stored.
+    """
+
+    def __init__(self, collection, batch_size, interval=None, before=None):
+        """create a writer for collection"""
+        self.collection = collection
+        self.batch_size = batch_size
+        self.interval = interval
+        self.before = before
+        self.ops = []
+        self.oldest = None
+        self.sequence = 0
+        self.written = 0
+        self.lock = threading.RLock()
+        self.closed = threading.Event()
+        if interval:
+            # flush periodically, so a quiet worker doesn't sit on updates
+            t = threading.Thread(target=self.flusher)
+            t.daemon = True
+            t.start()
+
+    def update_one(self, filter, update, upsert=False):
+        """buffer an update, writing the batch if its full"""
+        with self.lock:
+            if len(self.ops) == 0:
+                self.oldest = time.time()
+            self.ops.append((filter, update, upsert))
+            self.sequence += 1
+            if len(self.ops) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """write all buffered updates"""
+        with self.lock:
+            ops = self.ops
+            sequence = self.sequence
+            self.ops = []
+            self.oldest = None
+            if len(ops) > 0:
+                if self.before is not None:
+                    self.before.flush()
+                self.write(ops)
+            self.written = sequence
+
+    def write(self, ops, retry=True):
+        """bulk write ops, retrying those which lost an upsert race"""
+        try:
+            self.collection.bulk_write([
+                UpdateOne(filter, update, upsert=upsert)
+                for filter, update, upsert in ops
+            ], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            failed = [err for err in errors if err['code'] != DUPLICATE_KEY]
+            if retry is False or len(failed) > 0:
+                raise
+            # the documents now exist, so the retry will just update them
+            self.write([ops[err['index']] for err in errors], False)
+
+    def flusher(self):
+        """thread; flushes updates which have been buffered too long"""
+        while not self.closed.wait(self.interval / 2.0):
+            with self.lock:
+                if (self.oldest is not None and
+                        time.time() - self.oldest >= self.interval):
+                    self.flush()
+
+    def close(self):
+        """flush any buffered updates and stop the flusher"""
+        self.closed.set()
+        self.flush()
@@ -2,127 +2,671 @@
 # pylint: disable=W0621,C0103,R0903,C0326
 from __future__ import unicode_literals, print_function
 
+import io
 import os
-import signal
 import stat
-import hashlib
+import threading
 from datetime import datetime
-import multiprocessing
-import magic
-from ctypes import *
-from ctypes.util import find_library
+from bson import ObjectId
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir # python 2
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full # python 2
 
 import cadfael.core.signals
 from cadfael.conf import settings
-from cadfael.core.utils import fork
+from cadfael.core.archive import members, archive_kind, file_kind, HEAD
+from cadfael.core.archive import ERRORS as ARCHIVE_ERRORS
+from cadfael.core import sniff, metadata
+from cadfael.core.content import Content
+from cadfael.core.journal import Journal
+from cadfael.core.stats import stats, Progress
+from cadfael.core.utils import BoundedFeed, load_volume, finish_volume
+from cadfael.core import pool
+from cadfael.core.pool import run_pool
 
 
-def import_tree(volume_name, top):
-    """import all files rooted at top"""
-    # we have to do this magic as otherwise we can't properly ctrl-c
+def import_tree(volume_name, top, incremental=False, progress=False,
+                resume=False):
+    """import all files rooted at top, returning a summary of the import
+
+    Paths are streamed to the pool as they are walked; at most
+    settings.IMPORT_BACKLOG paths are in flight at any time, so walking,
+    analysis and writing overlap and the parent's memory stays flat.
+
+    If incremental is True the volume isn't expected to be empty; inodes
+    whose size, mtime and ctime match what's stored aren't re-analysed, and
+    those which are no longer in the tree are removed.
+
+    Progress is journalled (see Journal) in settings.JOURNALS.  If resume
+    is True the import the journal is from is carried on; the entries of
+    the directories it finished are skipped, and inodes already stored
+    aren't analysed again.  incremental is taken from the journal.
+
+    Files which any inode receiver wants are analysed by a pool of their
+    own, largest first, while the walk carries on (see pool.Analysis).
+
+    If top is an archive (see import_archive) its members are imported.
+
+    Per-stage timings from the workers are returned in summary['stats'],
+    and if progress is True a live progress line is written to stderr.
+    """
+    if os.path.isfile(top):
+        if incremental or resume:
+            raise ValueError('archives can only be imported afresh')
+        return import_archive(volume_name, top, progress)
     if top[-1] != os.path.sep:
         top += os.path.sep
-    original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-    pool = multiprocessing.Pool(initializer=fork)
-    signal.signal(signal.SIGINT, original_sigint_handler)
+    journal = Journal(journal_path(volume_name))
+    known, run = None, None
+    if resume:
+        header = journal.load()
+        if header['top'] != top:
+            journal.close()
+            raise ValueError(
+                'journal is of an import of %s, not %s' % (header['top'], top)
+            )
+        incremental = header['run'] is not None
+        if incremental:
+            run = ObjectId(header['run'])
+        known = load_volume(volume_name, keep_seen=incremental)
+    else:
+        if incremental:
+            known, run = load_volume(volume_name), ObjectId()
+        journal.create({
+            'volume': volume_name,
+            'top': top,
+            'run': str(run) if run is not None else None
+        })
+    feed = BoundedFeed(
+        list_tree(volume_name, top, journal=journal),
+        settings.IMPORT_CHUNKSIZE,
+        max(settings.IMPORT_BACKLOG // settings.IMPORT_CHUNKSIZE, 1)
+    )
+    progress = Progress() if progress else None
     try:
-        res = pool.map_async(get_inode, list_tree(volume_name, top))
-        while True:
+        summary, completed, flushed = run_pool(
+            import_inodes, feed, (known, run), progress, journal,
+            analyse_inode
+        )
+    except Exception:
+        journal.close()
+        raise
+    if completed and incremental:
+        # all the workers have exited, so all their writes are flushed
+        finish_volume(volume_name, run)
+    if flushed:
+        journal.commit(force=True)
+    journal.close(remove=completed)
+    if progress is not None:
+        progress.finish(summary)
+    return summary
+
+
+def journal_path(volume_name):
+    """get the path of the journal of imports of a volume"""
+    return os.path.join(settings.JOURNALS, '%s.journal' % volume_name)
+
+
+def import_archive(volume_name, path, progress=False):
+    """import the members of the archive at path, returning a summary
+
+    Archives (see cadfael.core.archive) are read as they are stored, without
+    being extracted to disk, and the members are handed to the pool with
+    their content.  Members which are archives are imported recursively,
+    down to settings.ARCHIVE_DEPTH, with routes under the member's.  Inodes'
+    _ids are the volume and route, as members have no inode numbers.  Raises
+    ValueError if path isn't an archive; e.g. it's compressed, but not a tar.
+    """
+    kind = file_kind(path)
+    if kind is None:
+        raise ValueError('not a directory or archive: %s' % path)
+    with open(path, 'rb') as f:
+        feed = BoundedFeed(
+            batch_members(list_archive(volume_name, f, path, kind)),
+            1,
+            max(settings.ARCHIVE_BACKLOG // settings.ARCHIVE_CHUNK, 1)
+        )
+        progress = Progress() if progress else None
+        summary, _, _ = run_pool(import_members, feed, (None, None), progress)
+    if progress is not None:
+        progress.finish(summary)
+    return summary
+
+
+def list_tree(volume_name, top, threads=None, journal=None):
+    """walk the tree rooted at top, yielding (volume_name, top, path, isdir)
+
+    Directories are listed with scandir, so the type of each entry normally
+    comes from the directory itself rather than a stat.  Symlinks aren't
+    followed.  With threads > 1 (settings.WALK_THREADS by default) that many
+    directories are listed concurrently, which helps on slow or network
+    filesystems.
+
+    Hardlinks are only yielded once; subsequent links to an inode are
+    yielded with its st_ino appended, (volume_name, top, path, False, ino),
+    and get_inode just adds the path to it rather than re-analysing it.
+    The inode of every regular file is remembered for this, as telling
+    which have other links would take a stat of each.
+
+    If journal is given each directory listed is noted in it; the entries
+    of those it has as done aren't yielded.
+    """
+    if threads is None:
+        threads = settings.WALK_THREADS
+    if threads > 1:
+        walk = walk_parallel(top, threads)
+    else:
+        walk = walk_serial(top)
+    links = set() # (st_dev, st_ino) of each regular file yielded
+    for entries in walk:
+        wanted = journal is None or journal.listed(entries)
+        # links are still noted if unwanted; they're the ones stored by the
+        # import which did this directory
+        args = link_args(volume_name, top, entries, links)
+        if wanted:
+            for arg in args:
+                yield arg
+
+
+def link_args(volume_name, top, entries, links):
+    """get the get_inode args of scan_dir's entries
+
+    links is the set of (st_dev, st_ino) already seen, and is added to;
+    entries linking to one of them get its st_ino appended.
+    """
+    retval = []
+    for path, isdir, link in entries:
+        if link is None:
+            retval.append((volume_name, top, path, isdir))
+        elif link in links:
+            retval.append((volume_name, top, path, isdir, link[1]))
+        else:
+            links.add(link)
+            retval.append((volume_name, top, path, isdir))
+    return retval
+
+
+def import_directory(volume_name, top, path, links):
+    """import the entries of a directory, for a distributed import
+
+    Returns the paths of its subdirectories, and import_inodes' list of
+    (path, fmt, size) and stats.  links is as for link_args.
+    """
+    entries = scan_dir(path)
+    out, collected, _ = import_inodes(
+        link_args(volume_name, top, entries, links)
+    )
+    return [p for p, isdir, _ in entries if isdir], out, collected
+
+
+def walk_serial(top):
+    """list the directories under top, yielding each one's entries"""
+    stack = [top]
+    while len(stack) > 0:
+        entries = scan_dir(stack.pop())
+        yield entries
+        stack.extend([path for path, isdir, _ in entries if isdir])
+
+
+def walk_parallel(top, threads):
+    """list the directories under top on several threads
+
+    The threads only list directories; this generator hands them each
+    subdirectory found, so it knows when the walk is complete.  The results
+    queue is bounded, so the threads don't run far ahead of the consumer.
+    """
+    todo = Queue()
+    done = Queue(threads * 16)
+    stopped = threading.Event()
+    for _ in range(threads):
+        t = threading.Thread(target=scan_worker, args=(todo, done, stopped))
+        t.daemon = True
+        t.start()
+    try:
+        todo.put(top)
+        pending = 1
+        while pending > 0:
+            entries = done.get()
+            pending -= 1
+            for path, isdir, _ in entries:
+                if isdir:
+                    todo.put(path)
+                    pending += 1
+            yield entries
+    finally:
+        stopped.set()
+        for _ in range(threads):
+            todo.put(None)
+
+
+def scan_worker(todo, done, stopped):
+    """thread; lists the directories in todo until given None"""
+    while not stopped.is_set():
+        path = todo.get()
+        if path is None:
+            break
+        entries = scan_dir(path)
+        while not stopped.is_set():
             try:
-                out = res.get(60)
+                done.put(entries, timeout=1)
                 break
-            except multiprocessing.TimeoutError:
-                pass # ignore and try again
-        #print(len(out))
-    except KeyboardInterrupt:
-        pool.terminate()
-    else:
-        pool.close()
-    pool.join()
+            except Full:
+                pass # consumer is busy, try again
+
 
+def scan_dir(path):
+    """list a directory, returning a list of (path, isdir, link)
 
-def list_tree(volume_name, top):
-    """Simplified version of os.walk"""
-    # https://hg.python.org/cpython/file/29f0836c0456/Lib/os.py#l276
+    link is (st_dev, st_ino) for regular files, and None otherwise.  The
+    inode number comes from the directory entry and the device is the
+    directory's (a file can't be a mount point), so the entries are only
+    stat'd if the filesystem doesn't give their type.
+    """
+    retval = []
     try:
-        names = os.listdir(top)
-    except IOError:
-        return
+        dev = os.lstat(path).st_dev
+        for entry in scandir(path):
+            isdir = False
+            link = None
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    isdir = True
+                elif entry.is_file(follow_symlinks=False):
+                    link = (dev, entry.inode())
+            except OSError:
+                pass # d_type unknown and the stat failed
+            retval.append((entry.path, isdir, link))
+    except (IOError, OSError):
+        pass # permission denied, or it's gone
+    return retval
 
-    for name in names:
-        path = os.path.join(top, name)
-        isdir = os.path.isdir(path)
-        yield volume_name, top, path, isdir
-        if isdir:
-            for volume_name, _, path, isdir in list_tree(volume_name, path):
-                yield volume_name, top, path, isdir
 
+def get_inode(arg, deferred=None):
+    """extract the info for an inode
 
-def get_inode(arg):
-    """extract the info for an inode"""
-    volume_name, top, path, isdir = arg
-    db = settings.DB
+    If deferred is a list, files which inode receivers want aren't analysed
+    or stored; (path, route, inode) is appended to it for analyse_inode.
+    The parts of files (see import_parts) are left to it too, appending
+    (path, route, inode, parts) for each chunk of them.
+    """
+    volume_name, top, path, isdir = arg[:4]
     inode = None
-    if isdir:
+    route = path[len(top)-1:]
+    if len(arg) > 4:
+        # another link to an inode which has already been dispatched
+        add_link(volume_name, arg[4], route)
+    elif isdir:
         try:
             inode = get_base_inode(volume_name, path)
-            cadfael.core.signals.inode(inode, path)
-            route = path[len(top)-1:]
-            db.inodes.update_one(
-                { '_id': inode['_id'] },
-                {
-                    '$setOnInsert': inode,
-                    '$addToSet': { 'paths': route }
-                },
-                True
-            )
+            fresh = changed(inode)
+            if fresh:
+                cadfael.core.signals.inode(inode, path)
+            store_inode(inode, route, fresh)
         except IOError:
             pass # permission denied
     else:
         try:
             inode = get_base_inode(volume_name, path)
             fmt = inode['fmt']
-            if fmt == 'l':
-                # symlink
-                inode['details'] = {
-                    'readlink': os.readlink(path)
-                }
-            elif fmt in ('s', 'p'):
-                # sock or pipe
-                raise NotImplementedError('socket or pipe: %s' % fmt) # XXX
+            if fmt in ('s', 'p'):
+                # sock or pipe
+                raise NotImplementedError('socket or pipe: %s' % fmt) # XXX
             elif fmt in ('c', 'b'):
                 # device
                 raise NotImplementedError('device: %s' % fmt) # XXX
-            else:
-                # file
+            fresh = changed(inode)
+            if fresh and fmt == 'l':
+                # symlink
                 inode['details'] = {
-                    'mime_type': magic.from_file(path, mime=True),
-                    'sha256': sha256_file(path)
+                    'readlink': os.readlink(path)
                 }
-            cadfael.core.signals.inode(inode, path)
-            route = path[len(top)-1:]
-            db.inodes.update_one(
-                { '_id': inode['_id'] },
-                {
-                    '$setOnInsert': inode,
-                    '$addToSet': { 'paths': route }
-                },
-                True
-            )
+                cadfael.core.signals.inode(inode, path)
+            elif fresh:
+                # file; read once, and shared by everything looking at it
+                with stats.timer('open'):
+                    content = Content(path)
+                with content:
+                    inode['details'] = get_details(content)
+                    parts = get_parts(inode, path, content)
+                    if deferred is not None:
+                        for chunk in batch_parts(parts):
+                            deferred.append((path, route, inode, chunk))
+                        parts = []
+                        if cadfael.core.signals.inode.receives(inode, path):
+                            deferred.append((path, route, inode))
+                            return inode
+                    cadfael.core.signals.inode(inode, path, content=content)
+                    import_parts(inode, path, route, content, parts)
+            store_inode(inode, route, fresh)
         except IOError:
             pass # permission denied
     return inode
 
 
+def changed(inode):
+    """false if an incremental import already has this inode, unchanged"""
+    if pool.worker.known is None:
+        return True
+    return pool.worker.known.get(inode['_id']) != (
+        inode['size'],
+        to_millis(inode['mtime']),
+        to_millis(inode['ctime'])
+    )
+
+
+def to_millis(dt):
+    """truncate a datetime to the millisecond precision mongo stores"""
+    return dt.replace(microsecond=dt.microsecond - dt.microsecond % 1000)
+
+
+def store_inode(inode, route, fresh=True):
+    """write inode, and the route it was found at, to the db
+
+    The inode is written with $set, rather than $setOnInsert, as add_link
+    may already have created the document for another link to it.  In an
+    incremental import unchanged inodes are just stamped with the run, and
+    the routes are also collected in 'seen' so finish_volume can drop those
+    which have gone.
+    """
+    values = {}
+    if fresh:
+        values = dict(inode)
+        del values['_id']
+    paths = { 'paths': route }
+    if pool.worker.run is not None:
+        values['run'] = pool.worker.run
+        paths['seen'] = route
+    update = { '$addToSet': paths }
+    if len(values) > 0:
+        update['$set'] = values
+    with stats.timer('write'):
+        settings.WRITER.update_one({ '_id': inode['_id'] }, update, True)
+
+
+def add_link(volume_name, ino, route):
+    """add a route to an inode, without analysing it again
+
+    ino is the inode number, or for archive members the target's route.
+    """
+    paths = { 'paths': route }
+    if pool.worker.run is not None:
+        paths['seen'] = route
+    with stats.timer('write'):
+        settings.WRITER.update_one(
+            { '_id': '%s:%s' % (volume_name, ino) },
+            {
+                '$setOnInsert': { 'dev': volume_name },
+                '$addToSet': paths
+            },
+            True
+        )
+
+
+def import_inodes(args):
+    """pool worker; import a chunk of inodes
+
+    Returns a list of (path, fmt, size), along with the stats collected
+    while importing them and the task's ack (see Worker.acknowledge).  The full
+    inodes are deliberately not returned, so
+    the parent doesn't have to unpickle (or hold) every document in the tree;
+    except those of files deferred for the analysis pool, which are returned
+    as (path, fmt, size, job); once for each job, if there's more than one.
+    """
+    retval = []
+    deferred = [] if pool.worker.defer else None
+    for arg in args:
+        queued = len(deferred) if deferred is not None else 0
+        try:
+            inode = get_inode(arg, deferred)
+        except NotImplementedError:
+            inode = None # sockets, pipes and devices
+        if len(arg) > 4:
+            retval.append((arg[2], '-', 0)) # content counted at first link
+        elif deferred and len(deferred) > queued:
+            for job in deferred[queued:]:
+                retval.append((arg[2], inode['fmt'], inode['size'], job))
+        elif inode is None:
+            retval.append((arg[2], None, 0))
+        else:
+            retval.append((arg[2], inode['fmt'], inode['size']))
+    return retval, stats.collect(), pool.worker.acknowledge()
+
+
+def analyse_inode(job):
+    """analysis pool worker; run the inode receivers on a deferred file
+
+    job is (path, route, inode) from import_inodes; the inode is stored
+    once the receivers have added to it.  Or it's (path, route, inode,
+    parts), and the parts are imported; see analyse_parts.  Returns the same
+    as import_inodes, for just this file.
+    """
+    if len(job) > 3:
+        return analyse_parts(job)
+    path, route, inode = job
+    try:
+        with stats.timer('open'):
+            content = Content(path)
+        with content:
+            if content.size != inode['size']:
+                # it's changed since it was hashed
+                inode['size'] = content.size
+                inode['details'] = get_details(content)
+            cadfael.core.signals.inode(inode, path, content=content)
+    except IOError:
+        pass # it's gone since; store what we know
+    store_inode(inode, route)
+    return (
+        [(path, inode['fmt'], inode['size'])], stats.collect(),
+        pool.worker.acknowledge()
+    )
+
+
+def analyse_parts(job):
+    """analysis pool worker; import a chunk of the parts of a file
+
+    job is (path, route, inode, parts) from import_inodes.  The file's
+    content is kept open between jobs, so each worker maps it just once
+    however many chunks of its parts it's given; the workers share the
+    pages.
+    """
+    worker = pool.worker
+    path, route, inode, parts = job
+    try:
+        if worker.container is not None and worker.container.path != path:
+            worker.container.close()
+            worker.container = None
+        if worker.container is None:
+            with stats.timer('open'):
+                worker.container = Content(path)
+        if worker.container.size == inode['size']:
+            import_parts(inode, path, route, worker.container, parts)
+        # otherwise it's changed since; the next import will have its parts
+    except IOError:
+        pass # it's gone since
+    return (
+        [(path, inode['fmt'], inode['size'])], stats.collect(),
+        pool.worker.acknowledge()
+    )
+
+
+def get_parts(inode, path, content):
+    """get the Parts of a file from the parts receivers
+
+    The number found is added to the inode's details, as parts.
+    """
+    retval = []
+    for _, parts in cadfael.core.signals.parts(inode, path, content=content):
+        retval.extend(parts or [])
+    if len(retval) > 0:
+        inode['details']['parts'] = len(retval)
+    return retval
+
+
+def batch_parts(parts):
+    """group a file's parts into chunks for the analysis pool"""
+    size = settings.IMPORT_CHUNKSIZE
+    return [parts[i:i+size] for i in range(0, len(parts), size)]
+
+
+def import_parts(container, path, route, content, parts):
+    """import the Parts of a file (e.g. the images in a dyld shared cache)
+
+    Each part is an inode of its own, beneath the container's route and
+    with its metadata, and with the container's _id as container.  The
+    inode receivers are given a view of the container's content (see
+    Content.view), and the path of the container plus the part's name.
+    """
+    for part in parts:
+        part_route = route + part.name
+        label = path + part.name
+        inode = dict(container)
+        inode.update({
+            '_id': '%s:%s' % (container['dev'], part_route),
+            'size': part.size,
+            'container': container['_id']
+        })
+        view = content.view(label, part)
+        inode['details'] = get_details(view)
+        cadfael.core.signals.inode(inode, label, content=view)
+        store_inode(inode, part_route)
+
+
+def list_archive(volume_name, fileobj, label, kind, prefix='', depth=0):
+    """generate (volume_name, label, route, member) for an archive's members
+
+    label is where the archive is (its path, with the route of nested
+    archives); it's the path receivers are given.
+    """
+    for member in members(fileobj, kind):
+        route = prefix + member.name
+        if member.fmt == 'h':
+            member = member._replace(linkname=prefix + member.linkname)
+        yield volume_name, label, route, member
+        if member.fmt == '-' and depth < settings.ARCHIVE_DEPTH:
+            nested = archive_kind(member.data[:HEAD])
+            if nested is None:
+                continue
+            try:
+                for arg in list_archive(
+                        volume_name, io.BytesIO(member.data),
+                        label + route, nested, route, depth + 1):
+                    yield arg
+            except ARCHIVE_ERRORS:
+                pass # damaged; the member itself is still imported
+
+
+def batch_members(args):
+    """group list_archive's members into chunks for the pool
+
+    A chunk is settings.IMPORT_CHUNKSIZE members or settings.ARCHIVE_CHUNK
+    bytes, whichever is reached first; so large members are spread across
+    the workers, and the memory held by the feed is bounded.
+    """
+    chunk = []
+    size = 0
+    for arg in args:
+        chunk.append(arg)
+        size += len(arg[3].data or b'')
+        if (len(chunk) >= settings.IMPORT_CHUNKSIZE or
+                size >= settings.ARCHIVE_CHUNK):
+            yield chunk
+            chunk = []
+            size = 0
+    if len(chunk) > 0:
+        yield chunk
+
+
+def import_members(chunks):
+    """pool worker; import a chunk of archive members (from batch_members)
+
+    Returns the same as import_inodes.
+    """
+    retval = []
+    for volume_name, label, route, member in chunks[0]:
+        try:
+            inode = get_member(volume_name, label, route, member)
+        except NotImplementedError:
+            inode = None # pipes and devices
+        if member.fmt == 'h':
+            retval.append((route, '-', 0)) # content counted at first link
+        elif inode is None:
+            retval.append((route, None, 0))
+        else:
+            retval.append((route, inode['fmt'], inode['size']))
+    return retval, stats.collect(), pool.worker.acknowledge()
+
+
+def get_member(volume_name, label, route, member):
+    """extract the info for an archive member, as get_inode does"""
+    if member.fmt == 'h':
+        add_link(volume_name, member.linkname, route)
+        return None
+    elif member.fmt not in ('d', 'l', '-'):
+        raise NotImplementedError('device or pipe: %s' % member.fmt) # XXX
+    path = label + route
+    inode = {
+        '_id': '%s:%s' % (volume_name, route),
+        'dev': volume_name,
+        'fmt': member.fmt,
+        'uid': member.uid,
+        'gid': member.gid,
+        'size': member.size,
+        'atime': member.mtime,
+        'mtime': member.mtime,
+        'ctime': member.mtime,
+        'chmod': get_chmod(member.fmt, member.mode),
+        'chflags': [],
+        'acl': None,
+        'details': {}
+    }
+    if member.fmt == 'l':
+        inode['details'] = {
+            'readlink': member.linkname
+        }
+        cadfael.core.signals.inode(inode, path)
+    elif member.fmt == '-':
+        content = Content.from_bytes(path, member.data)
+        with content:
+            inode['details'] = get_details(content)
+            parts = get_parts(inode, path, content)
+            cadfael.core.signals.inode(inode, path, content=content)
+            import_parts(inode, path, route, content, parts)
+    else:
+        cadfael.core.signals.inode(inode, path)
+    store_inode(inode, route)
+    return inode
+
+
+def profile_receiver(func, seconds, args):
+    """signals.inode profile hook; time each receiver, per path"""
+    stage = 'receiver:%s.%s' % (func.__module__.split('.')[-1], func.__name__)
+    stats.add(stage, seconds, args[1])
+
+cadfael.core.signals.inode.profile = profile_receiver
+cadfael.core.signals.parts.profile = profile_receiver
+
+
+def get_details(content):
+    """identify and hash a file's content"""
+    with stats.timer('hash', content.path):
+        details = content.digests(settings.DIGESTS)
+    if content.size == 0:
+        # what libmagic's from_file says for empty files
+        details['mime_type'] = 'inode/x-empty'
+    else:
+        details['mime_type'] = sniff.mime_type(content, details['sha256'])
+    return details
+
+
 def sha256_file(path):
     """generate the sha256 hash of a file"""
-    sha256 = hashlib.sha256()
-    with open(path, 'rb') as f:
-        data = f.read(4096)
-        while len(data) > 0:
-            sha256.update(data)
-            data = f.read(4096)
-    return sha256.hexdigest()
+    with Content(path) as content:
+        return content.digests(['sha256'])['sha256']
 
 
 def get_base_inode(volume_name, path):
@@ -137,8 +681,13 @@ def get_base_inode(volume_name, path):
         stat.S_IFIFO: 'p'
     }
 
-    st = os.lstat(path)
+    with stats.timer('lstat'):
+        st = os.lstat(path)
     tpe = st_type[stat.S_IFMT(st.st_mode)]
+    with stats.timer('chflags'):
+        chflags = metadata.chflags(path, st)
+    with stats.timer('acl'):
+        acl = metadata.acl(path, st)
     return {
         '_id': '%s:%u' % (volume_name, st.st_ino),
         'dev': volume_name,
@@ -150,8 +699,8 @@ def get_base_inode(volume_name, path):
         'mtime': datetime.utcfromtimestamp(st.st_mtime),
         'ctime': datetime.utcfromtimestamp(st.st_ctime),
         'chmod': get_chmod(tpe, stat.S_IMODE(st.st_mode)),
-        'chflags': get_chflags(st.st_flags),
-        'acl': get_acl(path),
+        'chflags': chflags,
+        'acl': acl,
         'details': {}
     }
 
@@ -190,47 +739,3 @@ def get_chmod(tpe, mode):
     )
 
 
-def get_chflags(flags):
-    """generate an array of chflag strings"""
-    retval = []
-    if flags & stat.SF_ARCHIVED != 0:
-        retval.append('archived')
-    if flags & stat.UF_OPAQUE != 0:
-        retval.append('opaque')
-    if flags & stat.UF_NODUMP != 0:
-        retval.append('nodump')
-    if flags & (stat.UF_APPEND | stat.SF_APPEND) != 0:
-        retval.append('sappend')
-    if flags & (stat.UF_IMMUTABLE | stat.SF_IMMUTABLE) != 0:
-        retval.append('uappend')
-    if flags & stat.UF_HIDDEN != 0:
-        retval.append('hidden')
-    return retval
-
-
-def get_acl(path):
-    retval = None
-    libc = cdll.LoadLibrary(find_library('c'))
-
-    # from <sys/acl.h>
-    ACL_TYPE_EXTENDED = 0x00000100
-
-    acl_get_file = libc.acl_get_file
-    acl_get_file.argtypes = [c_char_p, c_int]
-    acl_get_file.restype = c_void_p
-
-    acl_to_text = libc.acl_to_text
-    acl_to_text.argtypes = [c_void_p, POINTER(c_ssize_t)]
-    acl_to_text.restype = c_char_p
-
-    acl_free = libc.acl_free
-    acl_free.argtypes = [c_void_p]
-    acl_free.restype = c_int
-
-    acl = acl_get_file(path, ACL_TYPE_EXTENDED)
-    if acl:
-        retval = acl_to_text(acl, None)
-        acl_free(acl)
-    return retval
-
-
@@ -0,0 +1,195 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import struct
+
+from cadfael.core.content import Content, Part
+
+
+# from dyld's dyld_cache_format.h; offsets of dyld_cache_header fields
+MAPPING_OFFSET = 16 # mappingOffset, mappingCount
+IMAGES_OFFSET_OLD = 24 # imagesOffsetOld, imagesCountOld
+IMAGES_OFFSET = 0x1c0 # imagesOffset, imagesCount; if mappingOffset is past
+UUID_OFFSET = 0x58 # uuid
+SUBCACHE_OFFSET = 0x188 # subCacheArrayOffset, subCacheArrayCount
+SYMBOLS_UUID_OFFSET = 0x190 # symbolFileUUID
+CACHE_SUBTYPE_OFFSET = 0x1c8 # cacheSubType; new subcache entries if past
+
+# sizes of dyld_cache_mapping_info and dyld_cache_image_info
+MAPPING_SIZE = 32
+IMAGE_SIZE = 32
+
+# sizes of dyld_subcache_entry_v1 (macOS 12) and dyld_subcache_entry
+SUBCACHE_SIZE_V1 = 24
+SUBCACHE_SIZE = 56
+
+# from <mach-o/loader.h>
+MH_MAGIC = 0xfeedface
+MH_MAGIC_64 = 0xfeedfacf
+LC_SEGMENT = 0x1
+LC_SEGMENT_64 = 0x19
+
+
+def get_mappings(data):
+    """get the (address, size, file offset) of each of a cache's mappings"""
+    offset, count = struct.unpack_from('<II', data, MAPPING_OFFSET)
+    return [
+        struct.unpack_from('<QQQ', data, offset + i * MAPPING_SIZE)
+        for i in range(count)
+    ]
+
+
+def get_images(data):
+    """get the (path, address) of each image in a cache"""
+    mapping_offset = struct.unpack_from('<I', data, MAPPING_OFFSET)[0]
+    offset, count = struct.unpack_from('<II', data, IMAGES_OFFSET_OLD)
+    if count == 0 and mapping_offset >= IMAGES_OFFSET + 8:
+        # moved, in caches from macOS 11 on
+        offset, count = struct.unpack_from('<II', data, IMAGES_OFFSET)
+    retval = []
+    for i in range(count):
+        address, _, _, path_offset, _ = struct.unpack_from(
+            '<QQQII', data, offset + i * IMAGE_SIZE
+        )
+        retval.append((get_cstring(data, path_offset), address))
+    return retval
+
+
+def get_subcaches(data):
+    """get the (suffix, uuid) of each of a split cache's subcaches
+
+    Including its .symbols file, if it has one.  Subcaches are files
+    alongside the main cache, named with these suffixes; .1, .2 ... on
+    macOS 12, and whatever the entry says (e.g. .01) after.
+    """
+    mapping_offset = struct.unpack_from('<I', data, MAPPING_OFFSET)[0]
+    if mapping_offset < SUBCACHE_OFFSET + 8:
+        return [] # from before split caches
+    offset, count = struct.unpack_from('<II', data, SUBCACHE_OFFSET)
+    retval = []
+    for i in range(count):
+        if mapping_offset <= CACHE_SUBTYPE_OFFSET:
+            uuid = struct.unpack_from(
+                '<16s', data, offset + i * SUBCACHE_SIZE_V1
+            )[0]
+            suffix = '.%u' % (i + 1)
+        else:
+            uuid, _, suffix = struct.unpack_from(
+                '<16sQ32s', data, offset + i * SUBCACHE_SIZE
+            )
+            suffix = get_cstring(suffix, 0)
+        retval.append((suffix, uuid))
+    if mapping_offset >= SYMBOLS_UUID_OFFSET + 16:
+        uuid = struct.unpack_from('<16s', data, SYMBOLS_UUID_OFFSET)[0]
+        if uuid != b'\0' * 16:
+            retval.append(('.symbols', uuid))
+    return retval
+
+
+def get_main_images(data, path):
+    """get the images of the main cache of the subcache at path
+
+    The main cache is the file alongside named without the suffix; its
+    images are only used if it lists this file, by its suffix and uuid, as
+    one of its subcaches.  Otherwise (or if there's no main cache) [].
+    """
+    directory, name = os.path.split(path)
+    if '.' not in name:
+        return []
+    main, suffix = name.split('.', 1)
+    uuid = struct.unpack_from('<16s', data, UUID_OFFSET)[0]
+    try:
+        with Content(os.path.join(directory, main)) as content:
+            if (content.head(7) != b'dyld_v1' or
+                    ('.' + suffix, uuid) not in get_subcaches(content.data)):
+                return []
+            return get_images(content.data)
+    except (IOError, OSError, struct.error):
+        return [] # missing, or not a cache we understand
+
+
+def get_cstring(data, offset):
+    """get the nul terminated string at offset"""
+    end = data.find(b'\0', offset)
+    if end == -1:
+        end = len(data)
+    return data[offset:end].decode('utf-8', 'ignore')
+
+
+def to_offset(mappings, address):
+    """get the file offset of address, or None if it's not in this file"""
+    for start, size, offset in mappings:
+        if start <= address < start + size:
+            return offset + address - start
+    return None
+
+
+def get_text_size(data, offset):
+    """get the file size of the __TEXT segment of the image at offset
+
+    This starts with the mach header; it's the image's own content, as its
+    data and __LINKEDIT are mixed in with everyone else's.
+    """
+    magic, ncmds = struct.unpack_from('<I12xI', data, offset)
+    pos = offset + (32 if magic == MH_MAGIC_64 else 28)
+    for _ in range(ncmds):
+        cmd, cmdsize = struct.unpack_from('<II', data, pos)
+        segname = data[pos + 8:pos + 24].rstrip(b'\0')
+        if cmd == LC_SEGMENT_64 and segname == b'__TEXT':
+            return struct.unpack_from('<Q', data, pos + 48)[0]
+        elif cmd == LC_SEGMENT and segname == b'__TEXT':
+            return struct.unpack_from('<I', data, pos + 36)[0]
+        if cmdsize < 8:
+            break # malformed; we'd loop forever
+        pos += cmdsize
+    return 0
+
+
+def get_parts(data, path=None):
+    """get a Part for each image in a dyld shared cache
+
+    Images are named by their install path, and their content is their
+    __TEXT segment.  Split caches (macOS 12 on) keep most images in the
+    subcaches alongside the main cache, which lists them all.  Each file
+    gets the parts mapped into it; so a subcache (whose own header lists
+    no images) resolves its images from the main cache at path's sibling
+    (see get_main_images), and the main cache leaves them to it.
+    """
+    retval = []
+    mappings = get_mappings(data)
+    images = get_images(data)
+    if len(images) == 0 and path is not None:
+        images = get_main_images(data, path)
+    names = set()
+    for name, address in images:
+        offset = to_offset(mappings, address)
+        if offset is None or offset + 32 > len(data) or name in names:
+            continue # in another subcache, or already found
+        if struct.unpack_from('<I', data, offset)[0] not in (
+                MH_MAGIC, MH_MAGIC_64):
+            continue # not an image we understand
+        size = min(get_text_size(data, offset), len(data) - offset)
+        retval.append(Part(name, offset, size))
+        names.add(name)
+    return retval
+
+
+# received from signals.parts; see settings.ANALYSERS
+def signals_parts(inode, path, content=None):
+    """finds the images in a dyld shared cache"""
+    if content is None:
+        with Content(path) as content:
+            return signals_parts(inode, path, content)
+    try:
+        return get_parts(content.data, path)
+    except struct.error:
+        return [] # truncated or malformed
+
+
+if __name__ == '__main__':
+    with Content(sys.argv[1]) as content:
+        for part in get_parts(content.data, sys.argv[1]):
+            print('%08x %8u %s' % (part.offset, part.size, part.name))
@@ -0,0 +1,404 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import re
+import sys
+import array
+import struct
+
+from cadfael.core import cache, similarity
+from cadfael.core.content import Content
+
+
+# version of the results signals_inode produces; bump when they change
+ANALYSER_VERSION = 3
+
+# from <elf.h>
+EI_CLASS = 4
+EI_DATA = 5
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+ET_DYN = 3
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_NOTE = 4
+PT_LOAD = 1
+PT_GNU_STACK = 0x6474e551
+PT_GNU_RELRO = 0x6474e552
+PF_X = 0x1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_NOTE = 7
+SHT_DYNSYM = 11
+SHF_ALLOC = 0x2
+SHF_STRINGS = 0x20
+SHN_UNDEF = 0
+STT_SECTION = 3
+STT_FILE = 4
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_SONAME = 14
+DT_RPATH = 15
+DT_BIND_NOW = 24
+DT_RUNPATH = 29
+DT_FLAGS = 30
+DT_FLAGS_1 = 0x6ffffffb
+DF_BIND_NOW = 0x8
+DF_1_NOW = 0x1
+DF_1_PIE = 0x08000000
+NT_GNU_BUILD_ID = 3
+
+# struct formats, after the byte order, by is64; the header is from e_type
+# on, and get_phdrs and get_shdrs reorder program and section headers to
+# (p_type, p_flags, p_offset, p_vaddr, p_filesz) and (sh_name, sh_type,
+# sh_flags, sh_offset, sh_size, sh_link)
+EHDR = { False: 'HHIIIIIHHHHHH', True: 'HHIQQQIHHHHHH' }
+PHDR = { False: 'IIIIIIII', True: 'IIQQQQQQ' }
+SHDR = { False: 'IIIIIIIIII', True: 'IIQQQQIIQQ' }
+DYN = { False: 'iI', True: 'qQ' }
+
+# symbols which mean the stack protector is in use
+CANARY_SYMBOLS = set(['__stack_chk_fail', '__stack_chk_guard'])
+
+# strings pulled out of data sections; nul terminated printable runs
+STRING = re.compile(b'[\t\n\r\x20-\x7e]{4,}(?=\0)')
+
+# array typecodes of a uint32 and uint16; 'I' and 'H' on everything we care
+# about
+UINT32 = [t for t in 'IL' if array.array(t).itemsize == 4][0]
+UINT16 = [t for t in 'HI' if array.array(t).itemsize == 2][0]
+
+# byte order of this host, as a struct prefix
+HOST_ENDIAN = '<' if sys.byteorder == 'little' else '>'
+
+
+def get_header(data):
+    """get (endian, is64, e_type, phdrs, shdrs) of an ELF file
+
+    Returns None if it isn't an ELF file, and raises ValueError if its
+    headers are truncated or corrupt.
+    """
+    if data[:4] != b'\x7fELF':
+        return None
+    ident = bytearray(data[:16])
+    if len(ident) < 16:
+        raise ValueError('truncated ELF header')
+    if ident[EI_CLASS] not in (ELFCLASS32, ELFCLASS64):
+        raise ValueError('bad ELF class: %u' % ident[EI_CLASS])
+    if ident[EI_DATA] not in (ELFDATA2LSB, ELFDATA2MSB):
+        raise ValueError('bad ELF byte order: %u' % ident[EI_DATA])
+    is64 = ident[EI_CLASS] == ELFCLASS64
+    endian = '<' if ident[EI_DATA] == ELFDATA2LSB else '>'
+    try:
+        (e_type, _, _, _, phoff, shoff, _, _, phentsize, phnum, shentsize,
+         shnum, shstrndx) = struct.unpack_from(endian + EHDR[is64], data, 16)
+        return (
+            endian, is64, e_type,
+            get_phdrs(data, endian, is64, phoff, phentsize, phnum),
+            get_shdrs(data, endian, is64, shoff, shentsize, shnum, shstrndx)
+        )
+    except struct.error as e:
+        raise ValueError('truncated ELF headers: %s' % e)
+
+
+def get_phdrs(data, endian, is64, phoff, phentsize, phnum):
+    """get (p_type, p_flags, p_offset, p_vaddr, p_filesz) of each segment"""
+    retval = []
+    if phoff == 0:
+        return retval
+    fmt = struct.Struct(endian + PHDR[is64])
+    if phnum > 0 and phentsize < fmt.size:
+        raise ValueError('bad ELF program header size: %u' % phentsize)
+    for i in range(phnum):
+        ph = fmt.unpack_from(data, phoff + i * phentsize)
+        if is64:
+            retval.append((ph[0], ph[1], ph[2], ph[3], ph[5]))
+        else:
+            retval.append((ph[0], ph[6], ph[1], ph[2], ph[4]))
+    return retval
+
+
+def get_shdrs(data, endian, is64, shoff, shentsize, shnum, shstrndx):
+    """get (name, sh_type, sh_flags, sh_offset, sh_size, sh_link) of each
+    section; stripped files may have none
+    """
+    retval = []
+    if shoff == 0:
+        return retval
+    fmt = struct.Struct(endian + SHDR[is64])
+    if shnum > 0 and shentsize < fmt.size:
+        raise ValueError('bad ELF section header size: %u' % shentsize)
+    for i in range(shnum):
+        sh = fmt.unpack_from(data, shoff + i * shentsize)
+        retval.append((sh[0], sh[1], sh[2], sh[4], sh[5], sh[6]))
+    if shstrndx >= len(retval):
+        return retval
+    names = retval[shstrndx][3]
+    return [
+        (get_cstring(data, names + sh[0]),) + sh[1:] for sh in retval
+    ]
+
+
+def get_cstring(data, offset):
+    """get the nul terminated string at offset"""
+    end = data.find(b'\0', offset)
+    if end == -1:
+        end = len(data)
+    return data[offset:end].decode('utf-8', 'ignore')
+
+
+def to_offset(phdrs, vaddr):
+    """get the file offset of a virtual address, from the PT_LOAD segments"""
+    for p_type, _, p_offset, p_vaddr, p_filesz in phdrs:
+        if p_type == PT_LOAD and p_vaddr <= vaddr < p_vaddr + p_filesz:
+            return p_offset + vaddr - p_vaddr
+    return None
+
+
+def get_dynamic(data, endian, is64, phdrs):
+    """get the (d_tag, d_val) entries of the dynamic section"""
+    retval = []
+    fmt = struct.Struct(endian + DYN[is64])
+    for p_type, _, p_offset, _, p_filesz in phdrs:
+        if p_type != PT_DYNAMIC:
+            continue
+        for offset in range(p_offset, p_offset + p_filesz, fmt.size):
+            d_tag, d_val = fmt.unpack_from(data, offset)
+            if d_tag == DT_NULL:
+                break
+            retval.append((d_tag, d_val))
+    return retval
+
+
+def get_build_id(data, endian, phdrs, shdrs):
+    """get the GNU build-id, as hex, from the notes; or None"""
+    notes = [
+        (p_offset, p_filesz) for p_type, _, p_offset, _, p_filesz in phdrs
+        if p_type == PT_NOTE
+    ]
+    if len(notes) == 0:
+        # relocatables have no segments
+        notes = [(sh[3], sh[4]) for sh in shdrs if sh[1] == SHT_NOTE]
+    for offset, size in notes:
+        end = offset + size
+        while offset + 12 <= end:
+            namesz, descsz, n_type = struct.unpack_from(
+                endian + 'III', data, offset
+            )
+            name = offset + 12
+            desc = name + (namesz + 3) // 4 * 4
+            if (n_type == NT_GNU_BUILD_ID and
+                    data[name:name+namesz] == b'GNU\0'):
+                return ''.join(
+                    '%02x' % b for b in bytearray(data[desc:desc+descsz])
+                )
+            offset = desc + (descsz + 3) // 4 * 4
+    return None
+
+
+def get_symbols(table, nsyms, is64, endian, string_table, local, undef):
+    """decode a symbol table, adding the names to local and undef
+
+    As for mach-o, the table is loaded into arrays and the fields we need
+    are pulled out with strided slices rather than unpacking each Elf_Sym;
+    st_name is the first uint32 of each, st_info the fifth (64 bit) or
+    thirteenth byte, and st_shndx the fourth (64 bit) or eighth uint16.
+    Section and file symbols are ignored.
+    """
+    stride = 24 if is64 else 16
+    nsyms = min(nsyms, len(table) // stride) # truncated files
+    table = table[:nsyms * stride]
+    words = array.array(UINT32)
+    halves = array.array(UINT16)
+    if hasattr(words, 'frombytes'):
+        words.frombytes(table)
+        halves.frombytes(table)
+    else:
+        words.fromstring(table) # python 2
+        halves.fromstring(table)
+    if endian != HOST_ENDIAN:
+        words.byteswap()
+        halves.byteswap()
+    strxs = words[0::stride // 4]
+    infos = bytearray(table[4 if is64 else 12::stride])
+    shndxs = halves[3 if is64 else 7::stride // 2]
+
+    find = string_table.find
+    for strx, st_info, st_shndx in zip(strxs[1:], infos[1:], shndxs[1:]):
+        if st_info & 0xf in (STT_SECTION, STT_FILE):
+            continue
+        end = find(b'\0', strx)
+        if end == -1:
+            end = len(string_table)
+        name = string_table[strx:end].decode('utf-8', 'ignore')
+        if len(name) == 0:
+            continue
+        if st_shndx == SHN_UNDEF:
+            # imported from another library
+            undef.add(name)
+        else:
+            # defined here; exported if it's in the dynamic symbols
+            local.add(name)
+
+
+def get_info(path, content=None):
+    """extract symbol, library and hardening information from an ELF file
+
+    Everything is unpacked and searched in place in the content's mmap; only
+    the symbol tables are copied out.  Symbols are
+    taken from .dynsym (falling back to .symtab for relocatables and static
+    binaries), so need section headers.  Raises ValueError if the headers
+    are truncated or corrupt; truncated sections just give what's there.
+    """
+    if content is None:
+        with Content(path) as content:
+            return get_info(path, content)
+
+    retval = empty_info()
+    data = content.data
+    header = get_header(data)
+    if header is None:
+        return retval # not an ELF file
+    endian, is64, e_type, phdrs, shdrs = header
+
+    local = set()
+    undef = set()
+    strings = set()
+    dynamic = []
+    try:
+        retval['uuid'] = get_build_id(data, endian, phdrs, shdrs)
+        dynamic = get_dynamic(data, endian, is64, phdrs)
+        strtab = [to_offset(phdrs, d_val) for d_tag, d_val in dynamic
+                  if d_tag == DT_STRTAB]
+        strtab = strtab[0] if len(strtab) > 0 else None
+        if strtab is not None:
+            for d_tag, d_val in dynamic:
+                if d_tag == DT_NEEDED:
+                    retval['dylibs'].append(get_cstring(data, strtab + d_val))
+                elif d_tag == DT_SONAME:
+                    retval['soname'] = get_cstring(data, strtab + d_val)
+                elif d_tag == DT_RPATH:
+                    retval['rpath'].extend(
+                        get_cstring(data, strtab + d_val).split(':')
+                    )
+                elif d_tag == DT_RUNPATH:
+                    retval['runpath'].extend(
+                        get_cstring(data, strtab + d_val).split(':')
+                    )
+
+        symtabs = [sh for sh in shdrs if sh[1] == SHT_DYNSYM]
+        if len(symtabs) == 0:
+            symtabs = [sh for sh in shdrs if sh[1] == SHT_SYMTAB]
+        for _, _, _, sh_offset, sh_size, sh_link in symtabs:
+            if sh_link >= len(shdrs):
+                continue
+            strsh = shdrs[sh_link]
+            get_symbols(
+                data[sh_offset:sh_offset+sh_size],
+                sh_size // (24 if is64 else 16),
+                is64,
+                endian,
+                data[strsh[3]:strsh[3]+strsh[4]],
+                local,
+                undef
+            )
+
+        for name, sh_type, sh_flags, sh_offset, sh_size, _ in shdrs:
+            if sh_type == SHT_STRTAB:
+                continue # symbol names
+            if (name.startswith('.rodata') or
+                    (sh_flags & SHF_STRINGS and sh_flags & SHF_ALLOC)):
+                # not debug strings, which aren't loaded
+                for s in STRING.findall(data, sh_offset, sh_offset + sh_size):
+                    strings.add(s.decode('ascii'))
+    except struct.error:
+        pass # truncated or malformed; keep what we've got
+
+    retval['symbols'] = { 'local': list(local), 'undef': list(undef) }
+    retval['strings'] = list(strings)
+    retval['hardening'] = get_hardening(
+        e_type, phdrs, dynamic, local | undef
+    )
+    return retval
+
+
+def empty_info():
+    """get the results of get_info for a file with nothing in"""
+    return {
+        'uuid': None,
+        'symbols': { 'local': [], 'undef': [] },
+        'strings': [],
+        'dylibs': [],
+        'soname': None,
+        'rpath': [],
+        'runpath': [],
+        'hardening': []
+    }
+
+
+def get_hardening(e_type, phdrs, dynamic, symbols):
+    """generate an array of the hardening an ELF file was built with
+
+    'pie' for position independent executables, 'relro' if there's a
+    PT_GNU_RELRO segment and 'bind-now' too if it's all read only (full
+    RELRO), 'nx' if the stack isn't executable, and 'canary' if the stack
+    protector's symbols are used.
+    """
+    retval = []
+    types = dict((ph[0], ph) for ph in phdrs)
+    flags = dict(dynamic)
+    if e_type == ET_DYN and (
+            PT_INTERP in types or flags.get(DT_FLAGS_1, 0) & DF_1_PIE):
+        retval.append('pie') # otherwise a shared library
+    if PT_GNU_RELRO in types:
+        retval.append('relro')
+        if (DT_BIND_NOW in flags or
+                flags.get(DT_FLAGS, 0) & DF_BIND_NOW or
+                flags.get(DT_FLAGS_1, 0) & DF_1_NOW):
+            retval.append('bind-now')
+    if PT_GNU_STACK in types and types[PT_GNU_STACK][1] & PF_X == 0:
+        retval.append('nx')
+    if len(CANARY_SYMBOLS & symbols) > 0:
+        retval.append('canary')
+    return retval
+
+
+# received from signals.inode; see settings.ANALYSERS
+@cache.analysis('x-elf', ANALYSER_VERSION)
+def signals_inode(inode, path, content=None):
+    """extracts info from ELF files
+
+    Files whose headers are truncated or corrupt are recorded, with the
+    reason as error, rather than failing the import.
+    """
+    try:
+        retval = get_info(path, content)
+        retval['error'] = None
+    except ValueError as e:
+        retval = empty_info()
+        retval['error'] = '%s' % e
+    retval.update(similarity.sketch(
+        local=retval['symbols']['local'],
+        undef=retval['symbols']['undef'],
+        strings=retval['strings']
+    ))
+    return retval
+
+
+if __name__ == '__main__':
+    info = get_info(sys.argv[1])
+    print('B %s' % info['uuid'])
+    for sym in info['symbols']['local']:
+        print('T %s' % sym)
+    print('T=%u' % len(info['symbols']['local']))
+    for sym in info['symbols']['undef']:
+        print('U %s' % sym)
+    print('U=%u' % len(info['symbols']['undef']))
+    for lib in info['dylibs']:
+        print('L %s' % lib)
+    print('L=%u' % len(info['dylibs']))
+    print('H %s' % ' '.join(info['hardening']))
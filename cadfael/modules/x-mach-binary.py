@@ -2,36 +2,131 @@
 # pylint: disable=W0621,C0103,R0903,C0326
 from __future__ import unicode_literals, print_function
 
-import ctypes
+import os
 import sys
-import subprocess
+import array
+import struct
 import xml.etree.ElementTree as ET
+from datetime import datetime
 from macholib.MachO import MachO
-from macholib.mach_o import uuid_command, symtab_command, dylib_command, MH_MAGIC_64, N_UNDF, segment_command, segment_command_64
+from macholib.mach_o import uuid_command, symtab_command, dylib_command, MH_MAGIC, MH_CIGAM, MH_MAGIC_64, MH_CIGAM_64, FAT_MAGIC, FAT_MAGIC_64, LC_CODE_SIGNATURE, N_STAB, N_TYPE, N_UNDF, segment_command, segment_command_64, LC_REGISTRY, LC_UUID, LC_SYMTAB, LC_SEGMENT, LC_SEGMENT_64
 
-from cadfael.core import signals
+from cadfael.core import cache, similarity
+from cadfael.core.content import Content
 
 
-class nlist(ctypes.Structure):
-    """32bit nlist structure"""
-    _fields_ = (
-        ('n_un', ctypes.c_uint32),
-        ('n_type', ctypes.c_uint8),
-        ('n_sect', ctypes.c_uint8),
-        ('n_desc', ctypes.c_uint16),
-        ('n_value', ctypes.c_uint32),
-    )
+class MappedMachO(MachO):
+    """MachO which loads from an already open file object"""
 
+    def __init__(self, path, fileobj):
+        # mirrors MachO.__init__, which insists on opening path itself
+        self.graphident = path
+        self.filename = path
+        self.loader_path = os.path.dirname(path)
+        self.fat = None
+        self.headers = []
+        self.allow_unknown_load_commands = False
+        self.load(fileobj)
 
-class nlist_64(ctypes.Structure):
-    """64bit nlist structure"""
-    _fields_ = (
-        ('n_un', ctypes.c_uint32),
-        ('n_type', ctypes.c_uint8),
-        ('n_sect', ctypes.c_uint8),
-        ('n_desc', ctypes.c_uint16),
-        ('n_value', ctypes.c_uint64),
-    )
+
+# version of the results signals_inode produces; bump when they change
+ANALYSER_VERSION = 4
+
+# what macholib raises for files it can't parse; truncated ones give
+# struct.error, EOFError or (seeking past the end) IOError, rather than
+# ValueError.  The content's already read, so IOError isn't the disk's
+MALFORMED = (ValueError, struct.error, EOFError, IOError)
+
+# byte order of a mach-o header, by its magic as it appears in the file
+MACHO_ENDIAN = {
+    struct.pack('>I', MH_MAGIC): '>',
+    struct.pack('>I', MH_MAGIC_64): '>',
+    struct.pack('>I', MH_CIGAM): '<',
+    struct.pack('>I', MH_CIGAM_64): '<',
+}
+
+# from <kern/cs_blobs.h>
+CSMAGIC_EMBEDDED_SIGNATURE = 0xfade0cc0
+CSMAGIC_CODEDIRECTORY = 0xfade0c02
+CSMAGIC_EMBEDDED_ENTITLEMENTS = 0xfade7171
+CSSLOT_CODEDIRECTORY = 0
+CSSLOT_ENTITLEMENTS = 5
+CS_SUPPORTSTEAMID = 0x20200
+CS_FLAGS = (
+    (0x00000001, 'valid'),
+    (0x00000002, 'adhoc'),
+    (0x00000004, 'get-task-allow'),
+    (0x00000100, 'hard'),
+    (0x00000200, 'kill'),
+    (0x00000400, 'check-expiration'),
+    (0x00000800, 'restrict'),
+    (0x00001000, 'enforcement'),
+    (0x00002000, 'library-validation'),
+    (0x00010000, 'runtime'),
+    (0x00020000, 'linker-signed'),
+)
+
+# format of a plist <date>
+PLIST_DATE = '%Y-%m-%dT%H:%M:%SZ'
+
+# the load commands macholib takes to be dylib_commands
+DYLIB_COMMANDS = set(
+    cmd for cmd, klass in LC_REGISTRY.items() if klass is dylib_command
+)
+
+# array typecode of a uint32; 'I' on everything we care about
+UINT32 = [t for t in 'IL' if array.array(t).itemsize == 4][0]
+
+# byte order of this host, in macholib's notation
+HOST_ENDIAN = '<' if sys.byteorder == 'little' else '>'
+
+
+def get_symbols(table, nsyms, is64, endian, string_table, local, undef,
+                stroff=0, strsize=None):
+    """decode a symbol table, adding the names to local and undef
+
+    Rather than unpacking each nlist/nlist_64 in turn, the whole table is
+    loaded into an array and the fields we need are pulled out with strided
+    slices; n_strx is the first uint32 and n_type the fifth byte of each.
+    Debugger (stab) entries are ignored.  The string table is the strsize
+    bytes stroff bytes into string_table (all the rest if strsize is None);
+    so it can be all of a mapped file rather than a copy.  Symbols past the
+    end of a truncated table, and names outside the string table, are left
+    out.
+    """
+    stride = 16 if is64 else 12
+    nsyms = min(nsyms, len(table) // stride) # truncated files
+    table = table[:nsyms * stride]
+    words = array.array(UINT32)
+    if hasattr(words, 'frombytes'):
+        words.frombytes(table)
+    else:
+        words.fromstring(table) # python 2
+    if endian != HOST_ENDIAN:
+        words.byteswap()
+    strxs = words[0::stride // 4]
+    types = bytearray(table[4::stride])
+
+    limit = len(string_table)
+    if strsize is not None:
+        limit = min(stroff + strsize, limit)
+    find = string_table.find
+    for strx, n_type in zip(strxs, types):
+        if n_type & N_STAB != 0:
+            continue
+        strx += stroff
+        if strx >= limit:
+            continue # malformed
+        end = find(b'\0', strx, limit)
+        if end == -1:
+            end = limit
+        name = string_table[strx:end].decode('utf-8', 'ignore')
+        if n_type & N_TYPE == N_UNDF:
+            # undefined - calls to func in other module
+            undef.add(name)
+        else:
+            # symbol in n_sect; internal symbols
+            local.add(name)
 
 
 def parse_strings(text, strings, ucode):
@@ -42,8 +137,16 @@ def parse_strings(text, strings, ucode):
                 strings.add(s)
 
 
-def get_info(path):
-    """extract symbol information from a macho file"""
+def get_info(path, content=None):
+    """extract symbol information from a macho file
+
+    Raises ValueError if it isn't one macholib can parse; e.g. it's
+    truncated.
+    """
+    if content is None:
+        with Content(path) as content:
+            return get_info(path, content)
+
     uuid = None
     strings = set()
     dylibs = set()
@@ -60,57 +163,46 @@ def get_info(path):
         '__objc_methname': (objc_methods, False),
         '__objc_classname': (objc_classes, False),
     }
-    macho = None
     try:
-        macho = MachO(path)
+        macho = MappedMachO(path, content.fileobj())
         #print(path)
-    except ValueError:
-        pass # not a MachO file
+    except MALFORMED as e:
+        raise ValueError('not a Mach-O, or malformed: %s' % e)
     if macho is not None:
         # I hate this library, but am lothed to re-write it
         for h in macho.headers:
             for c in h.commands:
                 if isinstance(c[1], uuid_command):
-                    uuid = ''
-                    for c in c[1].uuid:
-                        uuid += '%02x' % (ord(c))
+                    uuid = ''.join(
+                        '%02x' % b for b in bytearray(c[1].uuid)
+                    )
                 elif isinstance(c[1], symtab_command):
                     symtab = c[1]
-                    with open(path, 'rb') as f:
-                        f.seek(h.offset + symtab.stroff)
-                        string_table = f.read(symtab.strsize)
-
-                        f.seek(h.offset + symtab.symoff)
-                        for _ in range(0, symtab.nsyms):
-                            if h.MH_MAGIC == MH_MAGIC_64:
-                                nl = nlist_64()
-                                f.readinto(nl)
-                            else:
-                                nl = nlist()
-                                f.readinto(nl)
-                            s = ''
-                            for c in string_table[nl.n_un:]:
-                                if ord(c) == 0:
-                                    break
-                                s += c
-                            if nl.n_type & N_UNDF == N_UNDF:
-                                # undefined - calls to func in other module
-                                undef.add(s)
-                            elif nl.n_type & N_UNDF != N_UNDF:
-                                # symbol in n_sect; internal symbols
-                                local.add(s)
+                    is64 = h.MH_MAGIC in (MH_MAGIC_64, MH_CIGAM_64)
+                    stride = 16 if is64 else 12
+                    get_symbols(
+                        content.read(
+                            h.offset + symtab.symoff, symtab.nsyms * stride
+                        ),
+                        symtab.nsyms,
+                        is64,
+                        h.endian,
+                        content.read(h.offset + symtab.stroff, symtab.strsize),
+                        local,
+                        undef
+                    )
                 elif isinstance(c[1], dylib_command):
-                    dylibs.add(str(c[2]).strip('\x00'))
+                    dylibs.add(get_cstring(bytes(c[2]), 0))
                 elif isinstance(c[1], segment_command) or isinstance(c[1], segment_command_64):
-                    segname = c[1].segname.strip('\0')
+                    segname = get_cstring(bytes(c[1].segname), 0)
                     if segname == '__TEXT':
                         for sec in c[2]:
-                            secname = sec.sectname.strip('\0')
+                            secname = get_cstring(bytes(sec.sectname), 0)
                             #print(segname, secname)
                             if secname in sections:
-                                with open(path, 'rb') as f:
-                                    f.seek(h.offset + sec.offset)
-                                    text = f.read(sec.size)
+                                text = content.read(
+                                    h.offset + sec.offset, sec.size
+                                )
                                 parse_strings(text, *sections[secname])
     symbols = {
         'local': list(local),
@@ -121,29 +213,237 @@ def get_info(path):
     return uuid, symbols, strings, dylibs
 
 
-def get_codesign(path):
-    """get codesign info from the binary"""
-    ident = None
-    entitlements = None
-    out = subprocess.check_output([
-        'codesign', '-dvvv', '--entitlements', '-', path
-    ], stderr=subprocess.STDOUT).decode('utf-8', 'ignore')
-        
-    for line in out.split('\n'):
-        #print(line)
-        if line.startswith('Identifier'):
-            _, ident = line.split('=')
-    s = out.find('<?xml version="1.0" encoding="UTF-8"?>')
-    if s != -1:
-        entitlementsxml = out[s:]
-        entitlements = obj_from_entitlements(entitlementsxml)
-    return ident, entitlements
+def get_image_info(content):
+    """extract symbol information from an image in a dyld shared cache
+
+    The same as get_info, for the content of a cache's Part; but as the
+    image's offsets are relative to the cache, not its mach header, the
+    load commands are read directly rather than with macholib.  The shared
+    string table isn't copied, and anything which isn't in this file (in a
+    subcache) is left out.
+    """
+    uuid = None
+    strings = set()
+    dylibs = set()
+
+    local = set()
+    undef = set()
+    objc_methods = set()
+    objc_classes = set()
+
+    # __TEXT sections to parse for strings, params to parse_strings
+    sections = {
+        '__cstring': (strings, False),
+        '__ustring': (strings, True),
+        '__objc_methname': (objc_methods, False),
+        '__objc_classname': (objc_classes, False),
+    }
+    data = content.data
+    endian = MACHO_ENDIAN.get(content.head(4))
+    try:
+        commands = []
+        if endian is not None:
+            commands = get_load_commands(data, content.offset, endian)
+            magic = struct.unpack_from(endian + 'I', data, content.offset)[0]
+        for cmd, cmdoff in commands:
+            if cmd == LC_UUID:
+                uuid = ''.join(
+                    '%02x' % c for c in bytearray(data[cmdoff+8:cmdoff+24])
+                )
+            elif cmd == LC_SYMTAB:
+                symoff, nsyms, stroff, strsize = struct.unpack_from(
+                    endian + 'IIII', data, cmdoff + 8
+                )
+                stride = 16 if magic == MH_MAGIC_64 else 12
+                if (symoff + nsyms * stride <= len(data) and
+                        stroff + strsize <= len(data)):
+                    get_symbols(
+                        content.read(symoff, nsyms * stride), nsyms,
+                        stride == 16, endian, data, local, undef, stroff,
+                        strsize
+                    )
+            elif cmd in DYLIB_COMMANDS:
+                name = struct.unpack_from(endian + 'I', data, cmdoff + 8)[0]
+                dylibs.add(get_cstring(data, cmdoff + name))
+            elif cmd in (LC_SEGMENT, LC_SEGMENT_64):
+                for secname, offset, size in get_text_sections(
+                        data, cmd, cmdoff, endian):
+                    if secname in sections and offset + size <= len(data):
+                        parse_strings(
+                            content.read(offset, size), *sections[secname]
+                        )
+    except struct.error:
+        pass # truncated or malformed
+    symbols = {
+        'local': list(local),
+        'undef': list(undef),
+        'objc_methods': list(objc_methods),
+        'objc_classes': list(objc_classes)
+    }
+    return uuid, symbols, strings, dylibs
+
+
+def get_text_sections(data, cmd, cmdoff, endian):
+    """get the (name, offset, size) of each section of a __TEXT segment
+
+    cmd and cmdoff are a segment command; for any other segment there are
+    none.
+    """
+    if data[cmdoff+8:cmdoff+24].rstrip(b'\0') != b'__TEXT':
+        return []
+    if cmd == LC_SEGMENT_64:
+        # struct segment_command_64, then section_64s
+        nsects = struct.unpack_from(endian + 'I', data, cmdoff + 64)[0]
+        first, size, fields = cmdoff + 72, 80, 'QQI'
+    else:
+        # struct segment_command, then sections
+        nsects = struct.unpack_from(endian + 'I', data, cmdoff + 48)[0]
+        first, size, fields = cmdoff + 56, 68, 'III'
+    retval = []
+    for i in range(nsects):
+        sec = first + i * size
+        _, secsize, secoff = struct.unpack_from(
+            endian + fields, data, sec + 32
+        )
+        retval.append((get_cstring(data[sec:sec+16], 0), secoff, secsize))
+    return retval
+
+
+def get_codesign(path, content=None):
+    """get the codesign identifier and entitlements from the binary"""
+    signature = get_signature(path, content)
+    if signature is None:
+        return None, None
+    return signature['identifier'], signature['entitlements']
+
+
+def get_signature(path, content=None):
+    """parse the embedded code signature of a binary
+
+    Reads the LC_CODE_SIGNATURE superblob directly (so works on any host)
+    returning a dict of identifier, team_id, flags and entitlements; or None
+    if the binary isn't signed.  For fat binaries the first signed slice is
+    used.
+    """
+    if content is None:
+        with Content(path) as content:
+            return get_signature(path, content)
+
+    data = content.data
+    try:
+        for offset, endian in get_slices(data):
+            for cmd, cmdoff in get_load_commands(data, offset, endian):
+                if cmd == LC_CODE_SIGNATURE:
+                    dataoff, datasize = struct.unpack_from(
+                        endian + 'II', data, cmdoff + 8
+                    )
+                    return parse_superblob(
+                        data[offset + dataoff:offset + dataoff + datasize]
+                    )
+    except struct.error:
+        pass # truncated or malformed
+    return None
+
+
+def get_slices(data):
+    """get the (offset, endian) of each mach-o in a thin or fat binary"""
+    retval = []
+    if len(data) < 8:
+        return retval
+    magic, nfat_arch = struct.unpack_from('>II', data, 0)
+    if magic == FAT_MAGIC:
+        for i in range(nfat_arch):
+            # struct fat_arch: cputype, cpusubtype, offset, size, align
+            retval.append(struct.unpack_from('>8xI', data, 8 + i * 20)[0])
+    elif magic == FAT_MAGIC_64:
+        for i in range(nfat_arch):
+            # struct fat_arch_64: cputype, cpusubtype, offset, size, align
+            retval.append(struct.unpack_from('>8xQ', data, 8 + i * 32)[0])
+    else:
+        retval.append(0)
+    retval = [(o, MACHO_ENDIAN.get(data[o:o+4])) for o in retval]
+    return [(o, endian) for o, endian in retval if endian is not None]
+
+
+def get_load_commands(data, offset, endian):
+    """get the (cmd, offset) of each load command of the mach-o at offset"""
+    retval = []
+    magic, ncmds = struct.unpack_from(endian + 'I12xI', data, offset)
+    pos = offset + (32 if magic == MH_MAGIC_64 else 28)
+    for _ in range(ncmds):
+        cmd, cmdsize = struct.unpack_from(endian + 'II', data, pos)
+        retval.append((cmd, pos))
+        if cmdsize < 8:
+            break # malformed; we'd loop forever
+        pos += cmdsize
+    return retval
+
+
+def parse_superblob(blob):
+    """parse a code signing superblob, see <kern/cs_blobs.h>"""
+    retval = {
+        'identifier': None,
+        'team_id': None,
+        'flags': [],
+        'entitlements': None
+    }
+    magic, _, count = struct.unpack_from('>III', blob, 0)
+    if magic != CSMAGIC_EMBEDDED_SIGNATURE:
+        return None
+    for i in range(count):
+        slot, offset = struct.unpack_from('>II', blob, 12 + i * 8)
+        magic, length = struct.unpack_from('>II', blob, offset)
+        if slot == CSSLOT_CODEDIRECTORY and magic == CSMAGIC_CODEDIRECTORY:
+            (version, flags, _, ident_offset
+            ) = struct.unpack_from('>IIII', blob, offset + 8)
+            retval['identifier'] = get_cstring(blob, offset + ident_offset)
+            retval['flags'] = get_csflags(flags)
+            if version >= CS_SUPPORTSTEAMID:
+                team_offset = struct.unpack_from('>I', blob, offset + 48)[0]
+                if team_offset != 0:
+                    retval['team_id'] = get_cstring(blob, offset + team_offset)
+        elif (slot == CSSLOT_ENTITLEMENTS and
+                magic == CSMAGIC_EMBEDDED_ENTITLEMENTS):
+            try:
+                retval['entitlements'] = obj_from_entitlements(
+                    blob[offset + 8:offset + length]
+                )
+            except (ValueError, RuntimeError):
+                # malformed, or nested too deeply; the rest's still good
+                pass
+    return retval
+
+
+def get_cstring(data, offset):
+    """get the nul terminated string at offset"""
+    end = data.find(b'\0', offset)
+    if end == -1:
+        end = len(data)
+    return data[offset:end].decode('utf-8', 'ignore')
+
+
+def get_csflags(flags):
+    """generate an array of code directory flag strings"""
+    retval = []
+    for bit, name in CS_FLAGS:
+        if flags & bit != 0:
+            retval.append(name)
+    return retval
 
 
 def obj_from_entitlements(entitlementsxml):
-    """parse entitlements xml and produce a dict"""
-    root = ET.fromstring(entitlementsxml)
-    return parse_entitlement_dict(root.find('dict'))
+    """parse entitlements xml and produce a dict
+
+    Raises ValueError if it isn't a plist of a dict we understand.
+    """
+    try:
+        root = ET.fromstring(entitlementsxml)
+    except ET.ParseError as e:
+        raise ValueError('bad entitlements xml: %s' % e)
+    el = root if root.tag == 'dict' else root.find('dict')
+    if el is None:
+        raise ValueError('entitlements aren\'t a dict')
+    return parse_entitlement_dict(el)
 
 
 def parse_entitlement_dict(el):
@@ -154,44 +454,80 @@ def parse_entitlement_dict(el):
             key = child.text
         else:
             # value
-            value = None
-            if child.tag == 'true':
-                value = True
-            elif child.tag == 'false':
-                value = False
-            elif child.tag == 'string':
-                value = child.text
-            elif child.tag == 'integer':
-                value = int(child.text)
-            elif child.tag == 'array':
-                value = []
-                for a in child:
-                    value.append(a.text)
-            elif child.tag == 'dict':
-                value = parse_entitlement_dict(child)
-            else:
-                raise NotImplementedError('unexpected plist type: %s' % child.tag)
-            retval.append({ 'name': key, 'value': value })
+            retval.append({ 'name': key, 'value': parse_entitlement(child) })
             key = None
     return retval
 
 
-@signals.receiver(
-    signals.inode,
-    fmt='-',
-    details__mime_type='application/x-mach-binary'
-)
-def signals_inode(inode, path):
-    """extracts info from mach-o files"""
+def parse_entitlement(el):
+    """get the value of a plist element; data is kept as its base64"""
+    retval = None
+    if el.tag == 'true':
+        retval = True
+    elif el.tag == 'false':
+        retval = False
+    elif el.tag == 'string':
+        retval = el.text or ''
+    elif el.tag == 'integer':
+        retval = int((el.text or '').strip())
+    elif el.tag == 'real':
+        retval = float((el.text or '').strip())
+    elif el.tag == 'date':
+        retval = datetime.strptime((el.text or '').strip(), PLIST_DATE)
+    elif el.tag == 'data':
+        retval = ''.join((el.text or '').split())
+    elif el.tag == 'array':
+        retval = [parse_entitlement(a) for a in el]
+    elif el.tag == 'dict':
+        retval = parse_entitlement_dict(el)
+    else:
+        raise ValueError('unexpected plist type: %s' % el.tag)
+    return retval
+
+
+# received from signals.inode; see settings.ANALYSERS
+@cache.analysis('x-mach-binary', ANALYSER_VERSION)
+def signals_inode(inode, path, content=None):
+    """extracts info from mach-o files
+
+    Files which can't be parsed are recorded, with the reason as error,
+    rather than failing the import.
+    """
     #print(path)
-    uuid, symbols, strings, dylibs = get_info(path)
-    ident, entitlements = get_codesign(path)
-    inode['details']['uuid'] = uuid
-    inode['details']['symbols'] = symbols
-    inode['details']['strings'] = list(strings)
-    inode['details']['dylibs'] = list(dylibs)
-    inode['details']['identifier'] = ident
-    inode['details']['entitlements'] = entitlements
+    error = None
+    if content is not None and content.parent is not None:
+        # an image in a dyld shared cache; these aren't signed
+        uuid, symbols, strings, dylibs = get_image_info(content)
+        signature = {}
+    else:
+        try:
+            uuid, symbols, strings, dylibs = get_info(path, content)
+        except ValueError as e:
+            error = '%s' % e
+            uuid, strings, dylibs = None, set(), set()
+            symbols = {
+                'local': [], 'undef': [], 'objc_methods': [],
+                'objc_classes': []
+            }
+        signature = get_signature(path, content) or {}
+    retval = {
+        'uuid': uuid,
+        'symbols': symbols,
+        'strings': list(strings),
+        'dylibs': list(dylibs),
+        'identifier': signature.get('identifier'),
+        'team_id': signature.get('team_id'),
+        'codesign_flags': signature.get('flags', []),
+        'entitlements': signature.get('entitlements'),
+        'error': error
+    }
+    retval.update(similarity.sketch(
+        local=symbols['local'],
+        undef=symbols['undef'],
+        strings=strings,
+        objc_classes=symbols['objc_classes']
+    ))
+    return retval
 
 
 if __name__ == '__main__':
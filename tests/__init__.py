@@ -0,0 +1,26 @@
+# coding: utf-8
+"""Tests; run with python -m unittest discover from the top of the repo
+
+Fixtures are generated with the synthetic binaries of benchmarks/.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+
+
+# so the fixture generators can be imported as they are by the benchmarks
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'
+))
+
+
+def use_sqlite(path):
+    """point cadfael at a new sqlite db at path, as a worker would be"""
+    from cadfael.conf import settings, load_modules
+    from cadfael.core import cache, utils
+    load_modules()
+    settings.DBADDR = 'sqlite:' + path
+    utils.fork()
+    cache.analysed.clear() # they're in another db
+    return settings.STORAGE
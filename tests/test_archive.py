@@ -0,0 +1,127 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import io
+import os
+import gzip
+import tarfile
+import zipfile
+import hashlib
+import unittest
+
+from cadfael.core.archive import archive_kind, file_kind
+from tests.test_import import ImportTest
+
+
+def zipped(files):
+    """get a zip of files, { name: data }"""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        for name, data in sorted(files.items()):
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+class TestKind(ImportTest):
+    """archives are told apart from other files"""
+
+    def test_kind(self):
+        self.assertEqual(archive_kind(zipped({ 'a': b'a' })), 'zip')
+        self.assertEqual(archive_kind(b'\x1f\x8b'), 'tar')
+        self.assertEqual(archive_kind(b'not an archive'), None)
+        self.assertEqual(archive_kind(b''), None)
+
+    def test_file_kind(self):
+        path = self.write('file.zip', zipped({ 'a': b'a' }))
+        self.assertEqual(file_kind(path), 'zip')
+        path = os.path.join(self.tmp, 'text.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(b'compressed, but not a tar')
+        self.assertEqual(file_kind(path), None)
+        self.assertEqual(file_kind(self.write('text', b'text')), None)
+
+
+class TestImport(ImportTest):
+    """the members of archives are imported without extracting them"""
+
+    def setUp(self):
+        super(TestImport, self).setUp()
+        self.write('app/file', b'file')
+        self.write('app/Payload.zip', zipped({
+            'Payload/': b'', 'Payload/binary': b'binary'
+        }))
+        os.symlink('file', os.path.join(self.top, 'app/symlink'))
+        os.link(
+            os.path.join(self.top, 'app/file'),
+            os.path.join(self.top, 'app/hardlink')
+        )
+
+    def import_archive(self, path):
+        from cadfael.conf import settings
+        from cadfael.modules.inode import import_tree
+        summary = import_tree('test', path)
+        settings.WRITER.flush()
+        return summary
+
+    def inodes(self):
+        """get the stored inodes, by their first path"""
+        return dict(
+            (sorted(inode['paths'])[0], inode)
+            for inode in self.storage.documents('inodes', 'test')
+        )
+
+    def test_tar(self):
+        path = os.path.join(self.tmp, 'app.tar.gz')
+        with tarfile.open(path, 'w:gz') as tf:
+            tf.add(os.path.join(self.top, 'app'), 'app')
+        summary = self.import_archive(path)
+        inodes = self.inodes()
+        self.assertEqual(sorted(inodes), [
+            '/app', '/app/Payload.zip', '/app/Payload.zip/Payload',
+            '/app/Payload.zip/Payload/binary', '/app/file', '/app/symlink'
+        ])
+        self.assertEqual(
+            sorted(inodes['/app/file']['paths']),
+            ['/app/file', '/app/hardlink']
+        )
+        self.assertEqual(
+            inodes['/app/file']['details']['sha256'],
+            hashlib.sha256(b'file').hexdigest()
+        )
+        self.assertEqual(
+            inodes['/app/symlink']['details']['readlink'], 'file'
+        )
+        self.assertEqual(inodes['/app/Payload.zip/Payload']['fmt'], 'd')
+        self.assertEqual(
+            inodes['/app/Payload.zip/Payload/binary']['size'], 6
+        )
+        self.assertEqual(summary['dirs'], 2)
+        self.assertEqual(summary['links'], 1)
+
+    def test_zip(self):
+        path = self.write('app.ipa', zipped({
+            'Payload/App.app/App': b'app', 'Payload/App.app/Info.plist': b''
+        }))
+        self.import_archive(path)
+        self.assertEqual(sorted(self.inodes()), [
+            '/Payload/App.app/App', '/Payload/App.app/Info.plist'
+        ])
+
+    def test_not_tar(self):
+        from cadfael.modules.inode import import_archive, import_tree
+        path = os.path.join(self.tmp, 'text.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(b'compressed, but not a tar')
+        with self.assertRaises(ValueError):
+            import_archive('test', path)
+        with self.assertRaises(ValueError):
+            import_tree('test', path)
+        # and archives can't be imported incrementally
+        path = self.write('app.zip', zipped({ 'a': b'a' }))
+        with self.assertRaises(ValueError):
+            import_tree('test', path, incremental=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import gzip
+import unittest
+import subprocess
+
+from tests.test_import import ImportTest
+
+
+# the repo, where cadfael-ctrl is
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+class TestTop(ImportTest):
+    """a top which can't be imported is an error, before the volume's wiped"""
+
+    def ctrl(self, *args):
+        """run cadfael-ctrl on the test db; get its exit code and stderr"""
+        from cadfael.conf import settings
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [ROOT] + [p for p in [env.get('PYTHONPATH')] if p]
+        )
+        p = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'cadfael-ctrl'), '-q',
+             '--db', settings.DBADDR] + list(args),
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        _, err = p.communicate()
+        return p.returncode, err.decode('utf-8', 'replace')
+
+    def test_not_archive(self):
+        from cadfael.conf import settings
+        from cadfael.modules.inode import import_tree
+        self.write('file', b'data')
+        import_tree('test', self.top)
+        settings.WRITER.flush()
+        text = os.path.join(self.tmp, 'text')
+        with open(text, 'wb') as f:
+            f.write(b'not an archive')
+        compressed = os.path.join(self.tmp, 'text.gz')
+        with gzip.open(compressed, 'wb') as f:
+            f.write(b'compressed, but not a tar')
+        for top in [text, compressed]:
+            rc, err = self.ctrl('test', top)
+            self.assertEqual(rc, 2)
+            self.assertIn('isn\'t a directory or archive', err)
+        rc, err = self.ctrl('test', os.path.join(self.tmp, 'missing'))
+        self.assertEqual(rc, 2)
+        self.assertIn('can\'t read', err)
+        # still as it was
+        inodes = list(self.storage.documents('inodes', 'test'))
+        self.assertEqual([inode['paths'] for inode in inodes], [['/file']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import unittest
+
+from cadfael.core import diff
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class TestMerge(unittest.TestCase):
+    """sorted streams are merged by path"""
+
+    def test_merge(self):
+        a = iter([('/a', 1), ('/b', 2), ('/d', 4)])
+        b = iter([('/b', 20), ('/c', 30), ('/e', 50)])
+        self.assertEqual(list(diff.merge(a, b)), [
+            ('/a', 1, None), ('/b', 2, 20), ('/c', None, 30),
+            ('/d', 4, None), ('/e', None, 50)
+        ])
+        self.assertEqual(list(diff.merge(iter([]), iter([]))), [])
+
+
+@unittest.skipIf(mongomock is None, 'needs mongomock')
+class TestDiff(unittest.TestCase):
+    """two volumes compared, by content and analyses"""
+
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.analysis('lib1', ['libSystem'], ['_open'], [
+            { 'name': 'sandbox', 'value': True },
+            { 'name': 'groups', 'value': ['a'] }
+        ])
+        self.analysis('lib2', ['libSystem', 'libfoo'], ['_open', '_foo'], [
+            { 'name': 'groups', 'value': ['a', 'b'] },
+            { 'name': 'tcc', 'value': True }
+        ])
+        self.inode('old', ['/same', '/same-link'], '-', 'same')
+        self.inode('new', ['/same', '/same-link'], '-', 'same')
+        self.inode('old', ['/removed'], '-', 'removed')
+        self.inode('new', ['/added'], '-', 'added')
+        self.inode('old', ['/bin/lib'], '-', 'lib1')
+        self.inode('new', ['/bin/lib'], '-', 'lib2')
+        self.inode('old', ['/link'], 'l', readlink='/same')
+        self.inode('new', ['/link'], 'l', readlink='/added')
+        self.inode('old', ['/dir'], 'd')
+        self.inode('new', ['/dir'], 'd')
+        self.inode('old', ['/became-dir'], '-', 'same')
+        self.inode('new', ['/became-dir'], 'd')
+
+    def analysis(self, sha256, dylibs, undef, entitlements):
+        """store the analysis of some content"""
+        self.db.analyses.insert_one({
+            '_id': 'x-mach-binary:%s' % sha256,
+            'analyser': 'x-mach-binary',
+            'sha256': sha256,
+            'dylibs': dylibs,
+            'symbols': { 'undef': undef, 'local': [] },
+            'entitlements': entitlements
+        })
+
+    def inode(self, volname, paths, fmt, sha256=None, readlink=None):
+        """store an inode; with the analysis of its content, if there is one"""
+        details = {}
+        if sha256 is not None:
+            details['sha256'] = sha256
+            _id = 'x-mach-binary:%s' % sha256
+            if self.db.analyses.find_one({ '_id': _id }) is not None:
+                details['analyses'] = { 'x-mach-binary': _id }
+        if readlink is not None:
+            details['readlink'] = readlink
+        self.db.inodes.insert_one({
+            'dev': volname, 'paths': paths, 'fmt': fmt, 'details': details
+        })
+
+    def test_diff(self):
+        records = list(diff.diff(self.db, 'old', 'new'))
+        self.assertEqual(
+            [(r['path'], r['change']) for r in records], [
+                ('/added', 'added'),
+                ('/became-dir', 'changed'),
+                ('/bin/lib', 'changed'),
+                ('/link', 'changed'),
+                ('/removed', 'removed')
+            ]
+        )
+        added, became, lib, link, removed = records
+        self.assertEqual(added['old'], None)
+        self.assertEqual(added['new'], { 'fmt': '-', 'sha256': 'added' })
+        self.assertEqual(removed['new'], None)
+        self.assertEqual(became['new'], { 'fmt': 'd', 'sha256': None })
+        self.assertEqual(link['new']['readlink'], '/added')
+        self.assertEqual(
+            lib['dylibs'], { 'added': ['libfoo'], 'removed': [] }
+        )
+        self.assertEqual(
+            lib['imports'], { 'added': ['_foo'], 'removed': [] }
+        )
+        self.assertEqual(lib['entitlements'], {
+            'added': [{ 'name': 'tcc', 'value': True }],
+            'removed': [{ 'name': 'sandbox', 'value': True }],
+            'changed': [{ 'name': 'groups', 'old': ['a'], 'new': ['a', 'b'] }]
+        })
+        # only files which have analyses have their changes compared
+        for record in (added, became, link, removed):
+            self.assertNotIn('dylibs', record)
+
+    def test_same(self):
+        self.assertEqual(list(diff.diff(self.db, 'old', 'old')), [])
+
+    def test_batches(self):
+        size = diff.LOOKUP_SIZE
+        diff.LOOKUP_SIZE = 1
+        try:
+            records = list(diff.diff(self.db, 'old', 'new'))
+        finally:
+            diff.LOOKUP_SIZE = size
+        self.assertEqual(records, list(diff.diff(self.db, 'old', 'new')))
+
+
+if __name__ == '__main__':
+    unittest.main()
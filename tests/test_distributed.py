@@ -0,0 +1,92 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import unittest
+
+from tests.test_import import ImportTest
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+@unittest.skipIf(mongomock is None, 'needs mongomock')
+class TestImportItem(ImportTest):
+    """work items imported by a distributed worker, on a mock queue"""
+
+    def setUp(self):
+        from cadfael.core.workqueue import WorkQueue
+        super(TestImportItem, self).setUp()
+        self.queue = WorkQueue(
+            mongomock.MongoClient().db.workqueue, 60, 'test'
+        )
+        self.write('a/one', b'one')
+        self.write('a/b/two', b'two')
+        self.write('c/three', b'three')
+        os.link(
+            os.path.join(self.top, 'a/one'), os.path.join(self.top, 'c/link')
+        )
+
+    def claim(self):
+        """claim an item, and import it"""
+        from cadfael.conf import settings
+        from cadfael.core.distributed import import_item
+        from cadfael.modules.inode import import_directory
+        item = self.queue.claim()
+        import_item(self.queue, item, import_directory)
+        settings.WRITER.flush()
+        return item
+
+    def paths(self):
+        """get the paths of each stored inode"""
+        return sorted(
+            sorted(inode['paths'])
+            for inode in self.storage.documents('inodes', 'test')
+        )
+
+    def test_item(self):
+        self.queue.publish('test', self.top, [os.path.sep])
+        self.claim()
+        self.assertEqual(self.queue.outstanding('test'), 0)
+        self.assertEqual(self.paths(), [
+            ['/a'], ['/a/b'], ['/a/b/two'], ['/a/one', '/c/link'], ['/c'],
+            ['/c/three']
+        ])
+        summary, = self.queue.summaries('test')
+        self.assertEqual(summary['dirs'], 3)
+        self.assertEqual(summary['files'], 4)
+        self.assertEqual(summary['links'], 0)
+        self.assertEqual(summary['bytes'], 11)
+
+    def test_split(self):
+        from cadfael.conf import settings
+        from cadfael.core.distributed import merge_summaries
+        # the root's entries are imported, then the rest split off
+        settings.WORKQUEUE_SPLIT = 1
+        self.queue.publish('test', self.top, [os.path.sep])
+        self.claim()
+        routes = [
+            item['route'] for item in self.queue.collection.find(
+                { 'state': 'queued' }
+            )
+        ]
+        self.assertEqual(sorted(routes), ['/a', '/c'])
+        self.assertEqual(self.paths(), [['/a'], ['/c']])
+        while self.queue.outstanding('test') > 0:
+            self.claim()
+        # each directory ends up an item of its own
+        self.assertEqual(len(list(self.queue.summaries('test'))), 4)
+        self.assertEqual(
+            [paths for paths in self.paths() if len(paths) > 1],
+            [['/a/one', '/c/link']]
+        )
+        summary = merge_summaries(self.queue.summaries('test'))
+        self.assertEqual(summary['dirs'], 3)
+        self.assertEqual(summary['files'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import struct
+import unittest
+import importlib
+
+from cadfael.core.content import Content
+
+
+xelf = importlib.import_module('cadfael.modules.x-elf')
+
+# section types and flags used by the synthetic files, besides x-elf's
+SHT_PROGBITS = 1
+SHT_DYNAMIC = 6
+PF_R = 0x4
+PF_W = 0x2
+
+# strings in .rodata
+RODATA = [b'hello, world', b'synthetic ELF']
+
+
+def cstrings(names):
+    """get a string table of names, and the offset of each in it"""
+    data = b'\0'
+    offsets = {}
+    for name in names:
+        offsets[name] = len(data)
+        data += name.encode('ascii') + b'\0'
+    return data, offsets
+
+
+def symbols(endian, is64, names, defined):
+    """get a symbol table of (st_name, defined) with a null symbol first"""
+    retval = b''
+    for strx, isdefined in [(0, False)] + list(zip(names, defined)):
+        shndx = 1 if isdefined else xelf.SHN_UNDEF
+        # st_info is a global function
+        if is64:
+            retval += struct.pack(
+                endian + 'IBBHQQ', strx, 0x12, 0, shndx, 0, 0
+            )
+        else:
+            retval += struct.pack(
+                endian + 'IIIBBH', strx, 0, 0, 0x12, 0, shndx
+            )
+    return retval
+
+
+def elf(is64=True, endian='<', dynamic=True, sections=True, symtab=True):
+    """generate an ELF file, as a pie linking libc and libfoo
+
+    dynamic gives it a dynamic section and .dynsym; without, it's a static
+    binary.  sections gives it section headers, and symtab a .symtab
+    (static binaries only).  Everything's loaded at vaddr 0, so offsets
+    and addresses are the same.
+    """
+    ehsize, phentsize, shentsize = (64, 56, 64) if is64 else (52, 32, 40)
+    phnum = 5 if dynamic else 3
+    body = [] # (name, sh_type, sh_flags, data, index in body of sh_link)
+    dynstr, dyn = cstrings(['libc.so.6', 'libfoo.so', 'puts', 'foo_init'])
+    if dynamic:
+        body.append(('.dynstr', xelf.SHT_STRTAB, xelf.SHF_ALLOC, dynstr,
+                     None))
+        body.append(('.dynsym', xelf.SHT_DYNSYM, xelf.SHF_ALLOC, symbols(
+            endian, is64, [dyn['puts'], dyn['foo_init']], [False, True]
+        ), 0))
+    elif symtab:
+        strtab, strs = cstrings(['main', '__stack_chk_fail'])
+        body.append(('.strtab', xelf.SHT_STRTAB, 0, strtab, None))
+        body.append(('.symtab', xelf.SHT_SYMTAB, 0, symbols(
+            endian, is64, [strs['main'], strs['__stack_chk_fail']],
+            [True, False]
+        ), 0))
+    body.append(('.rodata', SHT_PROGBITS, xelf.SHF_ALLOC,
+                 b'\0'.join(RODATA) + b'\0', None))
+    note = struct.pack(endian + 'III', 4, 8, xelf.NT_GNU_BUILD_ID) + (
+        b'GNU\0\x01\x23\x45\x67\x89\xab\xcd\xef'
+    )
+    body.append(('.note.gnu.build-id', xelf.SHT_NOTE, xelf.SHF_ALLOC, note,
+                 None))
+
+    # lay the sections out after the headers, then the dynamic section
+    offset = ehsize + phnum * phentsize
+    offsets = []
+    for _, _, _, data, _ in body:
+        offset += -offset % 8
+        offsets.append(offset)
+        offset += len(data)
+    if dynamic:
+        fmt = endian + xelf.DYN[is64]
+        table = b''.join(struct.pack(fmt, tag, value) for tag, value in [
+            (xelf.DT_NEEDED, dyn['libc.so.6']),
+            (xelf.DT_NEEDED, dyn['libfoo.so']),
+            (xelf.DT_STRTAB, offsets[0]),
+            (xelf.DT_FLAGS_1, xelf.DF_1_NOW | xelf.DF_1_PIE),
+            (xelf.DT_NULL, 0)
+        ])
+        offset += -offset % 8
+        offsets.append(offset)
+        body.append(('.dynamic', SHT_DYNAMIC, xelf.SHF_ALLOC, table, 0))
+        dynoff = offset
+        offset += len(table)
+    names = [b[0] for b in body] + ['.shstrtab']
+    shstrtab, shstrs = cstrings(names)
+    offsets.append(offset)
+    body.append(('.shstrtab', xelf.SHT_STRTAB, 0, shstrtab, None))
+    offset += len(shstrtab)
+    offset += -offset % 8
+    shoff = offset if sections else 0
+    size = offset + (len(body) + 1) * shentsize if sections else offset
+
+    # program headers; (p_type, p_flags, offset, size)
+    segments = [
+        (xelf.PT_LOAD, PF_R, 0, size),
+        (xelf.PT_NOTE, PF_R, offsets[names.index('.note.gnu.build-id')],
+         len(note)),
+        (xelf.PT_GNU_STACK, PF_R | PF_W, 0, 0)
+    ]
+    if dynamic:
+        segments.append((xelf.PT_DYNAMIC, PF_R | PF_W, dynoff, len(table)))
+        segments.append((xelf.PT_GNU_RELRO, PF_R, 0, dynoff))
+    data = bytearray(size)
+    data[:16] = b'\x7fELF' + bytearray([
+        xelf.ELFCLASS64 if is64 else xelf.ELFCLASS32,
+        xelf.ELFDATA2LSB if endian == '<' else xelf.ELFDATA2MSB,
+        1
+    ]) + b'\0' * 9
+    struct.pack_into(
+        endian + xelf.EHDR[is64], data, 16, xelf.ET_DYN if dynamic else 2,
+        62, 1, 0, ehsize, shoff, 0, ehsize, phentsize, phnum,
+        shentsize, len(body) + 1 if sections else 0,
+        len(body) if sections else 0
+    )
+    for i, (p_type, p_flags, p_offset, p_size) in enumerate(segments):
+        at = ehsize + i * phentsize
+        if is64:
+            struct.pack_into(endian + xelf.PHDR[True], data, at, p_type,
+                             p_flags, p_offset, p_offset, p_offset, p_size,
+                             p_size, 8)
+        else:
+            struct.pack_into(endian + xelf.PHDR[False], data, at, p_type,
+                             p_offset, p_offset, p_offset, p_size, p_size,
+                             p_flags, 8)
+    for i, (name, sh_type, sh_flags, section, link) in enumerate(body):
+        data[offsets[i]:offsets[i] + len(section)] = section
+        if not sections:
+            continue
+        # section i is header i + 1, after the null one
+        struct.pack_into(
+            endian + xelf.SHDR[is64], data, shoff + (i + 1) * shentsize,
+            shstrs[name], sh_type, sh_flags, offsets[i], offsets[i],
+            len(section), 0 if link is None else link + 1, 0, 8, 0
+        )
+    return bytes(data)
+
+
+def get_info(data):
+    """get_info of an ELF file's bytes"""
+    return xelf.get_info('test', Content.from_bytes('test', data))
+
+
+class TestInfo(unittest.TestCase):
+    """parsing of ELF files of each class and byte order"""
+
+    def check(self, is64, endian):
+        info = get_info(elf(is64, endian))
+        self.assertEqual(info['uuid'], '0123456789abcdef')
+        self.assertEqual(info['dylibs'], ['libc.so.6', 'libfoo.so'])
+        self.assertEqual(info['symbols'], {
+            'local': ['foo_init'], 'undef': ['puts']
+        })
+        self.assertEqual(sorted(info['strings']), sorted(
+            s.decode('ascii') for s in RODATA
+        ))
+        self.assertEqual(
+            info['hardening'], ['pie', 'relro', 'bind-now', 'nx']
+        )
+
+    def test_elf64_little(self):
+        self.check(True, '<')
+
+    def test_elf64_big(self):
+        self.check(True, '>')
+
+    def test_elf32_little(self):
+        self.check(False, '<')
+
+    def test_elf32_big(self):
+        self.check(False, '>')
+
+    def test_no_sections(self):
+        # the segments still give the build-id, libraries and hardening
+        for is64 in (True, False):
+            info = get_info(elf(is64, sections=False))
+            self.assertEqual(info['uuid'], '0123456789abcdef')
+            self.assertEqual(info['dylibs'], ['libc.so.6', 'libfoo.so'])
+            self.assertEqual(info['symbols'], { 'local': [], 'undef': [] })
+            self.assertEqual(info['strings'], [])
+            self.assertIn('bind-now', info['hardening'])
+
+    def test_static(self):
+        info = get_info(elf(dynamic=False))
+        self.assertEqual(info['dylibs'], [])
+        self.assertEqual(info['symbols'], {
+            'local': ['main'], 'undef': ['__stack_chk_fail']
+        })
+        self.assertEqual(info['hardening'], ['nx', 'canary'])
+
+    def test_stripped(self):
+        info = get_info(elf(dynamic=False, symtab=False))
+        self.assertEqual(info['symbols'], { 'local': [], 'undef': [] })
+        self.assertEqual(info['hardening'], ['nx'])
+        self.assertEqual(len(info['strings']), len(RODATA))
+
+    def test_not_elf(self):
+        self.assertEqual(get_info(b'')['uuid'], None)
+        self.assertEqual(
+            get_info(b'\xcf\xfa\xed\xfe' + b'\0' * 60), get_info(b'')
+        )
+
+
+class TestMalformed(unittest.TestCase):
+    """truncated or corrupt headers raise ValueError"""
+
+    def test_truncated(self):
+        for is64 in (True, False):
+            for endian in '<>':
+                data = elf(is64, endian)
+                # the headers are at both ends; sections in between
+                for size in list(range(4, 200)) + [len(data) - 1]:
+                    with self.assertRaises(ValueError):
+                        get_info(data[:size])
+
+    def test_truncated_sections(self):
+        # cut mid-way, but not through any headers; what's left is kept
+        data = elf(sections=False)
+        info = get_info(data[:-8])
+        self.assertEqual(info['dylibs'], ['libc.so.6', 'libfoo.so'])
+
+    def test_corrupt(self):
+        data = bytearray(elf())
+        for at, value in [
+                (xelf.EI_CLASS, 3),
+                (xelf.EI_DATA, 0)]:
+            corrupt = bytearray(data)
+            corrupt[at] = value
+            with self.assertRaises(ValueError):
+                get_info(bytes(corrupt))
+        # program and section headers smaller than they can be
+        for at in (54, 58):
+            corrupt = bytearray(data)
+            struct.pack_into('<H', corrupt, at, 8)
+            with self.assertRaises(ValueError):
+                get_info(bytes(corrupt))
+        # and pointing past the end
+        for at in (32, 40):
+            corrupt = bytearray(data)
+            struct.pack_into('<Q', corrupt, at, len(data))
+            with self.assertRaises(ValueError):
+                get_info(bytes(corrupt))
+
+    def test_analysis(self):
+        # recorded as unparseable, not raised
+        with Content.from_bytes('test', elf()[:100]) as content:
+            inode = { 'details': {} } # no sha256, so kept in the inode
+            xelf.signals_inode(inode, 'test', content)
+        self.assertIn('truncated', inode['details']['error'])
+        self.assertEqual(inode['details']['dylibs'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
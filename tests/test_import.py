@@ -0,0 +1,91 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+from tests import use_sqlite
+
+
+# seconds an import gets before it's taken to have hung
+TIMEOUT = 60
+
+
+def explode(inode, path, **_):
+    """inode receiver which always fails"""
+    raise RuntimeError('receiver failed on %s' % path)
+
+
+def import_failing(top):
+    """process; import top with a receiver which always fails
+
+    Exits 0 if the import raised the receiver's error.
+    """
+    import cadfael.core.signals
+    from cadfael.modules.inode import import_tree
+    cadfael.core.signals.receiver(cadfael.core.signals.inode, fmt='-')(
+        explode
+    )
+    try:
+        import_tree('test', top)
+    except RuntimeError:
+        sys.exit(0)
+    sys.exit(1)
+
+
+class ImportTest(unittest.TestCase):
+    """base of the import tests; a sqlite db, and a tree to import"""
+
+    def setUp(self):
+        from cadfael.conf import settings
+        self.values = settings.worker()
+        self.tmp = tempfile.mkdtemp()
+        self.storage = use_sqlite(os.path.join(self.tmp, 'db'))
+        self.storage.create_volume('test')
+        settings.JOURNALS = self.tmp
+        self.top = os.path.join(self.tmp, 'tree') + os.path.sep
+        os.mkdir(self.top)
+
+    def tearDown(self):
+        from cadfael.conf import settings
+        settings.update(self.values)
+        shutil.rmtree(self.tmp)
+
+    def write(self, route, data=b''):
+        """write a file in the tree, making its directory if need be"""
+        path = os.path.join(self.top, route)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+class TestErrors(ImportTest):
+    """an error in a worker fails the import, rather than hanging it"""
+
+    def test_receiver(self):
+        from cadfael.conf import settings
+        settings.IMPORT_BACKLOG = 8
+        settings.IMPORT_CHUNKSIZE = 1
+        settings.ANALYSIS_PROCESSES = 0
+        for i in range(64):
+            self.write('%02u' % i, b'file %u' % i)
+        p = multiprocessing.Process(target=import_failing, args=(self.top,))
+        p.start()
+        p.join(TIMEOUT)
+        hung = p.is_alive()
+        if hung:
+            p.terminate()
+            p.join()
+        self.assertFalse(hung, 'the import hung')
+        self.assertEqual(p.exitcode, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import shutil
+import unittest
+
+from tests.test_import import ImportTest
+
+
+# details of stored inodes, which an analysis would overwrite
+STAMP = { 'stamp': True }
+
+
+class TestIncremental(ImportTest):
+    """an incremental import only re-analyses what changed, and prunes"""
+
+    def import_tree(self, incremental=False):
+        from cadfael.conf import settings
+        from cadfael.modules.inode import import_tree
+        summary = import_tree('test', self.top, incremental)
+        settings.WRITER.flush()
+        return summary
+
+    def inodes(self):
+        """get the stored inodes, by their first path"""
+        return dict(
+            (sorted(inode['paths'])[0], inode)
+            for inode in self.storage.documents('inodes', 'test')
+        )
+
+    def stamp(self, inode):
+        """replace a stored inode's details, so it's seen if it's analysed"""
+        from cadfael.conf import settings
+        settings.WRITER.update_one(
+            { '_id': inode['_id'] }, { '$set': { 'details': STAMP } }
+        )
+        settings.WRITER.flush()
+
+    def test_prune(self):
+        self.write('same', b'same')
+        self.write('changed', b'before')
+        self.write('removed', b'removed')
+        self.write('dir/moved', b'moved')
+        self.write('gone/file', b'gone')
+        self.write('linked', b'linked')
+        os.link(
+            os.path.join(self.top, 'linked'), os.path.join(self.top, 'link')
+        )
+        self.import_tree()
+        for inode in self.inodes().values():
+            self.stamp(inode)
+
+        self.write('changed', b'after, and longer')
+        self.write('added', b'added')
+        os.remove(os.path.join(self.top, 'removed'))
+        os.remove(os.path.join(self.top, 'link'))
+        # renaming changes the ctime of the directory, but not its files
+        os.rename(
+            os.path.join(self.top, 'dir'), os.path.join(self.top, 'renamed')
+        )
+        shutil.rmtree(os.path.join(self.top, 'gone'))
+        self.import_tree(True)
+
+        inodes = self.inodes()
+        self.assertEqual(sorted(inodes), [
+            '/added', '/changed', '/linked', '/renamed', '/renamed/moved',
+            '/same'
+        ])
+        # routes which have gone are dropped from inodes which haven't
+        self.assertEqual(inodes['/linked']['paths'], ['/linked'])
+        self.assertNotIn('seen', inodes['/linked'])
+        self.assertEqual(inodes['/same']['details'], STAMP)
+        self.assertEqual(inodes['/renamed/moved']['details'], STAMP)
+        self.assertEqual(
+            inodes['/renamed/moved']['paths'], ['/renamed/moved']
+        )
+        # re-analysed
+        self.assertEqual(inodes['/changed']['size'], 17)
+        self.assertNotEqual(inodes['/changed']['details'], STAMP)
+
+    def test_unchanged(self):
+        self.write('file', b'data')
+        self.import_tree()
+        before = self.inodes()
+        self.import_tree(True)
+        after = self.inodes()
+        self.assertEqual(sorted(after), sorted(before))
+        for path, inode in after.items():
+            self.assertEqual(inode['paths'], before[path]['paths'])
+            self.assertEqual(inode.get('details'), before[path].get('details'))
+
+
+if __name__ == '__main__':
+    unittest.main()
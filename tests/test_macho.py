@@ -0,0 +1,67 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+import importlib
+
+import genmacho
+from tests.test_import import ImportTest
+
+
+macho = importlib.import_module('cadfael.modules.x-mach-binary')
+
+
+class TestInfo(unittest.TestCase):
+    """get_info raises ValueError for any truncated mach-o"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_truncated(self):
+        data = genmacho.generate(50, 50, is_fat=True)
+        path = os.path.join(self.tmp, 'binary')
+        for size in range(0, len(data), 61):
+            with open(path, 'wb') as f:
+                f.write(data[:size])
+            try:
+                macho.get_info(path)
+            except ValueError:
+                pass
+
+
+class TestTruncated(ImportTest):
+    """a truncated mach-o is recorded as unparseable, not fatal"""
+
+    def test_import(self):
+        from cadfael.conf import settings
+        from cadfael.modules.inode import import_tree
+        settings.ANALYSIS_PROCESSES = 0
+        data = genmacho.macho(100, 100)
+        self.write('binary', data)
+        self.write('truncated', data[:len(data) // 3])
+        summary = import_tree('test', self.top)
+        self.assertEqual(summary['files'], 2)
+        inodes = dict(
+            (inode['paths'][0], inode)
+            for inode in self.storage.documents('inodes', 'test')
+        )
+        analyses = {}
+        for route in ['/binary', '/truncated']:
+            _id = inodes[route]['details']['analyses']['x-mach-binary']
+            analyses[route] = self.storage.get('analyses', [_id])[_id]
+        self.assertIsNone(analyses['/binary']['error'])
+        self.assertNotIn('minhash', analyses['/binary']) # off by default
+        self.assertEqual(len(analyses['/binary']['dylibs']), 8)
+        self.assertIn('malformed', analyses['/truncated']['error'])
+        self.assertEqual(analyses['/truncated']['dylibs'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import unittest
+
+from cadfael.conf import settings
+from cadfael.core import query
+from cadfael.core.similarity import sketch
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+def symbols(start, stop):
+    """get a list of synthetic symbol names"""
+    return ['_sym%u' % i for i in range(start, stop)]
+
+
+@unittest.skipIf(mongomock is None, 'needs mongomock')
+class TestSearch(unittest.TestCase):
+    """queries of analyses, answered with the paths of their content"""
+
+    def setUp(self):
+        self.values = settings.worker()
+        settings.MINHASH = True
+        self.db = mongomock.MongoClient().db
+        self.analysis('app', symbols(0, 500), ['libSystem'], [
+            { 'name': 'com.apple.private.tcc', 'value': True },
+            { 'name': 'groups', 'value': ['a', 'b'] }
+        ])
+        self.analysis('like-app', symbols(0, 450), ['libSystem', 'libfoo'])
+        self.analysis('other', symbols(1000, 1500), ['libfoo'], [
+            { 'name': 'com.apple.private.tcc', 'value': False }
+        ])
+        self.inode('dev1', ['/bin/app', '/bin/app-link'], 'app')
+        self.inode('dev2', ['/bin/app'], 'app')
+        self.inode('dev1', ['/bin/like-app'], 'like-app')
+        self.inode('dev1', ['/bin/other'], 'other')
+        self.inode('dev1', ['/etc/text'], 'text') # never analysed
+
+    def tearDown(self):
+        settings.update(self.values)
+
+    def analysis(self, sha256, undef, dylibs, entitlements=()):
+        """store the analysis of some content"""
+        doc = {
+            '_id': 'x-mach-binary:%s' % sha256,
+            'analyser': 'x-mach-binary',
+            'version': 4,
+            'sha256': sha256,
+            'symbols': { 'undef': undef, 'local': [] },
+            'dylibs': dylibs,
+            'entitlements': list(entitlements)
+        }
+        doc.update(sketch(undef=set(undef)))
+        self.db.analyses.insert_one(doc)
+
+    def inode(self, volname, paths, sha256):
+        """store an inode with content"""
+        self.db.inodes.insert_one({
+            'dev': volname, 'paths': paths, 'details': { 'sha256': sha256 }
+        })
+
+    def search(self, kind, value, extra=None, volname=None):
+        return sorted(query.search(self.db, kind, value, extra, volname))
+
+    def test_imports(self):
+        self.assertEqual(self.search('imports', '_sym400'), [
+            ('dev1', '/bin/app'), ('dev1', '/bin/app-link'),
+            ('dev1', '/bin/like-app'), ('dev2', '/bin/app')
+        ])
+        self.assertEqual(self.search('imports', '_sym400', volname='dev2'), [
+            ('dev2', '/bin/app')
+        ])
+        self.assertEqual(self.search('imports', '_missing'), [])
+
+    def test_dylib(self):
+        self.assertEqual(self.search('dylib', 'libfoo'), [
+            ('dev1', '/bin/like-app'), ('dev1', '/bin/other')
+        ])
+
+    def test_entitlement(self):
+        tcc = 'com.apple.private.tcc'
+        self.assertEqual(self.search('entitlement', tcc, volname='dev1'), [
+            ('dev1', '/bin/app'), ('dev1', '/bin/app-link'),
+            ('dev1', '/bin/other')
+        ])
+        self.assertEqual(
+            self.search('entitlement', tcc, False), [('dev1', '/bin/other')]
+        )
+        # arrays contain the value
+        self.assertEqual(len(self.search('entitlement', 'groups', 'b')), 3)
+        self.assertEqual(self.search('entitlement', 'groups', 'c'), [])
+
+    def test_sha256(self):
+        self.assertEqual(
+            self.search('sha256', 'text'), [('dev1', '/etc/text')]
+        )
+
+    def test_similar(self):
+        self.assertEqual(self.search('similar', 'app'), [
+            ('dev1', '/bin/like-app')
+        ])
+        self.assertEqual(self.search('similar', 'app', 0.95), [])
+        self.assertEqual(self.search('similar', 'text'), [])
+
+    def test_batches(self):
+        size = query.LOOKUP_SIZE
+        query.LOOKUP_SIZE = 1
+        try:
+            self.assertEqual(len(self.search('dylib', 'libSystem')), 4)
+        finally:
+            query.LOOKUP_SIZE = size
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import json
+import unittest
+
+import cadfael.core.signals
+from cadfael.core.signals import receiver
+from tests.test_import import ImportTest
+
+
+def fail_bad(inode, path):
+    """receiver which fails on files called bad"""
+    if os.path.basename(path) == 'bad':
+        raise RuntimeError('receiver failed on %s' % path)
+
+
+class TestResume(ImportTest):
+    """an interrupted import carries on from its journal"""
+
+    def setUp(self):
+        super(TestResume, self).setUp()
+        self.write('a/one', b'one')
+        self.write('a/two', b'two')
+        self.write('b/three', b'three')
+
+    def journal(self):
+        """get the path of the test volume's journal"""
+        from cadfael.modules.inode import journal_path
+        return journal_path('test')
+
+    def paths(self):
+        """get the stored paths"""
+        return sorted(
+            path
+            for inode in self.storage.documents('inodes', 'test')
+            for path in inode['paths']
+        )
+
+    def import_tree(self, resume=False):
+        from cadfael.conf import settings
+        from cadfael.modules.inode import import_tree
+        summary = import_tree('test', self.top, resume=resume)
+        settings.WRITER.flush()
+        return summary
+
+    def test_complete(self):
+        self.import_tree()
+        self.assertFalse(os.path.exists(self.journal()))
+        with self.assertRaises(ValueError):
+            self.import_tree(True)
+
+    def test_skip_done(self):
+        from cadfael.core.journal import Journal
+        journal = Journal(self.journal())
+        journal.create({ 'volume': 'test', 'top': self.top, 'run': None })
+        journal.append({ 'done': os.path.join(self.top, 'a') })
+        journal.close()
+        self.import_tree(True)
+        # a's entries were imported by the run which was interrupted
+        self.assertEqual(self.paths(), ['/a', '/b', '/b/three'])
+        self.assertFalse(os.path.exists(self.journal()))
+
+    def test_other_top(self):
+        from cadfael.core.journal import Journal
+        journal = Journal(self.journal())
+        journal.create({ 'volume': 'test', 'top': self.tmp, 'run': None })
+        journal.close()
+        with self.assertRaises(ValueError):
+            self.import_tree(True)
+
+    def test_interrupted(self):
+        self.write('b/bad', b'bad')
+        hook = receiver(cadfael.core.signals.inode, fmt='-')
+        hook(fail_bad)
+        try:
+            with self.assertRaises(RuntimeError):
+                self.import_tree()
+        finally:
+            cadfael.core.signals.inode.receivers.remove(hook)
+            cadfael.core.signals.inode.dispatch = None
+        with open(self.journal()) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records[0], {
+            'volume': 'test', 'top': self.top, 'run': None
+        })
+        # b can't have been done
+        self.assertNotIn(
+            { 'done': os.path.join(self.top, 'b') }, records[1:]
+        )
+        self.import_tree(True)
+        self.assertEqual(self.paths(), [
+            '/a', '/a/one', '/a/two', '/b', '/b/bad', '/b/three'
+        ])
+        self.assertFalse(os.path.exists(self.journal()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+import importlib
+
+import genmacho
+from tests import use_sqlite
+
+
+dyld = importlib.import_module('cadfael.modules.x-dyld-shared-cache')
+
+# name of the synthetic caches' main files
+CACHE = 'dyld_shared_cache_x86_64'
+
+
+def write_cache(directory, files):
+    """write [(suffix, data)] of a cache to directory; get their paths"""
+    retval = []
+    for suffix, data in files:
+        retval.append(os.path.join(directory, CACHE + suffix))
+        with open(retval[-1], 'wb') as f:
+            f.write(data)
+    return retval
+
+
+def get_parts(path):
+    """get the parts of the cache file at path"""
+    with open(path, 'rb') as f:
+        return dyld.get_parts(f.read(), path)
+
+
+def image(i):
+    """get the install path of a synthetic cache's i'th image"""
+    return '/usr/lib/libcadfael%u.dylib' % i
+
+
+class TestParts(unittest.TestCase):
+    """finding the images of split caches"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def check_split(self, v1):
+        paths = write_cache(
+            self.tmp, genmacho.split_cache(7, 2, 50, 50, v1=v1)
+        )
+        suffixes = [os.path.basename(p)[len(CACHE):] for p in paths]
+        self.assertEqual(
+            suffixes,
+            ['', '.1', '.2', '.symbols'] if v1 else
+            ['', '.01', '.02', '.symbols']
+        )
+        names = [[part.name for part in get_parts(p)] for p in paths]
+        # each file has the images in its mapping, so all are found once
+        self.assertEqual(names, [
+            [image(0), image(3), image(6)],
+            [image(1), image(4)],
+            [image(2), image(5)],
+            []
+        ])
+        with open(paths[1], 'rb') as f:
+            data = f.read()
+        for part in get_parts(paths[1]):
+            self.assertEqual(data[part.offset:part.offset + 4],
+                             b'\xcf\xfa\xed\xfe')
+
+    def test_split(self):
+        self.check_split(False)
+
+    def test_split_v1(self):
+        self.check_split(True)
+
+    def test_single(self):
+        data = genmacho.shared_cache(3, 50, 50)
+        self.assertEqual(
+            [part.name for part in dyld.get_parts(data)],
+            [image(0), image(1), image(2)]
+        )
+
+    def test_mismatched(self):
+        # a subcache from another cache, or without its main cache, has none
+        paths = write_cache(self.tmp, genmacho.split_cache(4, 1, 50, 50))
+        other = dict(genmacho.split_cache(4, 1, 50, 50, seed=1))
+        with open(paths[1], 'wb') as f:
+            f.write(other['.01'])
+        self.assertEqual(get_parts(paths[1]), [])
+        os.remove(paths[0])
+        write_cache(self.tmp, [('.01', other['.01'])])
+        self.assertEqual(get_parts(paths[1]), [])
+
+
+class TestImport(unittest.TestCase):
+    """the images in subcaches are imported as inodes"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.storage = use_sqlite(os.path.join(self.tmp, 'db'))
+        self.storage.create_volume('test')
+        self.top = os.path.join(self.tmp, 'tree') + os.path.sep
+        os.mkdir(self.top)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_import(self):
+        from cadfael.conf import settings
+        from cadfael.modules.inode import import_inodes
+        paths = write_cache(self.top, genmacho.split_cache(5, 2, 50, 50))
+        import_inodes([('test', self.top, p, False) for p in paths])
+        settings.WRITER.flush()
+        inodes = dict(
+            (inode['paths'][0], inode)
+            for inode in self.storage.documents('inodes', 'test')
+        )
+        for i, suffix in enumerate(['', '.01', '.02', '', '.01']):
+            route = '/' + CACHE + suffix + image(i)
+            self.assertIn(route, inodes)
+            self.assertEqual(
+                inodes[route]['container'],
+                inodes['/' + CACHE + suffix]['_id']
+            )
+            _id = inodes[route]['details']['analyses']['x-mach-binary']
+            analysis = self.storage.get('analyses', [_id])[_id]
+            self.assertEqual(len(analysis['dylibs']), 8)
+        self.assertEqual(
+            len([inode for inode in inodes.values() if 'container' in inode]),
+            5
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
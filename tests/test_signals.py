@@ -0,0 +1,71 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import unittest
+
+import cadfael.core.signals
+from cadfael.core.signals import Signal, receiver, lazy_receiver
+from tests.test_import import ImportTest
+
+
+def legacy(inode, path):
+    """receiver from before signals passed content"""
+    inode['details']['legacy'] = path
+    return 'legacy'
+
+
+def current(inode, path, content=None):
+    """receiver which takes the content"""
+    return content
+
+
+def anything(inode, path, **kwargs):
+    """receiver which takes any keyword arguments"""
+    return sorted(kwargs)
+
+
+class TestKeywords(unittest.TestCase):
+    """receivers are only given the keyword arguments they take"""
+
+    def test_receivers(self):
+        signal = Signal(index=('fmt',))
+        receiver(signal, fmt='-')(legacy)
+        receiver(signal, fmt='-')(current)
+        receiver(signal)(anything)
+        lazy_receiver(signal, 'tests.test_signals:legacy', fmt='-')
+        inode = { 'fmt': '-', 'details': {} }
+        self.assertEqual(signal(inode, 'path', content='content'), [
+            (legacy, 'legacy'),
+            (current, 'content'),
+            (anything, ['content']),
+            (legacy, 'legacy')
+        ])
+        self.assertEqual(inode['details']['legacy'], 'path')
+
+
+class TestImport(ImportTest):
+    """a receiver which doesn't take content still works in an import"""
+
+    def setUp(self):
+        super(TestImport, self).setUp()
+        self.receiver = receiver(cadfael.core.signals.inode, fmt='-')
+        self.receiver(legacy)
+
+    def tearDown(self):
+        cadfael.core.signals.inode.receivers.remove(self.receiver)
+        cadfael.core.signals.inode.dispatch = None
+        super(TestImport, self).tearDown()
+
+    def test_import(self):
+        from cadfael.conf import settings
+        from cadfael.modules.inode import import_inodes
+        path = self.write('file', b'data')
+        import_inodes([('test', self.top, path, False)])
+        settings.WRITER.flush()
+        inodes = list(self.storage.documents('inodes', 'test'))
+        self.assertEqual(inodes[0]['details']['legacy'], path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+import importlib
+from datetime import datetime
+
+import genmacho
+from tests import use_sqlite
+
+
+xmach = importlib.import_module('cadfael.modules.x-mach-binary')
+
+# wraps the body of an entitlements plist
+PLIST = b'''<?xml version="1.0" encoding="UTF-8"?>
+<plist version="1.0">
+%s
+</plist>
+'''
+
+
+def parse(entitlements):
+    """parse a signature with an entitlements blob"""
+    return xmach.parse_superblob(
+        genmacho.signature(b'com.example.test', b'ABCDE12345', entitlements)
+    )
+
+
+class TestEntitlements(unittest.TestCase):
+    """parsing of the entitlements in code signatures"""
+
+    def test_entitlements(self):
+        signature = parse(genmacho.ENTITLEMENTS)
+        self.assertEqual(signature['identifier'], 'com.example.test')
+        self.assertEqual(signature['team_id'], 'ABCDE12345')
+        self.assertEqual(signature['entitlements'], [
+            { 'name': 'com.apple.security.app-sandbox', 'value': True },
+            {
+                'name': 'keychain-access-groups',
+                'value': ['ABCDE12345.com.example']
+            }
+        ])
+
+    def test_types(self):
+        signature = parse(PLIST % b'''<dict>
+            <key>data</key><data>
+                AAEC
+                Aw==
+            </data>
+            <key>real</key><real>1.5</real>
+            <key>date</key><date>2020-01-02T03:04:05Z</date>
+            <key>integer</key><integer> 42 </integer>
+            <key>empty</key><string/>
+            <key>array</key><array>
+                <true/><dict><key>a</key><false/></dict>
+            </array>
+        </dict>''')
+        self.assertEqual(signature['entitlements'], [
+            { 'name': 'data', 'value': 'AAECAw==' },
+            { 'name': 'real', 'value': 1.5 },
+            { 'name': 'date', 'value': datetime(2020, 1, 2, 3, 4, 5) },
+            { 'name': 'integer', 'value': 42 },
+            { 'name': 'empty', 'value': '' },
+            {
+                'name': 'array',
+                'value': [True, [{ 'name': 'a', 'value': False }]]
+            }
+        ])
+
+    def test_malformed(self):
+        # the rest of the signature is kept, without entitlements
+        for blob in (
+                b'<plist><dict><key>a</key>', # bad xml
+                PLIST % b'<array><string>a</string></array>', # not a dict
+                PLIST % b'<dict><key>a</key><integer>x</integer></dict>',
+                PLIST % b'<dict><key>a</key><date>today</date></dict>',
+                PLIST % b'<dict><key>a</key><unknown/></dict>'):
+            signature = parse(blob)
+            self.assertEqual(signature['identifier'], 'com.example.test')
+            self.assertIsNone(signature['entitlements'])
+
+
+class TestImport(unittest.TestCase):
+    """signed binaries are imported whatever their entitlements"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.storage = use_sqlite(os.path.join(self.tmp, 'db'))
+        self.storage.create_volume('test')
+        self.top = os.path.join(self.tmp, 'tree') + os.path.sep
+        os.mkdir(self.top)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_malformed(self):
+        from cadfael.conf import settings
+        from cadfael.modules.inode import import_inodes
+        path = os.path.join(self.top, 'bad')
+        with open(path, 'wb') as f:
+            f.write(genmacho.macho(
+                100, 100, entitlements=PLIST % b'<dict><key>a</key><x/></dict>'
+            ))
+        out, _, _ = import_inodes([('test', self.top, path, False)])
+        settings.WRITER.flush()
+        self.assertEqual(out, [(path, '-', os.path.getsize(path))])
+        inodes = list(self.storage.documents('inodes', 'test'))
+        self.assertEqual(len(inodes), 1)
+        _id = inodes[0]['details']['analyses']['x-mach-binary']
+        analysis = self.storage.get('analyses', [_id])[_id]
+        self.assertTrue(analysis['identifier'].startswith('com.example.'))
+        self.assertIsNone(analysis['entitlements'])
+        self.assertEqual(len(analysis['dylibs']), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import unittest
+
+from cadfael.conf import settings
+from cadfael.core.similarity import sketch, estimate
+
+
+def symbols(start, stop):
+    """get a set of synthetic symbol names"""
+    return set('_sym%u' % i for i in range(start, stop))
+
+
+class TestSketch(unittest.TestCase):
+    """MinHash sketches, and the similarity estimated from them"""
+
+    def setUp(self):
+        self.values = settings.worker()
+        settings.MINHASH = True
+
+    def tearDown(self):
+        settings.update(self.values)
+
+    def test_off(self):
+        settings.MINHASH = False
+        self.assertEqual(sketch(undef=symbols(0, 100)), {})
+
+    def test_empty(self):
+        self.assertEqual(sketch(undef=set(), local=set()), {})
+
+    def test_shape(self):
+        result = sketch(undef=symbols(0, 10))
+        self.assertEqual(len(result['minhash']), settings.MINHASH_SIZE)
+        self.assertEqual(len(result['lsh']), settings.MINHASH_BANDS)
+        # few features; most bins are empty, and densified
+        self.assertNotIn(None, result['minhash'])
+
+    def test_bounds(self):
+        a = sketch(undef=symbols(0, 1000))['minhash']
+        same = sketch(undef=symbols(0, 1000))['minhash']
+        self.assertEqual(estimate(a, same), 1.0)
+        self.assertEqual(estimate(a, a[:64]), 0.0)
+        self.assertEqual(estimate([], []), 0.0)
+        # the same names in another set are other features
+        self.assertLess(
+            estimate(a, sketch(local=symbols(0, 1000))['minhash']), 0.1
+        )
+        self.assertLess(
+            estimate(a, sketch(undef=symbols(1000, 2000))['minhash']), 0.1
+        )
+        # jaccard similarity of 1/3; the estimate's standard deviation is
+        # about 0.04 with 128 bins
+        half = estimate(a, sketch(undef=symbols(500, 1500))['minhash'])
+        self.assertGreater(half, 0.2)
+        self.assertLess(half, 0.47)
+        # and estimates are ordered by similarity
+        most = estimate(a, sketch(undef=symbols(100, 1100))['minhash'])
+        self.assertGreater(most, half)
+        self.assertGreaterEqual(most, 0.0)
+        self.assertLessEqual(most, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import struct
+import unittest
+
+import genmacho
+from cadfael.conf import settings
+from cadfael.core import sniff
+from cadfael.core.stats import stats
+from cadfael.core.content import Content
+from tests.test_elf import elf
+
+
+def content(data):
+    """get content of some bytes"""
+    return Content.from_bytes('test', data)
+
+
+def magic_calls():
+    """get (and reset) the number of times libmagic's been asked"""
+    return stats.collect()['stages'].get('magic', [0])[0]
+
+
+class TestSniff(unittest.TestCase):
+    """the kinds of content told from their first bytes"""
+
+    def test_kinds(self):
+        for head, kind in [
+                (genmacho.macho(10, 10)[:sniff.HEAD], 'mach-o'),
+                (genmacho.generate(10, 10, is_fat=True)[:8], 'mach-o'),
+                (elf()[:sniff.HEAD], None), # ET_DYN; a library, or a pie
+                (elf(dynamic=False)[:sniff.HEAD], 'elf-exec'),
+                (b'#!/bin/sh\necho\n', 'shell'),
+                (b'#!/usr/bin/env perl\n', 'perl'),
+                (b'#!/usr/bin/python\n', None),
+                (b'#!/bin/sh\n\x00\x01', None),
+                (b'<?xml version="1.0"?>\n<plist version="1.0">', 'xml-plist'),
+                (b'<?xml version="1.0"?>\n<html>', None),
+                (b'bplist00', 'binary-plist'),
+                (b'\x1f\x8b\x08', 'gzip'),
+                (b'\0' * 257 + b'ustar\x0000', 'tar'),
+                (b'dyld_v1  arm64e', 'dyld-shared-cache'),
+                (b'plain text', None),
+                (b'', None)]:
+            self.assertEqual(sniff.sniff(head), kind, head[:32])
+
+    def test_java(self):
+        # fat mach-o's magic, with a class file's version after it
+        self.assertEqual(
+            sniff.sniff(b'\xca\xfe\xba\xbe' + struct.pack('>I', 52)), None
+        )
+
+    def test_text(self):
+        self.assertTrue(sniff.is_text(b'text\n\ttabbed'))
+        self.assertTrue(sniff.is_text('caf\xe9'.encode('utf-8')[:-1]))
+        self.assertFalse(sniff.is_text(b'\x00binary'))
+        self.assertFalse(sniff.is_text(b'\xff\xfe\xfd\xfc latin-1'))
+
+
+class TestMimeType(unittest.TestCase):
+    """libmagic's asked when sniffing's unsure, or its kind isn't trusted"""
+
+    def setUp(self):
+        self.values = settings.worker()
+        sniff.confirmed.clear()
+        sniff.by_sha256.clear()
+        magic_calls()
+
+    def tearDown(self):
+        settings.update(self.values)
+        sniff.confirmed.clear()
+        sniff.by_sha256.clear()
+
+    def test_confirmed(self):
+        data = genmacho.macho(10, 10)
+        self.assertEqual(
+            sniff.mime_type(content(data)), 'application/x-mach-binary'
+        )
+        self.assertEqual(sniff.confirmed, { 'mach-o': True })
+        self.assertEqual(magic_calls(), 1)
+        # only the first of a kind is checked
+        sniff.mime_type(content(data))
+        self.assertEqual(magic_calls(), 0)
+
+    def test_distrusted(self):
+        # as if libmagic disagreed about the first of the kind
+        sniff.confirmed['shell'] = False
+        data = b'#!/bin/sh\necho\n'
+        self.assertEqual(
+            sniff.mime_type(content(data)), sniff.from_libmagic(content(data))
+        )
+        self.assertEqual(magic_calls(), 2)
+
+    def test_unsure(self):
+        self.assertEqual(
+            sniff.mime_type(content(b'plain text\n')), 'text/plain'
+        )
+        self.assertEqual(magic_calls(), 1)
+        # kinds libmagic doesn't know are never checked
+        self.assertEqual(
+            sniff.mime_type(content(b'dyld_v1  arm64e' + b'\0' * 64)),
+            'application/x-dyld-shared-cache'
+        )
+        self.assertEqual(magic_calls(), 0)
+
+    def test_cache(self):
+        settings.MAGIC_CACHE = 2
+        for sha256 in ['a', 'b', 'a', 'c', 'b']:
+            sniff.mime_type(content(b'plain text\n'), sha256)
+        # b was dropped to make room for c
+        self.assertEqual(magic_calls(), 4)
+        self.assertEqual(list(sniff.by_sha256), ['c', 'b'])
+        settings.MAGIC_CACHE = 0
+        sniff.mime_type(content(b'plain text\n'), 'c')
+        self.assertEqual(magic_calls(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
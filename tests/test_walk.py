@@ -0,0 +1,57 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cadfael.modules.inode import list_tree
+
+
+class TestHardlinks(unittest.TestCase):
+    """each inode is imported once, and other links added to it"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.top = os.path.join(self.tmp, 'tree') + os.path.sep
+        os.makedirs(os.path.join(self.top, 'a', 'b'))
+        self.file = os.path.join(self.top, 'a', 'file')
+        with open(self.file, 'wb') as f:
+            f.write(b'data')
+        with open(os.path.join(self.top, 'other'), 'wb') as f:
+            f.write(b'data')
+        os.link(self.file, os.path.join(self.top, 'link'))
+        os.link(self.file, os.path.join(self.top, 'a', 'b', 'link'))
+        os.symlink(self.file, os.path.join(self.top, 'symlink'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def check_walk(self, threads):
+        args = list(list_tree('test', self.top, threads))
+        routes = sorted(arg[2][len(self.top) - 1:] for arg in args)
+        self.assertEqual(routes, [
+            '/a', '/a/b', '/a/b/link', '/a/file', '/link', '/other',
+            '/symlink'
+        ])
+        ino = os.lstat(self.file).st_ino
+        first = [arg for arg in args if os.lstat(arg[2]).st_ino == ino]
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len([arg for arg in first if len(arg) == 4]), 1)
+        self.assertEqual(
+            [arg[4] for arg in first if len(arg) > 4], [ino, ino]
+        )
+        # everything else is imported in full
+        self.assertEqual(len([arg for arg in args if len(arg) > 4]), 2)
+
+    def test_serial(self):
+        self.check_walk(1)
+
+    def test_parallel(self):
+        self.check_walk(4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# coding: utf-8
+# pylint: disable=W0621,C0103,R0903,C0326
+from __future__ import unicode_literals, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+import genmacho
+from tests import use_sqlite
+from tests.test_import import ImportTest
+
+
+@unittest.skipUnless(
+    hasattr(multiprocessing, 'get_all_start_methods') and
+    'spawn' in multiprocessing.get_all_start_methods(),
+    'needs the spawn start method'
+)
+class TestSpawn(unittest.TestCase):
+    """workers which aren't forked get the settings and analysers"""
+
+    def setUp(self):
+        from cadfael.conf import settings
+        self.tmp = tempfile.mkdtemp()
+        self.method = multiprocessing.get_start_method(allow_none=True)
+        multiprocessing.set_start_method('spawn', force=True)
+        self.values = settings.worker()
+        self.storage = use_sqlite(os.path.join(self.tmp, 'db'))
+        self.storage.create_volume('test')
+        settings.JOURNALS = self.tmp
+        settings.ANALYSIS_PROCESSES = 1
+        settings.DIGESTS = ['sha256', 'md5'] # not the default
+        self.top = os.path.join(self.tmp, 'tree') + os.path.sep
+        os.mkdir(self.top)
+
+    def tearDown(self):
+        from cadfael.conf import settings
+        multiprocessing.set_start_method(self.method, force=True)
+        settings.update(self.values)
+        shutil.rmtree(self.tmp)
+
+    def test_import(self):
+        from cadfael.modules.inode import import_tree
+        with open(os.path.join(self.top, 'binary'), 'wb') as f:
+            f.write(genmacho.macho(100, 100))
+        summary = import_tree('test', self.top)
+        self.assertEqual(summary['files'], 1)
+        inodes = dict(
+            (inode['paths'][0], inode)
+            for inode in self.storage.documents('inodes', 'test')
+        )
+        details = inodes['/binary']['details']
+        self.assertIn('md5', details)
+        _id = details['analyses']['x-mach-binary']
+        analysis = self.storage.get('analyses', [_id])[_id]
+        self.assertEqual(len(analysis['dylibs']), 8)
+
+
+class TestWarm(ImportTest):
+    """fresh imports share the pools from warm_pools"""
+
+    def tearDown(self):
+        from cadfael.core import pool
+        pool.close_pools()
+        super(TestWarm, self).tearDown()
+
+    def test_imports(self):
+        from cadfael.conf import settings
+        from cadfael.core import pool
+        from cadfael.modules.inode import import_tree
+        settings.ANALYSIS_PROCESSES = 1
+        self.write('binary', genmacho.macho(100, 100))
+        for i in range(16):
+            self.write('%02u' % i, b'file %u' % i)
+        workers = pool.warm_pools()
+        self.assertIs(pool.warm_pools(), workers)
+        for volume in ['one', 'two']:
+            self.storage.create_volume(volume)
+            summary = import_tree(volume, self.top)
+            self.assertEqual(summary['files'], 17)
+            self.assertIs(pool.warm, workers)
+            # the kept workers flushed everything at the end of the import
+            inodes = list(self.storage.documents('inodes', volume))
+            self.assertEqual(len(inodes), 17)
+            binary = [i for i in inodes if i['paths'] == ['/binary']][0]
+            self.assertIn('x-mach-binary', binary['details']['analyses'])
+        # incremental imports start pools of their own
+        summary = import_tree('one', self.top, incremental=True)
+        self.assertEqual(summary['files'], 17)
+        self.assertIs(pool.warm, workers)
+        pool.close_pools()
+        self.assertIsNone(pool.warm)
+
+
+if __name__ == '__main__':
+    unittest.main()